@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark per-image working-space conversion with a cold and warm cache
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.color import (prophoto_profile, srgb_profile, to_working_space,
+                           TransformCache)
+from PIL import Image
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-n', '--images', 200, 'number of images to convert', False],
+    ['-s', '--size', 256, 'edge length of each synthetic image', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+
+
+def run(images: list, cold: bool) -> float:
+    """Return mean seconds per image."""
+    cache = TransformCache()
+    start = perf_counter()
+    for im in images:
+        if cold:
+            cache.clear()
+        to_working_space(im, prophoto_profile(), cache=cache)
+    return (perf_counter() - start) / len(images)
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    size = kwargs['size']
+    images = []
+    for i in range(kwargs['images']):
+        im = Image.new('RGB', (size, size), (i % 256, 128, 255 - i % 256))
+        im.info['icc_profile'] = srgb_profile()
+        images.append(im)
+    cold = run(images, cold=True)
+    warm = run(images, cold=False)
+    print('{} images, {}x{} px'.format(len(images), size, size))
+    print('cold cache: {:.3f} ms/image'.format(cold * 1000))
+    print('warm cache: {:.3f} ms/image'.format(warm * 1000))
+    print('speedup:    {:.1f}x'.format(cold / warm))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark previews from large JPEGs with and without reduced decoding
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.derivatives import _scale_to, open_scaled
+from os.path import join
+from PIL import Image
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-r', '--repeat', 5, 'number of previews of each size to time', False],
+    ['-s', '--source', join('tests', 'data', 'src', 'IMG_4107.JPG'),
+        'photograph to enlarge into the test JPEG', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+SIZES = [256, 1024]
+
+
+def full_decode(path: str, longest: int) -> Image.Image:
+    """The previous approach: decode everything, then resample."""
+    with Image.open(path) as im:
+        im.load()
+        return _scale_to(im, longest)
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    with TemporaryDirectory() as tmp:
+        path = join(tmp, '24mp.jpg')
+        # a photograph enlarged to 6000 x 4000 (24MP)
+        with Image.open(kwargs['source']) as im:
+            im.convert('RGB').resize((6000, 4000), Image.BICUBIC).save(
+                path, quality=90)
+        for longest in SIZES:
+            timings = []
+            for approach in (full_decode, open_scaled):
+                start = perf_counter()
+                for i in range(kwargs['repeat']):
+                    if approach is open_scaled:
+                        with open_scaled(path, longest) as im:
+                            _scale_to(im, longest)
+                    else:
+                        approach(path, longest)
+                timings.append((perf_counter() - start) / kwargs['repeat'])
+            print(
+                '{}px: full decode {:.1f}ms, reduced decode {:.1f}ms '
+                '({:.1f}x)'.format(
+                    longest, timings[0] * 1000, timings[1] * 1000,
+                    timings[0] / timings[1]))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
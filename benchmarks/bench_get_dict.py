@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark GetDict.get_dict against the original inspect-based version
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import inspect
+import logging
+from moondog.metadata import (Agent, DescriptiveMetadata, Name, NameType,
+                              RoleTerm, Title, TitleType)
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-n', '--objects', 100000, 'number of metadata objects', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+
+
+def legacy_get_dict(self) -> dict:
+    """GetDict.get_dict as it was before the field schema."""
+    members = inspect.getmembers(self, lambda a: not(inspect.isroutine(a)))
+    members = [a for a in members if (
+        not(a[0].startswith('__') and a[0].endswith('__')))]
+    # skip the class-level schema, which the old version never saw
+    members = [a for a in members if a[0] != '_fields']
+    d = {}
+    for name, value in members:
+        if isinstance(value, str):
+            d[name] = value
+        elif isinstance(value, list):
+            d[name] = []
+            for i, item in enumerate(value):
+                if type(item) in [Agent, Name, Title]:
+                    d[name].append(legacy_get_dict(item))
+                else:
+                    raise NotImplementedError(
+                        'no way: {}'.format(type(item)))
+        elif type(value) in [NameType, RoleTerm, TitleType]:
+            d[name] = value.value
+        else:
+            raise NotImplementedError('nope')
+    return d
+
+
+def build(count: int) -> DescriptiveMetadata:
+    """Build a record holding count agents, names and titles in total."""
+    third = count // 3
+    names = [Name('Photographer {}'.format(i)) for i in range(third)]
+    return DescriptiveMetadata(
+        agents=[Agent(names=[n]) for n in names],
+        titles=[Title('Title {}'.format(i)) for i in range(third)])
+
+
+def time_it(f, m: DescriptiveMetadata) -> tuple:
+    start = perf_counter()
+    d = f(m)
+    return perf_counter() - start, d
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    m = build(kwargs['objects'])
+    legacy, d_legacy = time_it(legacy_get_dict, m)
+    schema, d_schema = time_it(DescriptiveMetadata.get_dict, m)
+    if d_legacy != d_schema:
+        raise RuntimeError('serializations differ')
+    print('{} objects'.format(kwargs['objects']))
+    print('inspect-based get_dict: {:.3f}s'.format(legacy))
+    print('schema-based get_dict:  {:.3f}s'.format(schema))
+    print('speedup:                {:.1f}x'.format(legacy / schema))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark collection index lookups over many synthetic bags
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.index import CollectionIndex
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-b', '--bags', 100000, 'number of bags to index', False],
+    ['-d', '--database', ':memory:', 'SQLite database to build', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    n = kwargs['bags']
+    with CollectionIndex(kwargs['database']) as index:
+        start = perf_counter()
+        for i in range(n):
+            index.add(
+                '/collection/{:07d}'.format(i),
+                {'Original-Filename': 'IMG_{:07d}.JPG'.format(i)},
+                {'agents': [{'names': [
+                    {'full_name': 'Photographer {}'.format(i % 500)}]}],
+                 'keywords': [
+                    {'value': 'term {}'.format((i * 7 + k) % 5000)}
+                    for k in range(10)],
+                 'titles': [{'value': 'Image number {}'.format(i)}]})
+        print('indexed {} bags in {:.2f}s'.format(n, perf_counter() - start))
+        for label, lookup, arg in [
+                ('keyword', index.find_keyword, 'term 1234'),
+                ('agent', index.find_agent, 'Photographer 42'),
+                ('full text', index.search, '"term 1234"')]:
+            start = perf_counter()
+            found = lookup(arg)
+            print('{} lookup: {} bags in {:.2f}ms'.format(
+                label, len(found), (perf_counter() - start) * 1000))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
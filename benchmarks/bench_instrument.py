@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the cost of timing spans, with and without a recorder
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.instrument import PrometheusRecorder, recording, span
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-n', '--spans', 1000000, 'number of spans to time', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+
+
+def bare(n: int) -> float:
+    start = perf_counter()
+    for i in range(n):
+        pass
+    return perf_counter() - start
+
+
+def spans(n: int) -> float:
+    start = perf_counter()
+    for i in range(n):
+        with span('copy', bag='x') as s:
+            s.bytes = i
+    return perf_counter() - start
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    n = kwargs['spans']
+    baseline = bare(n)
+    disabled = spans(n) - baseline
+    with recording(PrometheusRecorder()):
+        enabled = spans(n // 10) * 10 - baseline
+    print('disabled: {:.3f}us per span'.format(disabled / n * 1e6))
+    print('recording (Prometheus totals): {:.3f}us per span'.format(
+        enabled / n * 1e6))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
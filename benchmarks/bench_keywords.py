@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark building keyword-heavy DescriptiveMetadata records
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.metadata import DescriptiveMetadata
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-r', '--records', 1000, 'number of records to build', False],
+    ['-k', '--keywords', 50, 'keywords per record', False],
+    ['-u', '--vocabulary', 2000, 'distinct keyword URIs', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+AUTHORITIES = [
+    'http://vocab.getty.edu/aat/3000{:05d}',
+    'http://id.loc.gov/authorities/subjects/sh85{:06d}',
+    'http://www.wikidata.org/entity/Q{}',
+    'https://example.org/thesaurus/term/{}']
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    vocabulary = [
+        {'value': 'term {}'.format(i),
+         'uri': AUTHORITIES[i % len(AUTHORITIES)].format(i),
+         'lang': 'en'}
+        for i in range(kwargs['vocabulary'])]
+    per_record = kwargs['keywords']
+    ring = vocabulary * (per_record // len(vocabulary) + 2)
+    start = perf_counter()
+    for r in range(kwargs['records']):
+        offset = (r * per_record) % len(vocabulary)
+        keywords = ring[offset:offset + per_record]
+        DescriptiveMetadata(keywords=keywords)
+    elapsed = perf_counter() - start
+    count = kwargs['records'] * per_record
+    print('{} records, {} keywords: {:.3f}s ({:.1f} us/keyword)'.format(
+        kwargs['records'], count, elapsed, elapsed / count * 1e6))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure the memory held by a large corpus of metadata value objects
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import gc
+import logging
+from moondog.metadata import Description, Keyword, Name, Title
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-n', '--objects', 1000000, 'number of metadata objects', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+# a realistic mix: keyword-heavy, drawn from a small vocabulary
+VOCABULARY = [
+    ('cotton', 'http://vocab.getty.edu/aat/300014067'),
+    ('roads', 'http://vocab.getty.edu/aat/300008217'),
+    ('Alabama', 'http://vocab.getty.edu/tgn/7007689'),
+    ('landscapes', 'http://id.loc.gov/authorities/subjects/sh85074443'),
+    ('agriculture', 'http://www.wikidata.org/entity/Q11451')]
+LANGS = ['und', 'en', 'de', 'fr']
+
+
+def build(count: int) -> list:
+    corpus = []
+    for i in range(count):
+        lang = LANGS[i % len(LANGS)]
+        kind = i % 10
+        if kind < 6:
+            value, uri = VOCABULARY[i % len(VOCABULARY)]
+            corpus.append(Keyword(value, uri=uri, lang=lang))
+        elif kind < 8:
+            corpus.append(Name('Photographer {}'.format(i % 500), lang=lang))
+        elif kind == 8:
+            corpus.append(Title('Image {}'.format(i), lang=lang))
+        else:
+            corpus.append(Description(
+                'A picture numbered {}'.format(i), lang=lang))
+    return corpus
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    corpus = build(kwargs['objects'])
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    total = after - before
+    print('{} objects: {:.1f} MiB ({:.0f} bytes/object)'.format(
+        len(corpus), total / 1048576, total / len(corpus)))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
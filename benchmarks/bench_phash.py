@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark near-duplicate queries against many stored perceptual hashes
+
+Fills the bags table of a CollectionIndex on disk with random dhash values
+(only the columns find_similar reads, which is much faster than add()) and
+times CollectionIndex.find_similar at several distances, against a linear
+scan of the same hashes.
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.index import CollectionIndex, HASH_CHUNK_COLUMNS
+from moondog.phash import format_hash, hamming, hash_chunks
+from os.path import join
+import random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-n', '--hashes', 1000000, 'number of stored hashes', False],
+    ['-q', '--queries', 100, 'number of queries to time', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+DISTANCES = (4, 6, 8, 10)
+
+
+def populate(index: CollectionIndex, hashes: list):
+    with index.db:
+        index.db.executemany(
+            'INSERT INTO bags (path, info, perceptual_hash, {}) '
+            'VALUES (?, ?, ?, {})'.format(
+                ', '.join(HASH_CHUNK_COLUMNS),
+                ', '.join('?' * len(HASH_CHUNK_COLUMNS))),
+            (('/bags/{}'.format(i), '{}', format_hash('dhash', h))
+             + tuple(hash_chunks(h))
+             for i, h in enumerate(hashes)))
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    rng = random.Random(4107)
+    hashes = [rng.getrandbits(64) for i in range(kwargs['hashes'])]
+    probes = [
+        hashes[rng.randrange(len(hashes))] ^ (1 << rng.randrange(64))
+        for i in range(kwargs['queries'])]
+    tmp = mkdtemp(prefix='moondog-bench-')
+    try:
+        with CollectionIndex(join(tmp, 'index.sqlite')) as index:
+            start = perf_counter()
+            populate(index, hashes)
+            print('stored {} hashes in {:.1f}s'.format(
+                len(hashes), perf_counter() - start))
+            for distance in DISTANCES:
+                start = perf_counter()
+                found = 0
+                for probe in probes:
+                    found += len(index.find_similar(
+                        format_hash('dhash', probe), distance))
+                elapsed = perf_counter() - start
+                print(
+                    'find_similar: {:.2f}ms per query (distance <= {}, '
+                    '{:.1f} found)'.format(
+                        elapsed / len(probes) * 1000, distance,
+                        found / len(probes)))
+    finally:
+        rmtree(tmp)
+    start = perf_counter()
+    for probe in probes[:3]:
+        [h for h in hashes if hamming(probe, h) <= 8]
+    elapsed = perf_counter() - start
+    print('linear scan: {:.2f}ms per query'.format(elapsed / 3 * 1000))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
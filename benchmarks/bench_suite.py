@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark suite with saved baselines
+
+Synthesizes a corpus (JPEGs, 16-bit TIFFs, a tiled BigTIFF and XMP packets
+with many dc: entries) in a temporary directory, then times each case in a
+fresh process so that its peak RSS is its own. Results can be saved as a
+baseline and later runs compared against it; any case slower, or using
+more memory, than the baseline by more than the tolerance is reported as
+a regression and the script exits with status 1.
+
+A comparison is only meaningful on like hardware and software, so it is
+refused (exit status 2) when the Python or Pillow version, CPU count,
+exiftool availability, scale or repeat count differ from the baseline's;
+--force compares anyway, with a warning. benchmarks/baseline.json is the
+committed baseline; regenerate it on the machine used for comparisons.
+
+    python benchmarks/bench_suite.py -o benchmarks/baseline.json
+    python benchmarks/bench_suite.py -b benchmarks/baseline.json
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+from concurrent.futures import ProcessPoolExecutor
+import json
+from libxmp.consts import XMP_NS_DC
+import logging
+from moondog.images import ImageBag
+from moondog.metadata import DescriptiveMetadata
+import multiprocessing
+from os import makedirs
+from os.path import getsize, join
+import platform
+from PIL import Image
+import PIL
+import resource
+from shutil import rmtree, which
+from statistics import median
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-r', '--repeat', 5, 'timed runs of each case', False],
+    ['-s', '--scale', 1, 'corpus size multiplier', False],
+    ['-k', '--cases', '', 'comma-separated cases to run (default all)',
+        False],
+    ['-o', '--output', '', 'save the results as JSON (e.g. a baseline)',
+        False],
+    ['-b', '--baseline', '', 'compare the results with this saved JSON',
+        False],
+    ['-t', '--tolerance', 0.25,
+        'allowed slowdown or memory growth over the baseline (0.25 = 25%)',
+        False],
+    ['-f', '--force', False,
+        'compare even if the environment differs from the baseline\'s',
+        False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+JPEG_SIZE = (3000, 2000)
+TIFF16_SIZE = (2000, 1500)
+BIGTIFF_SIZE = (4096, 4096)
+# low enough that the BigTIFF is streamed as tiles rather than decoded
+BIGTIFF_MEMORY_LIMIT = 16 * 1024 * 1024
+XMP_SUBJECTS = 2000
+# environment entries that must match for a comparison to mean anything
+COMPARABLE_ENVIRONMENT = (
+    'python', 'pillow', 'cpus', 'exiftool', 'scale', 'repeat')
+_bags = {}
+
+
+class NoMetadata(object):
+    """Stands in for ExifToolPool where exiftool is not installed."""
+
+    def extract(self, path: str) -> tuple:
+        return {'SourceFile': path}, None
+
+
+def _texture(size: tuple) -> Image.Image:
+    """A deterministic RGB image with some photographic-ish detail."""
+    w, h = size
+    bands = [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.effect_mandelbrot(size, (-2.0, -1.0, 1.0, 1.0), 64)]
+    im = Image.merge('RGB', bands)
+    noise = Image.effect_noise((w // 4, h // 4), 32).resize(size)
+    return Image.blend(im, Image.merge('RGB', [noise] * 3), 0.25)
+
+
+def make_xmp_packet(subjects: int) -> str:
+    items = ''.join(
+        '<rdf:li>term {}</rdf:li>'.format(i) for i in range(subjects))
+    return (
+        '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="{}">'
+        '<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Moontown Cotton'
+        '</rdf:li></rdf:Alt></dc:title>'
+        '<dc:creator><rdf:Seq><rdf:li>Tom Elliott</rdf:li></rdf:Seq>'
+        '</dc:creator>'
+        '<dc:rights><rdf:Alt><rdf:li xml:lang="x-default">Copyright 2017 '
+        'Tom Elliott</rdf:li></rdf:Alt></dc:rights>'
+        '<dc:subject><rdf:Bag>{}</rdf:Bag></dc:subject>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        '<?xpacket end="w"?>'.format(XMP_NS_DC, items))
+
+
+def make_properties(subjects: int) -> list:
+    """The (namespace, path, value) triples libxmp yields for the packet."""
+    properties = [
+        (XMP_NS_DC, 'dc:title', ''),
+        (XMP_NS_DC, 'dc:title[1]', 'Moontown Cotton'),
+        (XMP_NS_DC, 'dc:title[1]/?xml:lang', 'x-default'),
+        (XMP_NS_DC, 'dc:creator', ''),
+        (XMP_NS_DC, 'dc:creator[1]', 'Tom Elliott'),
+        (XMP_NS_DC, 'dc:rights', ''),
+        (XMP_NS_DC, 'dc:rights[1]', 'Copyright 2017 Tom Elliott'),
+        (XMP_NS_DC, 'dc:rights[1]/?xml:lang', 'x-default'),
+        (XMP_NS_DC, 'dc:subject', '')]
+    for i in range(1, subjects + 1):
+        properties.append(
+            (XMP_NS_DC, 'dc:subject[{}]'.format(i), 'term {}'.format(i)))
+    return properties
+
+
+def make_corpus(path: str, scale: int) -> dict:
+    """Write the synthetic corpus under path; return its file lists."""
+    corpus = {'jpeg': [], 'tiff16': [], 'bigtiff': [], 'xmp': []}
+    makedirs(path, exist_ok=True)
+    texture = _texture(JPEG_SIZE)
+    for i in range(4 * scale):
+        fn = join(path, 'photo_{}.jpg'.format(i))
+        texture.rotate(i * 90, expand=True).save(fn, quality=90)
+        corpus['jpeg'].append(fn)
+    gray = texture.convert('L').resize(TIFF16_SIZE)
+    for i in range(2 * scale):
+        fn = join(path, 'scan_{}.tif'.format(i))
+        gray.convert('I').point(lambda v: v * 256 + i).convert(
+            'I;16').save(fn)
+        corpus['tiff16'].append(fn)
+    if tifffile is not None:
+        fn = join(path, 'big.tif')
+        tile = numpy.asarray(texture.crop((0, 0, 512, 512)))
+        tiles = (tile for i in range(
+            (BIGTIFF_SIZE[0] // 512) * (BIGTIFF_SIZE[1] // 512)))
+        tifffile.imwrite(
+            fn, tiles, shape=(BIGTIFF_SIZE[1], BIGTIFF_SIZE[0], 3),
+            dtype=numpy.uint8, tile=(512, 512), bigtiff=True,
+            photometric='rgb', metadata=None)
+        corpus['bigtiff'].append(fn)
+    for i in range(10 * scale):
+        fn = join(path, 'packet_{}.xmp'.format(i))
+        with open(fn, 'w', encoding='utf-8') as f:
+            f.write(make_xmp_packet(XMP_SUBJECTS))
+        corpus['xmp'].append(fn)
+    return corpus
+
+
+def _exiftool():
+    if which('exiftool') is None:
+        return NoMetadata()
+    return None
+
+
+def _accession(originals: list, work: str, **options) -> tuple:
+    exiftool = _exiftool()
+    bags = [join(work, 'bag_{}'.format(i)) for i in range(len(originals))]
+    start = perf_counter()
+    for original, bag_path in zip(originals, bags):
+        ImageBag(
+            bag_path, auto_make=True, exiftool=exiftool,
+            **options).accession(original)
+    seconds = perf_counter() - start
+    for bag_path in bags:
+        rmtree(bag_path)
+    return seconds, sum(getsize(p) for p in originals)
+
+
+def case_accession_jpeg(corpus: dict, work: str) -> tuple:
+    return _accession(corpus['jpeg'], work)
+
+
+def case_accession_tiff16(corpus: dict, work: str) -> tuple:
+    return _accession(corpus['tiff16'], work)
+
+
+def case_accession_bigtiff(corpus: dict, work: str) -> tuple:
+    if not corpus['bigtiff']:
+        raise RuntimeError('needs numpy and tifffile')
+    return _accession(
+        corpus['bigtiff'], work, memory_limit=BIGTIFF_MEMORY_LIMIT)
+
+
+def _accessioned(corpus: dict, work: str) -> ImageBag:
+    """A bag accessioned from the first JPEG, made once per process."""
+    try:
+        return _bags[work]
+    except KeyError:
+        im = _bags[work] = ImageBag(
+            join(work, 'bag'), auto_make=True, exiftool=_exiftool())
+        im.accession(corpus['jpeg'][0])
+        return im
+
+
+def case_update(corpus: dict, work: str) -> tuple:
+    """Save a bag whose payload is unchanged (the incremental path)."""
+    im = _accessioned(corpus, work)
+    start = perf_counter()
+    im._update(manifests=True)
+    return perf_counter() - start, 1
+
+
+def case_update_rehash(corpus: dict, work: str) -> tuple:
+    """Save a bag with no known digests, hashing the whole payload."""
+    im = _accessioned(corpus, work)
+    im.digests.entries = {}
+    hashed = im.digests.bytes_hashed
+    start = perf_counter()
+    im._update(manifests=True)
+    return perf_counter() - start, im.digests.bytes_hashed - hashed
+
+
+def case_xmp(corpus: dict, work: str) -> tuple:
+    """DescriptiveMetadata(xmp=...) from packets, including XML parsing."""
+    from libxmp.core import XMPMeta
+    packets = []
+    for fn in corpus['xmp']:
+        with open(fn, 'r', encoding='utf-8') as f:
+            packets.append(f.read())
+    start = perf_counter()
+    for packet in packets:
+        DescriptiveMetadata(xmp=XMPMeta(xmp_str=packet))
+    return perf_counter() - start, len(packets)
+
+
+def case_xmp_properties(corpus: dict, work: str) -> tuple:
+    """The property dispatch behind DescriptiveMetadata(xmp=...)."""
+    properties = make_properties(XMP_SUBJECTS)
+    n = len(corpus['xmp'])
+    start = perf_counter()
+    for i in range(n):
+        DescriptiveMetadata().parse_xmp_properties(properties)
+    return perf_counter() - start, n
+
+
+def _record() -> DescriptiveMetadata:
+    md = DescriptiveMetadata()
+    md.parse_xmp_properties(make_properties(XMP_SUBJECTS))
+    return md
+
+
+def case_get_dict(corpus: dict, work: str) -> tuple:
+    md = _record()
+    n = len(corpus['xmp'])
+    start = perf_counter()
+    for i in range(n):
+        md.get_dict()
+    return perf_counter() - start, n
+
+
+def case_write_json(corpus: dict, work: str) -> tuple:
+    md = _record()
+    n = len(corpus['xmp'])
+    start = perf_counter()
+    for i in range(n):
+        md.write_json(join(work, 'descriptive.json'))
+    return perf_counter() - start, n
+
+
+# case name: (function, unit of throughput)
+CASES = {
+    'accession_jpeg': (case_accession_jpeg, 'MB/s'),
+    'accession_tiff16': (case_accession_tiff16, 'MB/s'),
+    'accession_bigtiff': (case_accession_bigtiff, 'MB/s'),
+    'update': (case_update, 'bags/s'),
+    'update_rehash': (case_update_rehash, 'MB/s'),
+    'xmp': (case_xmp, 'records/s'),
+    'xmp_properties': (case_xmp_properties, 'records/s'),
+    'get_dict': (case_get_dict, 'records/s'),
+    'write_json': (case_write_json, 'records/s'),
+}
+
+
+def run_case(name: str, corpus: dict, work: str, repeat: int) -> dict:
+    """Run one case repeat times; meant to be called in a fresh process."""
+    function, unit = CASES[name]
+    work = join(work, name)
+    makedirs(work, exist_ok=True)
+    # one untimed run to warm caches (and e.g. build the update bag)
+    function(corpus, work)
+    runs = [function(corpus, work) for i in range(repeat)]
+    seconds = [s for s, amount in runs]
+    amount = runs[0][1]
+    if unit == 'MB/s':
+        amount /= 1048576
+    return {
+        'seconds': median(seconds),
+        'min_seconds': min(seconds),
+        'throughput': amount / median(seconds) if median(seconds) else 0.0,
+        'unit': unit,
+        'max_rss': peak_rss()
+    }
+
+
+def peak_rss() -> int:
+    """Peak RSS of this process in bytes.
+
+    VmHWM belongs to the process's own address space, whereas ru_maxrss
+    survives fork and exec and so would report the parent's peak.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def environment_differences(results: dict, baseline: dict) -> list:
+    """Describe every COMPARABLE_ENVIRONMENT entry that differs."""
+    differences = []
+    for key in COMPARABLE_ENVIRONMENT:
+        ours = results['environment'].get(key)
+        theirs = baseline.get('environment', {}).get(key)
+        if ours != theirs:
+            differences.append(
+                '{}: {} here vs {} in the baseline'.format(key, ours, theirs))
+    return differences
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Describe every case that regressed beyond tolerance."""
+    regressions = []
+    for name, result in sorted(results['cases'].items()):
+        try:
+            base = baseline['cases'][name]
+        except KeyError:
+            continue
+        if 'error' in result or 'error' in base:
+            continue
+        for key, label in [('seconds', 'time'), ('max_rss', 'peak RSS')]:
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    '{}: {} {:.3g} vs baseline {:.3g} (+{:.0%})'.format(
+                        name, label, result[key], base[key],
+                        result[key] / base[key] - 1))
+    return regressions
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    names = [n for n in kwargs['cases'].split(',') if n] or list(CASES)
+    for name in names:
+        if name not in CASES:
+            raise ValueError('Unknown case: "{}"'.format(name))
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pillow': PIL.__version__,
+            'cpus': multiprocessing.cpu_count(),
+            'exiftool': which('exiftool') is not None,
+            'scale': kwargs['scale'],
+            'repeat': kwargs['repeat']
+        },
+        'cases': {}
+    }
+    tmp = mkdtemp(prefix='moondog-bench-')
+    try:
+        corpus = make_corpus(join(tmp, 'corpus'), kwargs['scale'])
+        if not results['environment']['exiftool']:
+            print('exiftool not found: accession runs without it')
+        context = multiprocessing.get_context('spawn')
+        for name in names:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                try:
+                    result = executor.submit(
+                        run_case, name, corpus, join(tmp, 'work'),
+                        kwargs['repeat']).result()
+                except Exception as e:
+                    result = {'error': '{}: {}'.format(
+                        type(e).__name__, str(e))}
+            results['cases'][name] = result
+            if 'error' in result:
+                print('{:<20} skipped ({})'.format(name, result['error']))
+            else:
+                print(
+                    '{:<20} {:>9.4f}s {:>10.2f} {:<9} {:>7.1f} MB RSS'
+                    ''.format(
+                        name, result['seconds'], result['throughput'],
+                        result['unit'], result['max_rss'] / 1048576))
+    finally:
+        rmtree(tmp)
+    if kwargs['output']:
+        with open(kwargs['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        del f
+    if kwargs['baseline']:
+        with open(kwargs['baseline'], 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        del f
+        differences = environment_differences(results, baseline)
+        for difference in differences:
+            print('ENVIRONMENT DIFFERS {}'.format(difference))
+        if differences and not kwargs['force']:
+            print(
+                'not comparing with {}: its results are from a different '
+                'environment (use --force to compare anyway)'.format(
+                    kwargs['baseline']))
+            sys.exit(2)
+        if differences:
+            print(
+                'WARNING: comparing across environments; regressions '
+                'reported below may not be real')
+        regressions = compare(results, baseline, kwargs['tolerance'])
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+        print('no regressions against {}'.format(kwargs['baseline']))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
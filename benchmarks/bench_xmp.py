@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark parsing XMP into DescriptiveMetadata
+
+Times the legacy regex parser and the table-driven parser on the same
+property triples, then DescriptiveMetadata(xmp=...) end to end on the
+equivalent packet, which adds XML parsing and property iteration.
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+from libxmp.consts import XMP_NS_DC
+from libxmp.core import XMPMeta
+import logging
+from moondog.metadata import (Agent, Copyright, Description,
+                              DescriptiveMetadata, Keyword, Name, rx_rights,
+                              Title)
+import re
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-r', '--records', 200, 'number of records to parse', False],
+    ['-s', '--subjects', 500, 'dc:subject items per record', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+]
+rx_dcterm = re.compile(
+    r'^dc:(?P<term>[a-z]+)(\[(?P<index>\d+)\])?(/\?(?P<attr>.+))?$')
+
+
+def legacy_parse(properties):
+    """The regex and if/elif dispatch previously used for dc: terms."""
+    creators = []
+    descriptions = []
+    keywords = []
+    rights = []
+    titles = []
+    for p in properties:
+        if p[1] == '':
+            continue
+        m = rx_dcterm.match(p[1])
+        i = m.group('index')
+        i = 0 if i is None else int(i)
+        attr = m.group('attr')
+        if attr is None:
+            if p[2] == '':
+                continue
+        else:
+            lang = 'und' if p[2] == 'x-default' else p[2]
+        term = m.group('term')
+        if term == 'creator':
+            while len(creators) < i + 1:
+                creators.append({})
+            if attr is None:
+                creators[i]['full_name'] = p[2]
+            else:
+                creators[i]['lang'] = lang
+        elif term == 'description':
+            while len(descriptions) < i + 1:
+                descriptions.append({})
+            if attr is None:
+                descriptions[i]['value'] = p[2]
+            else:
+                descriptions[i]['lang'] = lang
+        elif term == 'rights':
+            while len(rights) < i + 1:
+                rights.append({})
+            if attr is None:
+                m = rx_rights.match(p[2])
+                rights[i]['statement'] = p[2]
+                rights[i]['holder'] = Agent(names=[Name(m.group('name'))])
+                rights[i]['years'] = m.group('years')
+            else:
+                rights[i]['lang'] = lang
+        elif term == 'subject':
+            while len(keywords) < i + 1:
+                keywords.append({})
+            if attr is None:
+                keywords[i]['value'] = p[2]
+            else:
+                keywords[i]['lang'] = lang
+        elif term == 'title':
+            while len(titles) < i + 1:
+                titles.append({})
+            if attr is None:
+                titles[i]['title_val'] = p[2]
+            else:
+                titles[i]['lang'] = lang
+    md = DescriptiveMetadata()
+    md.agents.extend([Agent([Name(**c)]) for c in creators if c])
+    md.descriptions.extend([Description(**d) for d in descriptions if d])
+    md.keywords.extend([Keyword(**k) for k in keywords if k])
+    md.copyright.extend([Copyright(**r) for r in rights if r])
+    md.titles.extend([Title(**t) for t in titles if t])
+    return md
+
+
+def make_properties(subjects: int) -> list:
+    properties = [
+        (XMP_NS_DC, 'dc:title', ''),
+        (XMP_NS_DC, 'dc:title[1]', 'Moontown Cotton'),
+        (XMP_NS_DC, 'dc:title[1]/?xml:lang', 'x-default'),
+        (XMP_NS_DC, 'dc:creator', ''),
+        (XMP_NS_DC, 'dc:creator[1]', 'Tom Elliott'),
+        (XMP_NS_DC, 'dc:rights', ''),
+        (XMP_NS_DC, 'dc:rights[1]', 'Copyright 2017 Tom Elliott'),
+        (XMP_NS_DC, 'dc:rights[1]/?xml:lang', 'x-default'),
+        (XMP_NS_DC, 'dc:subject', '')]
+    for i in range(1, subjects + 1):
+        properties.append(
+            (XMP_NS_DC, 'dc:subject[{}]'.format(i), 'term {}'.format(i)))
+    return properties
+
+
+def make_packet(subjects: int) -> str:
+    """An XMP packet that yields the properties of make_properties()."""
+    items = ''.join(
+        '<rdf:li>term {}</rdf:li>'.format(i) for i in range(1, subjects + 1))
+    return (
+        '<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="{}">'
+        '<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Moontown Cotton'
+        '</rdf:li></rdf:Alt></dc:title>'
+        '<dc:creator><rdf:Seq><rdf:li>Tom Elliott</rdf:li></rdf:Seq>'
+        '</dc:creator>'
+        '<dc:rights><rdf:Alt><rdf:li xml:lang="x-default">Copyright 2017 '
+        'Tom Elliott</rdf:li></rdf:Alt></dc:rights>'
+        '<dc:subject><rdf:Bag>{}</rdf:Bag></dc:subject>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        '<?xpacket end="w"?>'.format(XMP_NS_DC, items))
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    records = kwargs['records']
+    properties = make_properties(kwargs['subjects'])
+    packet = make_packet(kwargs['subjects'])
+    start = perf_counter()
+    for r in range(records):
+        legacy_parse(properties)
+    legacy = perf_counter() - start
+    start = perf_counter()
+    for r in range(records):
+        DescriptiveMetadata().parse_xmp_properties(properties)
+    table = perf_counter() - start
+    start = perf_counter()
+    for r in range(records):
+        DescriptiveMetadata(xmp=XMPMeta(xmp_str=packet))
+    end_to_end = perf_counter() - start
+    print('{} records x {} properties'.format(records, len(properties)))
+    print('legacy regex parser: {:.3f}s'.format(legacy))
+    print('table-driven parser: {:.3f}s'.format(table))
+    print('parse_xmp end to end: {:.3f}s'.format(end_to_end))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Accession many images in parallel
+"""
+
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from glob import glob
+import logging
+from moondog.images import (accession_in_progress, DuplicateOriginal,
+                            ImageBag, SIDECAR_DIGEST)
+from moondog.index import CollectionIndex
+from moondog.instrument import recording
+from moondog.manifests import hash_file
+from os import cpu_count, scandir
+from os.path import (basename, exists, expanduser, expandvars, getsize, isdir,
+                     join, normpath, realpath, splitext)
+from time import perf_counter
+import traceback
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {
+    '.bmp', '.gif', '.jp2', '.jpeg', '.jpg', '.pcd', '.png', '.psd', '.tif',
+    '.tiff'}
+
+
+class BatchSummary(object):
+    """Throughput and outcome of a batch accession.
+
+    Originals found to be duplicates are listed apart from those
+    accessioned, and are left out of the throughput figures.
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.duplicates = []
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def files(self) -> int:
+        return len(self.succeeded) + len(self.duplicates) + len(self.failed)
+
+    @property
+    def files_per_second(self) -> float:
+        if self.seconds == 0.0:
+            return 0.0
+        return len(self.succeeded) / self.seconds
+
+    @property
+    def mb_per_second(self) -> float:
+        if self.seconds == 0.0:
+            return 0.0
+        return self.bytes / 1048576 / self.seconds
+
+    def add(self, result: dict):
+        if result['error'] is not None:
+            self.failed.append(result)
+        elif result.get('duplicate_of') is not None:
+            self.duplicates.append(result)
+        else:
+            self.succeeded.append(result)
+            self.bytes += result['bytes']
+
+    def __str__(self):
+        return (
+            '{} files accessioned, {} duplicates, {} failed in {:.2f}s '
+            '({:.2f} files/s, {:.2f} MB/s)'
+            ''.format(
+                len(self.succeeded), len(self.duplicates), len(self.failed),
+                self.seconds,
+                self.files_per_second, self.mb_per_second))
+
+
+def find_originals(sources: list, extensions: set = IMAGE_EXTENSIONS) -> list:
+    """Expand directories and glob patterns into a sorted list of images."""
+    found = set()
+    for source in sources:
+        source = expanduser(expandvars(source))
+        if isdir(source):
+            candidates = _walk_files(source)
+        else:
+            candidates = glob(source, recursive=True)
+        for path in candidates:
+            if splitext(path)[1].lower() in extensions:
+                found.add(realpath(normpath(path)))
+    return sorted(found)
+
+
+def _walk_files(path: str):
+    for entry in scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk_files(entry.path)
+        elif entry.is_file():
+            yield entry.path
+
+
+def plan_bags(originals: list, destination: str) -> list:
+    """Pair each original with a bag path, disambiguating repeated names.
+
+    Names already taken in destination are skipped too, unless the bag
+    there is part way through accessioning the same original, so that a
+    re-run resumes it.
+    """
+    destination = realpath(expanduser(expandvars(normpath(destination))))
+    planned = set()
+    jobs = []
+    for original in originals:
+        stem = splitext(basename(original))[0]
+        bag_path = join(destination, stem)
+        count = 1
+        while bag_path in planned or (
+                exists(bag_path)
+                and accession_in_progress(bag_path) != original):
+            count += 1
+            bag_path = join(destination, '{}-{}'.format(stem, count))
+        planned.add(bag_path)
+        jobs.append((original, bag_path))
+    return jobs
+
+
+def accession_one(
+    original: str,
+    bag_path: str,
+    index: str = None,
+    dedup: str = None,
+    perceptual_hash: str = None,
+    working_profile: bytes = None,
+    timings: bool = False
+) -> dict:
+    """Accession a single original, trapping any error it raises.
+
+    With dedup, the original is looked up in the index before any bag is
+    made; a duplicate skipped under dedup='skip' leaves no bag behind. Its
+    result names the existing bag in duplicate_of, as do duplicates that
+    were linked or pointed at. If an earlier run was interrupted while
+    accessioning original into bag_path, that accession is resumed.
+    working_profile, if given, is the ICC profile masters are converted
+    into (see moondog.masters.generate_master). With timings, the result's
+    spans lists the timing spans recorded (see moondog.instrument).
+    """
+    result = {
+        'original': original,
+        'bag': bag_path,
+        'bytes': 0,
+        'seconds': 0.0,
+        'error': None,
+        'duplicate_of': None
+    }
+    start = perf_counter()
+    if index is not None:
+        index = CollectionIndex(index)
+    if timings:
+        result['spans'] = []
+    try:
+        result['bytes'] = getsize(original)
+        resuming = accession_in_progress(bag_path) is not None
+        digest = None
+        if dedup is not None and not resuming:
+            digest = hash_file(original, [SIDECAR_DIGEST])[SIDECAR_DIGEST]
+            existing = index.find_original(digest)
+            if dedup == 'skip' and existing is not None:
+                raise DuplicateOriginal(original, existing)
+        im = ImageBag(
+            bag_path, auto_make=not resuming, dedup=dedup, index=index,
+            perceptual_hash=perceptual_hash, working_profile=working_profile)
+        if timings:
+            with recording(result['spans'].append):
+                im.accession(original, digest)
+        else:
+            im.accession(original, digest)
+        result['duplicate_of'] = im.components['original'].get('source_bag')
+    except DuplicateOriginal as e:
+        result['bag'] = None
+        result['duplicate_of'] = e.existing
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, str(e))
+        logger.debug(traceback.format_exc())
+    finally:
+        if index is not None:
+            index.close()
+    result['seconds'] = perf_counter() - start
+    return result
+
+
+def accession_batch(
+    sources: list,
+    destination: str,
+    workers: int = None,
+    index: str = None,
+    dedup: str = None,
+    perceptual_hash: str = None,
+    working_profile: bytes = None,
+    recorder=None
+) -> BatchSummary:
+    """Accession every image found in sources into bags under destination.
+
+    Each original is handled in its own worker process; a failure is
+    recorded in the summary and does not interrupt the rest of the batch.
+    With an index path, each worker adds its new bag to that
+    CollectionIndex, and with dedup (see ImageBag.accession) checks the
+    index for the original first, so duplicates are caught within the
+    batch too once their first copy has finished. perceptual_hash
+    ('dhash' or 'phash') records a hash of each original for
+    near-duplicate searches, and masters are converted into
+    working_profile when one is given. recorder, if given, is called in
+    this process with every timing span recorded by the workers.
+    """
+    if workers is None:
+        workers = cpu_count() or 1
+    jobs = plan_bags(find_originals(sources), destination)
+    if dedup is not None and index is None:
+        raise ValueError('dedup requires a collection index')
+    if index is not None:
+        # create the database up front so the workers do not race to
+        CollectionIndex(index).close()
+    summary = BatchSummary()
+    start = perf_counter()
+    timings = recorder is not None
+    if workers == 1:
+        results = (
+            accession_one(
+                original, bag_path, index, dedup, perceptual_hash,
+                working_profile, timings)
+            for original, bag_path in jobs)
+        for result in results:
+            summary.add(_log_result(_record_spans(result, recorder)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    accession_one, original, bag_path, index, dedup,
+                    perceptual_hash, working_profile, timings)
+                for original, bag_path in jobs]
+            for future in as_completed(futures):
+                summary.add(_log_result(
+                    _record_spans(future.result(), recorder)))
+    summary.seconds = perf_counter() - start
+    return summary
+
+
+def _record_spans(result: dict, recorder) -> dict:
+    for record in result.pop('spans', ()):
+        recorder(record)
+    return result
+
+
+def _log_result(result: dict) -> dict:
+    if result['bag'] is None:
+        logger.info(
+            'skipped {}: already in {}'
+            ''.format(result['original'], result['duplicate_of']))
+    elif result['error'] is None:
+        logger.info(
+            'accessioned {} as {} in {:.2f}s'
+            ''.format(result['original'], result['bag'], result['seconds']))
+    else:
+        logger.error(
+            'failed to accession {}: {}'
+            ''.format(result['original'], result['error']))
+    return result
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Colour management for masters
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+from io import BytesIO
+import logging
+from PIL import Image, ImageCms
+import struct
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTENT = ImageCms.Intent.PERCEPTUAL
+TRANSFORM_CACHE_SIZE = 64
+# modes ImageCms can convert to an RGB working space: source mode -> target
+CONVERTIBLE_MODES = {
+    'RGB': 'RGB',
+    'RGBA': 'RGBA',
+    'CMYK': 'RGB'
+}
+# ROMM RGB (ProPhoto) colorants, adapted to D50, and its 1.8 gamma
+PROPHOTO_COLORANTS = (
+    (0.797760, 0.288071, 0.000000),
+    (0.135185, 0.711843, 0.000000),
+    (0.031349, 0.000086, 0.825104))
+D50 = (0.964203, 1.000000, 0.824905)
+
+
+def _s15f16(v: float) -> bytes:
+    return struct.pack('>i', int(round(v * 65536)))
+
+
+def _xyz_tag(xyz: tuple) -> bytes:
+    return b'XYZ \0\0\0\0' + b''.join(_s15f16(v) for v in xyz)
+
+
+def _text_description_tag(text: str) -> bytes:
+    ascii = text.encode('ascii') + b'\0'
+    return (
+        b'desc\0\0\0\0' + struct.pack('>I', len(ascii)) + ascii
+        + struct.pack('>II', 0, 0) + struct.pack('>HB', 0, 0) + b'\0' * 67)
+
+
+@lru_cache(maxsize=1)
+def prophoto_profile() -> bytes:
+    """Return an ICC v2 matrix/TRC profile for ProPhoto (ROMM) RGB."""
+    gamma = b'curv\0\0\0\0' + struct.pack('>IH', 1, int(1.8 * 256)) + b'\0\0'
+    tags = [
+        (b'desc', _text_description_tag('ProPhoto RGB (moondog)')),
+        (b'cprt', b'text\0\0\0\0No copyright, use freely\0'),
+        (b'wtpt', _xyz_tag(D50)),
+        (b'rXYZ', _xyz_tag(PROPHOTO_COLORANTS[0])),
+        (b'gXYZ', _xyz_tag(PROPHOTO_COLORANTS[1])),
+        (b'bXYZ', _xyz_tag(PROPHOTO_COLORANTS[2])),
+        (b'rTRC', gamma),
+        (b'gTRC', gamma),
+        (b'bTRC', gamma)]
+    offset = 128 + 4 + 12 * len(tags)
+    table = struct.pack('>I', len(tags))
+    data = b''
+    for sig, body in tags:
+        table += sig + struct.pack('>II', offset + len(data), len(body))
+        data += body + b'\0' * (-len(body) % 4)
+    size = offset + len(data)
+    header = (
+        struct.pack('>I', size) + b'\0\0\0\0' + struct.pack('>I', 0x02100000)
+        + b'mntrRGB XYZ ' + struct.pack('>6H', 2018, 1, 1, 0, 0, 0)
+        + b'acsp' + b'\0' * 24 + struct.pack('>I', 0)
+        + b''.join(_s15f16(v) for v in D50) + b'\0' * 48)
+    return header + table + data
+
+
+@lru_cache(maxsize=1)
+def srgb_profile() -> bytes:
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+
+# working spaces masters can be converted into, by name
+WORKING_SPACES = {
+    'prophoto': prophoto_profile,
+    'srgb': srgb_profile
+}
+
+
+def working_profile(name: str) -> bytes:
+    """Return the ICC profile of a named working space, or None for 'none'."""
+    if name == 'none':
+        return None
+    try:
+        return WORKING_SPACES[name]()
+    except KeyError:
+        raise ValueError(
+            'unknown working space {}: expected one of {}'.format(
+                repr(name), ', '.join(sorted(WORKING_SPACES) + ['none'])))
+
+
+def profile_digest(profile: bytes) -> str:
+    return hashlib.sha256(profile).hexdigest()
+
+
+class TransformCache(object):
+    """A bounded LRU of built ImageCms transforms.
+
+    Keys are (source profile digest, target profile digest, input mode,
+    output mode, intent), so images that embed the same profile share one
+    transform however many of them are processed.
+    """
+
+    def __init__(self, maxsize: int = TRANSFORM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._transforms = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._transforms)
+
+    def clear(self):
+        with self._lock:
+            self._transforms.clear()
+
+    def get(
+        self,
+        source: bytes,
+        target: bytes,
+        in_mode: str,
+        out_mode: str,
+        intent: int = DEFAULT_INTENT
+    ) -> ImageCms.ImageCmsTransform:
+        key = (
+            profile_digest(source), profile_digest(target), in_mode,
+            out_mode, int(intent))
+        with self._lock:
+            try:
+                transform = self._transforms[key]
+            except KeyError:
+                pass
+            else:
+                self._transforms.move_to_end(key)
+                self.hits += 1
+                return transform
+        transform = ImageCms.buildTransform(
+            ImageCms.ImageCmsProfile(BytesIO(source)),
+            ImageCms.ImageCmsProfile(BytesIO(target)),
+            in_mode, out_mode, renderingIntent=intent)
+        with self._lock:
+            self.misses += 1
+            self._transforms[key] = transform
+            while len(self._transforms) > self.maxsize:
+                self._transforms.popitem(last=False)
+        return transform
+
+
+transforms = TransformCache()
+
+
+def to_working_space(
+    im: Image.Image,
+    working_profile: bytes,
+    intent: int = DEFAULT_INTENT,
+    cache: TransformCache = transforms
+) -> Image.Image:
+    """Convert im into the working space, assigning sRGB if it has no profile.
+
+    Images in modes ImageCms cannot convert are returned unchanged.
+    """
+    try:
+        out_mode = CONVERTIBLE_MODES[im.mode]
+    except KeyError:
+        logger.warning(
+            'cannot convert mode {} image to working space; leaving its '
+            'colour untouched'.format(im.mode))
+        return im
+    source = im.info.get('icc_profile') or srgb_profile()
+    transform = cache.get(source, working_profile, im.mode, out_mode, intent)
+    converted = transform.apply(im)
+    converted.info = dict(im.info)
+    converted.info['icc_profile'] = working_profile
+    return converted
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Access derivatives generated from a single decode of the master
+"""
+
+import json
+import logging
+from math import ceil
+from moondog.color import srgb_profile, to_working_space
+from os import makedirs
+from os.path import join
+from PIL import Image
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+# component name: longest side in pixels
+DEFAULT_SIZES = {
+    'access': 2048,
+    'thumbnail': 256
+}
+DEFAULT_QUALITY = 85
+DEFAULT_TILE_SIZE = 512
+IIIF_CONTEXT = 'http://iiif.io/api/image/2/context.json'
+IIIF_PROFILE = 'http://iiif.io/api/image/2/level0.json'
+
+
+def generate_derivatives(
+    master: str,
+    destination: str,
+    sizes: dict = DEFAULT_SIZES,
+    pyramid: bool = False,
+    tiles: bool = False,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    quality: int = DEFAULT_QUALITY
+) -> dict:
+    """Write derivatives of master into destination, decoding it only once.
+
+    sizes maps component names to the longest side, in pixels, of a JPEG
+    to write as <name>.jpg; sizes are made largest first, each from the
+    one before, using Image.reduce for the integer part of the scaling.
+    pyramid adds pyramid.tif, a tiled TIFF whose reduced resolutions are
+    stored as SubIFDs (this needs tifffile), and tiles adds a static IIIF
+    level 0 tile tree under tiles/. All derivatives are 8-bit sRGB.
+
+    Returns {component name: {'filename': ..., 'dimensions': 'WxH'}}.
+    """
+    components = {}
+    if pyramid or tiles or not sizes:
+        longest = None
+    else:
+        longest = max(sizes.values())
+    with open_scaled(master, longest) as im:
+        base = _web_image(im)
+    im = base
+    for name, longest in sorted(
+            sizes.items(), key=lambda item: item[1], reverse=True):
+        im = _scale_to(im, longest)
+        filename = '{}.jpg'.format(name)
+        im.save(
+            join(destination, filename), format='JPEG', quality=quality,
+            progressive=True, optimize=True, icc_profile=srgb_profile())
+        components[name] = _component(filename, im)
+    if pyramid:
+        components['pyramid'] = _component(
+            _write_pyramid(base, destination, tile_size), base)
+    if tiles:
+        components['tiles'] = _component(
+            _write_iiif_tiles(base, destination, tile_size, quality), base)
+    return components
+
+
+def open_scaled(path: str, longest: int = None) -> Image.Image:
+    """Open and decode path, at no more than about twice longest if given.
+
+    JPEGs are decoded with draft(), which has libjpeg scale the DCT by
+    1/2, 1/4 or 1/8 while decoding, so a preview never needs the full
+    resolution raster. Other formats are decoded in full and shrunk with
+    reduce() where the mode allows. Either way the result is at least
+    longest pixels on its longest side, leaving the final resampling to
+    the caller.
+    """
+    im = Image.open(path)
+    if longest is None:
+        im.load()
+        return im
+    factor = max(im.width, im.height) // longest
+    if factor < 2:
+        im.load()
+        return im
+    if im.format == 'JPEG':
+        scale = max(im.width, im.height) / longest
+        im.draft(im.mode, (
+            max(1, int(im.width / scale)), max(1, int(im.height / scale))))
+        im.load()
+        return im
+    im.load()
+    try:
+        reduced = im.reduce(factor)
+    except ValueError:
+        # e.g. I;16, which reduce() does not support
+        return im
+    reduced.info = dict(im.info)
+    im.close()
+    return reduced
+
+
+def make_preview(
+    src: str,
+    dst: str,
+    longest: int,
+    quality: int = DEFAULT_QUALITY
+) -> tuple:
+    """Write an sRGB JPEG preview of src no more than longest pixels wide.
+
+    Returns the preview's (width, height).
+    """
+    with open_scaled(src, longest) as im:
+        im = _scale_to(_web_image(im), longest)
+    im.save(
+        dst, format='JPEG', quality=quality, progressive=True, optimize=True,
+        icc_profile=srgb_profile())
+    return im.size
+
+
+def _component(filename: str, im: Image.Image) -> dict:
+    return {
+        'filename': filename,
+        'dimensions': '{}x{}'.format(im.width, im.height)
+    }
+
+
+def _web_image(im: Image.Image) -> Image.Image:
+    """Return im as 8-bit RGB (or L) in sRGB."""
+    if im.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        im = im.point(lambda v: v * (1 / 256)).convert('L')
+    elif im.mode in ('RGB', 'RGBA', 'CMYK') and im.info.get('icc_profile'):
+        im = to_working_space(im, srgb_profile())
+    if im.mode not in ('L', 'RGB'):
+        im = im.convert('RGB')
+    return im
+
+
+def _scale_to(im: Image.Image, longest: int) -> Image.Image:
+    """Scale im down so its longest side is at most longest pixels."""
+    factor = max(im.width, im.height) / longest
+    if factor <= 1:
+        return im
+    size = (
+        max(1, round(im.width / factor)), max(1, round(im.height / factor)))
+    # reduce() by whole factors first, leaving at least 2x for resampling
+    whole = int(factor // 2)
+    if whole > 1:
+        im = im.reduce(whole)
+    return im.resize(size, Image.LANCZOS)
+
+
+def _levels(im: Image.Image, tile_size: int) -> list:
+    """im and halvings of it until the whole image fits in one tile."""
+    levels = [im]
+    while max(levels[-1].width, levels[-1].height) > tile_size:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def _write_pyramid(im: Image.Image, destination: str, tile_size: int) -> str:
+    if tifffile is None:
+        raise RuntimeError(
+            'pyramidal TIFF derivatives require numpy and tifffile')
+    filename = 'pyramid.tif'
+    levels = _levels(im, tile_size)
+    photometric = 'minisblack' if im.mode == 'L' else 'rgb'
+    with tifffile.TiffWriter(
+            join(destination, filename), bigtiff=True) as tif:
+        for i, level in enumerate(levels):
+            kwargs = {}
+            if i == 0:
+                kwargs['subifds'] = len(levels) - 1
+                kwargs['iccprofile'] = srgb_profile()
+            else:
+                kwargs['subfiletype'] = 1
+            tif.write(
+                numpy.asarray(level), tile=(tile_size, tile_size),
+                photometric=photometric, compression='jpeg', metadata=None,
+                **kwargs)
+    return filename
+
+
+def _write_iiif_tiles(
+    im: Image.Image,
+    destination: str,
+    tile_size: int,
+    quality: int
+) -> str:
+    """Write a static IIIF Image API 2 (level 0) tile tree and info.json."""
+    dirname = 'tiles'
+    root = join(destination, dirname)
+    levels = _levels(im, tile_size)
+    scale_factors = [2 ** i for i in range(len(levels))]
+    for scale, level in zip(scale_factors, levels):
+        region_size = tile_size * scale
+        for y in range(0, im.height, region_size):
+            for x in range(0, im.width, region_size):
+                w = min(region_size, im.width - x)
+                h = min(region_size, im.height - y)
+                tile = level.crop((
+                    x // scale, y // scale,
+                    x // scale + ceil(w / scale),
+                    y // scale + ceil(h / scale)))
+                path = join(
+                    root, '{},{},{},{}'.format(x, y, w, h),
+                    '{},'.format(tile.width), '0')
+                makedirs(path, exist_ok=True)
+                tile.save(
+                    join(path, 'default.jpg'), format='JPEG',
+                    quality=quality)
+    # whole-image sizes, so viewers need no tile for an overview
+    for level in levels:
+        path = join(root, 'full', '{},'.format(level.width), '0')
+        makedirs(path, exist_ok=True)
+        level.save(join(path, 'default.jpg'), format='JPEG', quality=quality)
+    info = {
+        '@context': IIIF_CONTEXT,
+        '@id': dirname,
+        'protocol': 'http://iiif.io/api/image',
+        'profile': [IIIF_PROFILE],
+        'width': im.width,
+        'height': im.height,
+        'sizes': [
+            {'width': level.width, 'height': level.height}
+            for level in reversed(levels)],
+        'tiles': [{'width': tile_size, 'scaleFactors': scale_factors}]
+    }
+    with open(join(root, 'info.json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=4, sort_keys=True)
+    del f
+    return dirname
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-lived ExifTool sessions shared across accessions
+"""
+
+from base64 import b64decode
+import exiftool
+from exiftool import ExifTool
+import logging
+from os import getpid, read
+from queue import Queue
+from threading import Lock
+import weakref
+
+logger = logging.getLogger(__name__)
+
+XMP_PACKET_TAG = 'XMP:XMP'
+# every tag plus the raw XMP packet; -b is needed for the packet, so the
+# embedded images it would also pull in are excluded: the Preview group
+# covers thumbnails, preview TIFFs and maker note previews, MPF the other
+# frames of multi-picture (MPO) files and Trailer anything after the image
+EXTRACT_ARGS = (
+    '-b', '-All', '-XMP', '--Preview:All', '--Trailer:All',
+    '--MPF:MPImage*', '--ThumbnailImage', '--PreviewImage', '--JpgFromRaw',
+    '--OtherImage')
+# binary values larger than this (in bytes) that get past the exclusions
+# are replaced by exiftool's usual placeholder rather than kept as base64
+BINARY_LIMIT = 1024
+BINARY_PLACEHOLDER = '(Binary data {} bytes, use -b option to extract)'
+
+
+class ExifToolCrash(RuntimeError):
+    """The exiftool subprocess died while handling a request."""
+
+
+class ExifToolSession(ExifTool):
+    """An ExifTool that notices when its subprocess has gone away.
+
+    The upstream execute() loops forever on an exhausted pipe; here EOF and
+    a dead process are turned into ExifToolCrash so the pool can restart.
+    """
+
+    def execute(self, *params):
+        if not self.running or self._process.poll() is not None:
+            raise ExifToolCrash('exiftool process is not running')
+        try:
+            self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise ExifToolCrash(str(e))
+        output = b""
+        fd = self._process.stdout.fileno()
+        while not output[-32:].strip().endswith(exiftool.sentinel):
+            block = read(fd, exiftool.block_size)
+            if not block:
+                raise ExifToolCrash('exiftool closed its output')
+            output += block
+        return output.strip()[:-len(exiftool.sentinel)]
+
+    def terminate(self):
+        if self.running and self._process.poll() is not None:
+            self.kill()
+        ExifTool.terminate(self)
+
+    def kill(self):
+        """Discard a session whose process may already be dead."""
+        if not self.running:
+            return
+        try:
+            self._process.kill()
+            self._process.communicate()
+        except OSError:
+            pass
+        del self._process
+        self.running = False
+
+
+class ExifToolPool(object):
+    """A small pool of persistent exiftool processes.
+
+    Sessions are started on first use and reused for every subsequent
+    request, so the cost of forking perl is paid once per session rather
+    than once per image. A session that crashes is replaced and the request
+    retried once.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        executable: str = None
+    ):
+        if size < 1:
+            raise ValueError('ExifToolPool size must be at least 1')
+        self.size = size
+        self.executable = executable
+        self._idle = Queue()
+        self._sessions = []
+        self._lock = Lock()
+        self._closed = False
+        for i in range(size):
+            self._idle.put(None)
+        # runs on close(), when the pool is collected, or at exit, whichever
+        # comes first; it must not hold a reference to the pool itself
+        self._finalizer = weakref.finalize(
+            self, _terminate_sessions, self._sessions, self._lock, getpid())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_metadata(self, path: str) -> dict:
+        return self.execute_json(path)[0]
+
+    def extract(self, path: str) -> tuple:
+        """Return (metadata, XMP packet or None) for the file at path.
+
+        EXIF, IPTC, ICC and the raw XMP packet come out of the same
+        exiftool pass, so the file is not opened again to read its XMP.
+        Embedded images are left out (see EXTRACT_ARGS and elide_binary).
+        """
+        meta, xmp = split_xmp(self.execute_json(*(EXTRACT_ARGS + (path,)))[0])
+        return elide_binary(meta), xmp
+
+    def execute_json(self, *params) -> list:
+        session = self._acquire()
+        try:
+            try:
+                return session.execute_json(*params)
+            except ExifToolCrash as e:
+                logger.warning(
+                    'restarting crashed exiftool session: {}'.format(str(e)))
+                self._discard(session)
+                session = None
+                session = self._start()
+                return session.execute_json(*params)
+        except ExifToolCrash:
+            self._discard(session)
+            session = None
+            raise
+        finally:
+            # an empty slot (None) is filled lazily by the next request
+            self._idle.put(session)
+
+    def close(self):
+        """Terminate every session; the pool cannot be used afterwards."""
+        with self._lock:
+            self._closed = True
+        self._finalizer()
+
+    def _acquire(self) -> ExifToolSession:
+        if self._closed:
+            raise RuntimeError('ExifToolPool has been closed')
+        session = self._idle.get()
+        if session is None:
+            try:
+                session = self._start()
+            except BaseException:
+                self._idle.put(None)
+                raise
+        return session
+
+    def _start(self) -> ExifToolSession:
+        session = ExifToolSession(self.executable)
+        session.start()
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _discard(self, session: ExifToolSession):
+        session.kill()
+        with self._lock:
+            self._sessions.remove(session)
+
+
+def _terminate_sessions(sessions: list, lock: Lock, pid: int):
+    with lock:
+        running = list(sessions)
+        del sessions[:]
+    if getpid() != pid:
+        # inherited through fork: the processes belong to the parent, so
+        # forget them without sending anything down their pipes
+        for session in running:
+            session.running = False
+        return
+    for session in running:
+        try:
+            session.terminate()
+        except (OSError, ValueError):
+            session.kill()
+
+
+def split_xmp(meta: dict) -> tuple:
+    """Remove the XMP packet from exiftool JSON; return (meta, packet)."""
+    xmp = meta.pop(XMP_PACKET_TAG, None)
+    if xmp is not None:
+        if xmp.startswith('base64:'):
+            xmp = b64decode(xmp[7:]).decode('utf-8')
+        if not xmp.strip():
+            xmp = None
+    return meta, xmp
+
+
+def elide_binary(meta: dict) -> dict:
+    """Replace large base64 values in exiftool JSON with a placeholder."""
+    for tag, value in meta.items():
+        if isinstance(value, str) and value.startswith('base64:'):
+            size = (len(value) - 7) * 3 // 4 - value.count('=')
+            if size > BINARY_LIMIT:
+                meta[tag] = BINARY_PLACEHOLDER.format(size)
+    return meta
+
+
+_shared_pool = None
+_shared_pid = None
+
+
+def shared_pool() -> ExifToolPool:
+    """Return the process-wide pool, creating it on first use.
+
+    A child created by fork must not talk to its parent's exiftool pipes,
+    so the pool is recreated whenever the process id changes.
+    """
+    global _shared_pool, _shared_pid
+    if _shared_pool is None or _shared_pid != getpid():
+        if _shared_pool is not None:
+            _shared_pool.close()
+        _shared_pool = ExifToolPool()
+        _shared_pid = getpid()
+    return _shared_pool
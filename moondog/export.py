@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming NDJSON export of a collection's metadata
+"""
+
+from bagit import _load_tag_file
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from moondog.index import DESCRIPTIVE_FILENAME, find_bags
+from moondog.manifests import WORK_DIR
+from os import cpu_count, remove, replace
+from os.path import (exists, expanduser, expandvars, join, normpath,
+                     realpath)
+from time import perf_counter
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ('gzip', 'zstd')
+# uncompressed bytes per independently compressed block
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def bag_record(bag_path: str) -> dict:
+    """The export record for one bag: its bag-info and descriptive metadata.
+
+    Only bag-info.txt and metadata/descriptive.json are read; the record
+    is built from those files rather than from ImageBag objects.
+    """
+    info = _load_tag_file(join(bag_path, 'bag-info.txt'))
+    try:
+        with open(
+                join(bag_path, DESCRIPTIVE_FILENAME), 'r',
+                encoding='utf-8') as f:
+            descriptive = json.load(f)
+        del f
+    except FileNotFoundError:
+        descriptive = None
+    return {'bag': bag_path, 'info': info, 'descriptive': descriptive}
+
+
+def dumps(record: dict) -> bytes:
+    """record as one compact line of UTF-8 JSON, newline included."""
+    if orjson is not None:
+        return orjson.dumps(
+            record, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(
+        record, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        + '\n').encode('utf-8')
+
+
+def compress_block(block: bytes, compression: str) -> bytes:
+    """Compress block as a complete gzip member or zstd frame.
+
+    Members and frames can simply be concatenated: gzip and zstd readers
+    decompress them one after another as a single stream, so blocks can
+    be compressed independently and in parallel.
+    """
+    if compression == 'gzip':
+        c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(block) + c.flush()
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(block)
+    return block
+
+
+def _compression_for(path: str, compression: str) -> str:
+    if compression is None:
+        if path.endswith('.gz'):
+            compression = 'gzip'
+        elif path.endswith('.zst'):
+            compression = 'zstd'
+    elif compression not in COMPRESSIONS:
+        raise ValueError(
+            'Unsupported compression: "{}"'.format(compression))
+    if compression == 'zstd' and zstandard is None:
+        raise RuntimeError('zstd compression requires zstandard')
+    return compression
+
+
+def _serialize(bag_path: str) -> tuple:
+    try:
+        return bag_path, dumps(bag_record(bag_path)), None
+    except Exception as e:
+        return bag_path, None, '{}: {}'.format(type(e).__name__, str(e))
+
+
+def _bounded_map(executor: ThreadPoolExecutor, function, items, window: int):
+    """Like executor.map, in order, but never more than window in flight."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export_collection(
+    roots: list,
+    path: str,
+    compression: str = None,
+    workers: int = None,
+    block_size: int = DEFAULT_BLOCK_SIZE
+) -> dict:
+    """Write one NDJSON line per bag found under roots to path.
+
+    Bags are found, read and serialized as a stream, with a bounded number
+    in flight, so memory does not grow with the size of the collection.
+    compression is 'gzip' or 'zstd' (by default chosen from a .gz or .zst
+    suffix). Output is cut into blocks of about block_size bytes that are
+    compressed independently by up to workers threads, while serialization
+    also runs on workers threads; zlib and zstandard release the GIL, and
+    orjson is used for serialization when installed. Bags still being
+    accessioned are skipped. The file is written under a temporary name and
+    renamed into place when complete.
+
+    Returns {'records', 'errors', 'bytes', 'compressed_bytes', 'seconds'}.
+    """
+    path = realpath(expanduser(expandvars(normpath(path))))
+    compression = _compression_for(path, compression)
+    if workers is None:
+        workers = cpu_count() or 1
+    stats = {
+        'records': 0,
+        'errors': [],
+        'bytes': 0,
+        'compressed_bytes': 0,
+        'seconds': 0.0
+    }
+    start = perf_counter()
+
+    def bag_paths():
+        for root in roots:
+            root = realpath(expanduser(expandvars(normpath(root))))
+            for bag_path in find_bags(root):
+                if exists(join(bag_path, WORK_DIR)):
+                    logger.info(
+                        'skipping {}: accession not finished'
+                        ''.format(bag_path))
+                    continue
+                yield bag_path
+
+    tmp = path + '.tmp'
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as serializers, \
+                ThreadPoolExecutor(max_workers=workers) as compressors, \
+                open(tmp, 'wb') as f:
+            blocks = deque()
+
+            def flush(block: list, limit: int):
+                if block:
+                    blocks.append(compressors.submit(
+                        compress_block, b''.join(block), compression))
+                while len(blocks) > limit:
+                    data = blocks.popleft().result()
+                    stats['compressed_bytes'] += len(data)
+                    f.write(data)
+
+            block = []
+            size = 0
+            for bag_path, line, error in _bounded_map(
+                    serializers, _serialize, bag_paths(), workers * 4):
+                if error is not None:
+                    logger.error('{}: {}'.format(bag_path, error))
+                    stats['errors'].append({'bag': bag_path, 'error': error})
+                    continue
+                block.append(line)
+                size += len(line)
+                stats['records'] += 1
+                stats['bytes'] += len(line)
+                if size >= block_size:
+                    flush(block, workers)
+                    block = []
+                    size = 0
+            flush(block, 0)
+        del f
+        replace(tmp, path)
+    except BaseException:
+        # leave nothing half-written behind
+        if exists(tmp):
+            remove(tmp)
+        raise
+    stats['seconds'] = perf_counter() - start
+    return stats
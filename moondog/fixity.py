@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel fixity checking and scheduling for image bags
+"""
+
+from bagit import BagError
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from math import ceil
+from moondog.index import find_bags
+from moondog.manifests import _walk, hash_file, LazyBag
+from os import cpu_count
+from os.path import (exists, expanduser, expandvars, getsize, join, normpath,
+                     realpath)
+import sqlite3
+from time import perf_counter, time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IO_WORKERS = 4
+DEFAULT_FRACTION = 1 / 30
+
+
+def check_bag(
+    bag_path: str,
+    fast: bool = False,
+    executor: ThreadPoolExecutor = None,
+    known: dict = None
+) -> dict:
+    """Check the fixity of one bag, returning a result dict.
+
+    A full check re-hashes every file listed in the manifests and
+    tagmanifests, handing the files to executor (if given) so that they
+    are read in parallel. A fast check reads no file contents: it compares
+    Payload-Oxum and the manifest listing with the payload on disk and,
+    given known sizes and mtimes from the last full check ({bag-relative
+    path: (size, mtime_ns)}), reports any payload file that has changed.
+    Either way result['files'] holds the current sizes and mtimes.
+    """
+    bag_path = realpath(bag_path)
+    result = {
+        'bag': bag_path,
+        'fast': fast,
+        'valid': False,
+        'errors': [],
+        'bytes': 0,
+        'seconds': 0.0,
+        'files': {}
+    }
+    start = perf_counter()
+    errors = result['errors']
+    try:
+        bag = LazyBag(bag_path)
+        on_disk = {
+            rel_path: (st.st_size, st.st_mtime_ns)
+            for rel_path, st in _walk(join(bag_path, 'data'), bag_path)}
+        result['files'] = on_disk
+        oxum = bag.info.get('Payload-Oxum')
+        if oxum is not None:
+            actual = '{}.{}'.format(
+                sum(size for size, mtime_ns in on_disk.values()),
+                len(on_disk))
+            if oxum != actual:
+                errors.append(
+                    'Payload-Oxum is {} but the payload is {}'
+                    ''.format(oxum, actual))
+        payload = bag.payload_entries()
+        for rel_path in sorted(on_disk.keys() - payload.keys()):
+            errors.append('{} is not in the manifest'.format(rel_path))
+        for rel_path in sorted(payload.keys() - on_disk.keys()):
+            errors.append('{} is missing'.format(rel_path))
+        if fast:
+            if known is not None:
+                for rel_path, stamp in sorted(on_disk.items()):
+                    if rel_path in known and tuple(known[rel_path]) != stamp:
+                        errors.append(
+                            '{} has changed since it was last verified'
+                            ''.format(rel_path))
+        else:
+            result['bytes'] = _check_digests(
+                bag_path, bag.entries, executor, errors)
+    except (BagError, OSError) as e:
+        errors.append('{}: {}'.format(type(e).__name__, str(e)))
+    result['valid'] = not errors
+    result['seconds'] = perf_counter() - start
+    return result
+
+
+def _check_digests(
+    bag_path: str,
+    entries: dict,
+    executor: ThreadPoolExecutor,
+    errors: list
+) -> int:
+    """Re-hash every existing file in entries; return the bytes read."""
+    jobs = []
+    total = 0
+    for rel_path, expected in sorted(entries.items()):
+        path = join(bag_path, rel_path)
+        if not exists(path):
+            if not rel_path.startswith('data/'):
+                errors.append('{} is missing'.format(rel_path))
+            continue
+        algorithms = sorted(expected.keys())
+        if executor is None:
+            jobs.append((rel_path, expected, hash_file(path, algorithms)))
+        else:
+            jobs.append((
+                rel_path, expected,
+                executor.submit(hash_file, path, algorithms)))
+        total += getsize(path)
+    for rel_path, expected, digests in jobs:
+        if executor is not None:
+            digests = digests.result()
+        for alg, value in sorted(expected.items()):
+            if digests[alg] != value:
+                errors.append(
+                    '{} {} checksum mismatch: expected {}, found {}'
+                    ''.format(rel_path, alg, value, digests[alg]))
+    return total
+
+
+def check_bags(
+    bag_paths: list,
+    fast: bool = False,
+    workers: int = None,
+    io_workers: int = DEFAULT_IO_WORKERS,
+    known: dict = None
+):
+    """Check many bags at once, yielding their results in order.
+
+    Up to workers bags are checked concurrently, but every file read goes
+    through one pool of io_workers threads, so io_workers bounds the I/O
+    concurrency across all of them. known maps bag paths to the sizes and
+    mtimes used by fast checks.
+    """
+    if workers is None:
+        workers = cpu_count() or 1
+    if known is None:
+        known = {}
+    with ThreadPoolExecutor(max_workers=io_workers) as io, \
+            ThreadPoolExecutor(max_workers=workers) as bags:
+        futures = [
+            bags.submit(
+                check_bag, bag_path, fast, io, known.get(realpath(bag_path)))
+            for bag_path in bag_paths]
+        for future in futures:
+            yield _log_result(future.result())
+
+
+def _log_result(result: dict) -> dict:
+    if result['valid']:
+        logger.info(
+            'verified {} ({}) in {:.2f}s'.format(
+                result['bag'], 'fast' if result['fast'] else 'full',
+                result['seconds']))
+    else:
+        for error in result['errors']:
+            logger.error('{}: {}'.format(result['bag'], error))
+    return result
+
+
+class FixityScheduler(object):
+    """Spread full fixity checks of an archive across many runs.
+
+    Each run() fully re-hashes the fraction of bags whose last full check
+    is oldest, bags never checked coming first, and fast-checks all the
+    others against the sizes and mtimes recorded at their last full
+    check. Run nightly with fraction=1/30, every bag is re-hashed about
+    once a month while each night reads only a thirtieth of the archive.
+    The schedule is kept in a small SQLite database at path.
+    """
+
+    def __init__(self, path: str, fraction: float = DEFAULT_FRACTION):
+        if not 0 < fraction <= 1:
+            raise ValueError(
+                'fraction must be in (0, 1], not {}'.format(fraction))
+        self.fraction = fraction
+        self.db = sqlite3.connect(realpath(expanduser(expandvars(
+            normpath(path)))))
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS fixity ('
+            'path TEXT PRIMARY KEY, last_full REAL, last_check REAL, '
+            'valid INTEGER, files TEXT)')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def plan(self, bag_paths: list) -> tuple:
+        """Split bag_paths into (due for a full check, fast check only)."""
+        last_full = dict(self.db.execute(
+            'SELECT path, last_full FROM fixity'))
+        bag_paths = [realpath(p) for p in bag_paths]
+        ordered = sorted(
+            bag_paths, key=lambda p: (last_full.get(p) or 0.0, p))
+        n = ceil(len(ordered) * self.fraction)
+        return ordered[:n], ordered[n:]
+
+    def known(self, bag_paths: list) -> dict:
+        """Sizes and mtimes from the last full check of each bag."""
+        known = {}
+        for bag_path in bag_paths:
+            row = self.db.execute(
+                'SELECT files FROM fixity WHERE path = ? AND '
+                'last_full IS NOT NULL', (bag_path,)).fetchone()
+            if row is not None:
+                known[bag_path] = json.loads(row[0])
+        return known
+
+    def record(self, result: dict, now: float = None):
+        if now is None:
+            now = time()
+        with self.db:
+            if result['fast']:
+                updated = self.db.execute(
+                    'UPDATE fixity SET last_check = ?, valid = ? '
+                    'WHERE path = ?',
+                    (now, int(result['valid']), result['bag'])).rowcount
+                if not updated:
+                    self.db.execute(
+                        'INSERT INTO fixity (path, last_check, valid) '
+                        'VALUES (?, ?, ?)',
+                        (result['bag'], now, int(result['valid'])))
+            else:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO fixity (path, last_full, '
+                    'last_check, valid, files) VALUES (?, ?, ?, ?, ?)',
+                    (result['bag'], now, now, int(result['valid']),
+                     json.dumps(result['files'])))
+
+    def run(
+        self,
+        roots: list,
+        workers: int = None,
+        io_workers: int = DEFAULT_IO_WORKERS,
+        now: float = None
+    ) -> list:
+        """Check every bag under roots as planned; return the results."""
+        bag_paths = []
+        for root in roots:
+            bag_paths.extend(
+                find_bags(realpath(expanduser(expandvars(normpath(root))))))
+        full, fast = self.plan(bag_paths)
+        results = []
+        for paths, is_fast in [(full, False), (fast, True)]:
+            for result in check_bags(
+                    paths, fast=is_fast, workers=workers,
+                    io_workers=io_workers,
+                    known=self.known(paths) if is_fast else None):
+                self.record(result, now)
+                results.append(result)
+        return results
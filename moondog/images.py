@@ -6,23 +6,103 @@ Manage image collection
 
 from bagit import Bag, BagError, make_bag
 import better_exceptions
-from exiftool import ExifTool
-from libxmp import XMPFiles
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import json
+from libxmp.core import XMPMeta
 import logging
-from os import makedirs
-from os.path import (basename, expanduser, expandvars, join, normpath,
-                     realpath, splitext)
-from PIL import Image
-from pprint import pprint
-import shutil
+from moondog.derivatives import DEFAULT_TILE_SIZE, generate_derivatives
+from moondog.exif import ExifToolPool, shared_pool
+from moondog.fixity import check_bag, DEFAULT_IO_WORKERS
+from moondog.index import CollectionIndex
+from moondog.instrument import span
+from moondog.manifests import (copy_and_hash, fsync_path, hash_file,
+                               LazyBag, link_file, LINK_MODES,
+                               PayloadDigests, save_bag, WORK_DIR)
+from moondog.masters import DEFAULT_MEMORY_LIMIT, generate_master
+from moondog.metadata import DescriptiveMetadata
+from moondog.phash import HASH_ALGORITHMS, image_hash
+from os import makedirs, replace, stat
+from os.path import (basename, exists, expanduser, expandvars, isdir, join,
+                     normpath, realpath)
+import re
+from shutil import copy2, rmtree
+from threading import Lock
 
 logger = logging.getLogger(__name__)
 
+SIDECAR_DIGEST = 'sha256'
+COMPONENTS = (
+    'access', 'master', 'original', 'pyramid', 'thumbnail', 'tiles')
+# component names that derivatives= sizes may not use
+RESERVED_COMPONENTS = ('master', 'original', 'pyramid', 'tiles')
+# derivative names become bag-info terms (e.g. Web_Large-Filename) and file
+# names, so they are kept to lower case letters, digits and underscores
+DERIVATIVE_NAME = re.compile(r'^[a-z][a-z0-9_]*$')
+DEDUP_MODES = LINK_MODES + ('pointer', 'skip')
+JOURNAL_FILENAME = 'journal.json'
+# bagit.make_bag chdirs into the bag, so bags are made one at a time
+_make_bag_lock = Lock()
+
+
+class DuplicateOriginal(RuntimeError):
+    """The original being accessioned is already in another bag."""
+
+    def __init__(self, path: str, existing: str):
+        RuntimeError.__init__(
+            self, '{} is already accessioned in {}'.format(path, existing))
+        self.path = path
+        self.existing = existing
+
+
+def accession_in_progress(bag_path: str) -> str:
+    """The original whose accession into bag_path was interrupted, or None."""
+    try:
+        with open(
+                join(bag_path, WORK_DIR, JOURNAL_FILENAME), 'r',
+                encoding='utf-8') as f:
+            return json.load(f)['original']
+    except FileNotFoundError:
+        return None
+
 
 class ImageBag:
 
-    def __init__(self, path: str, auto_make: bool = False) -> None:
+    def __init__(
+        self,
+        path: str,
+        auto_make: bool = False,
+        dedup: str = None,
+        derivatives: dict = None,
+        exiftool: ExifToolPool = None,
+        fsync: bool = False,
+        index: CollectionIndex = None,
+        lazy: bool = False,
+        master_compression: str = None,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        perceptual_hash: str = None,
+        pyramid: bool = False,
+        tiles: bool = False,
+        working_profile: bytes = None
+    ) -> None:
+        if dedup is not None:
+            if dedup not in DEDUP_MODES:
+                raise ValueError(
+                    'Unsupported dedup mode: "{}"'.format(dedup))
+            if index is None:
+                raise ValueError('dedup requires a collection index')
+        for name in derivatives or {}:
+            if name in RESERVED_COMPONENTS:
+                raise ValueError(
+                    'Derivative name is reserved: "{}"'.format(name))
+            if not isinstance(name, str) or not DERIVATIVE_NAME.match(name):
+                raise ValueError(
+                    'Unsupported derivative name: "{}"'.format(name))
+        if perceptual_hash not in (None,) + HASH_ALGORITHMS:
+            raise ValueError(
+                'Unsupported perceptual hash: "{}"'.format(perceptual_hash))
         self.path = realpath(expanduser(expandvars(normpath(path))))
+        self.auto_made = auto_make
         if auto_make:
             try:
                 makedirs(self.path, exist_ok=False)
@@ -31,47 +111,407 @@ class ImageBag:
                     '{} already exists, but auto_make = True'
                     ''.format(self.path))
             else:
-                self.bag = make_bag(self.path)
+                with _make_bag_lock:
+                    self.bag = make_bag(self.path)
         else:
             try:
-                self.bag = Bag(self.path)
+                if lazy:
+                    self.bag = LazyBag(self.path)
+                else:
+                    self.bag = Bag(self.path)
             except BagError as e:
                 raise OSError(
                     '{} does not seem to be a valid Moondog Image bag: {}'
                     ''.format(self.path, str(e)))
-        self.components = {}
+        self.components = self._load_components()
+        self.dedup = dedup
+        self.derivatives = derivatives
+        self.exiftool = exiftool
+        self.fsync = fsync
+        self.index = index
+        self.master_compression = master_compression
+        self.memory_limit = memory_limit
+        self.near_duplicates = []
+        self.perceptual_hash = perceptual_hash
+        self.pyramid = pyramid
+        self.tiles = tiles
+        self.working_profile = working_profile
+        self.digests = PayloadDigests(
+            self.path, self.bag.algorithms, None if auto_make else self.bag)
+        self.descriptive = None
+        self.journal = self._load_journal()
         return None
 
-    def accession(self, path: str):
-        self._import_original(path)
-        self._generate_master()
+    def _load_components(self) -> dict:
+        """Rebuild the component list from bag-info, e.g. Master-Filename.
+
+        Besides the usual components, any name with a Filename term is one,
+        so derivatives with custom names are found again too.
+        """
+        components = {}
+        named = set(
+            bag_term[:-len('-Filename')].lower()
+            for bag_term in self.bag.info
+            if bag_term.endswith('-Filename'))
+        for bag_term, value in self.bag.info.items():
+            fn, sep, term = bag_term.partition('-')
+            fn = fn.lower()
+            if (fn in COMPONENTS or fn in named) and sep:
+                components.setdefault(fn, {})[
+                    term.lower().replace('-', '_')] = value
+        return components
+
+    def accession(self, path: str, digest: str = None):
+        """Accession the original at path into this bag.
+
+        Accession runs in steps (copy the original, describe it, make the
+        master, make derivatives). Files are written to a staging area in
+        the bag and renamed into data/ once complete, and each finished
+        step is recorded, with the payload digests so far, in a journal
+        that is removed when accession is done. Calling accession again on
+        a bag with a journal (e.g. after a crash) resumes with the first
+        unfinished step, without copying or hashing anything again.
+
+        With dedup set, an original whose sha256 is already in the index
+        is not copied or mastered again: skip raises DuplicateOriginal
+        (removing the bag if auto_make created it for this call), hardlink and reflink share the existing bag's original and master,
+        and pointer records only a reference (Original-Source-Bag) to it.
+        digest is the original's sha256, if the caller already has it.
+        """
+        if self.dedup is not None and self.journal is None:
+            if digest is None:
+                digest = hash_file(path, [SIDECAR_DIGEST])[SIDECAR_DIGEST]
+            existing = self.index.find_original(digest)
+            if existing is not None and existing != self.path:
+                self._accession_duplicate(path, digest, existing)
+                self._finish_accession()
+                self.index.add_bag(self.path)
+                return
+        self._start_journal(path)
+        self._run_steps(path, ['original'])
+        if self.index is not None and self.perceptual_hash is not None:
+            self._find_near_duplicates()
+        self._run_steps(path)
+        self._finish_accession()
+        if self.index is not None:
+            self.index.add_bag(self.path)
 
-    def _import_original(self, path: str):
+    def _accession_steps(self, path: str) -> list:
+        """[(step name, function)] in the order accession runs them."""
+        steps = [
+            ('original', partial(self._copy_original, path)),
+            ('metadata', self._describe_original),
+            ('master', self._generate_master)]
+        if self.derivatives or self.pyramid or self.tiles:
+            steps.append(('derivatives', self._generate_derivatives))
+        return steps
+
+    def _run_steps(self, path: str, names: list = None):
+        """Run the unfinished accession steps (or those of names).
+
+        Each step is timed as a span named after it (see moondog.instrument).
+        """
+        for name, function in self._accession_steps(path):
+            if names is not None and name not in names:
+                continue
+            if name in self.journal['steps']:
+                logger.debug(
+                    '{}: {} step already done'.format(self.path, name))
+                continue
+            with span(name, bag=self.path):
+                function()
+            self.journal['steps'].append(name)
+            self._save_journal()
+
+    def _start_journal(self, path: str):
+        original = realpath(expanduser(expandvars(normpath(path))))
+        if self.journal is None:
+            self.journal = {'original': original, 'steps': []}
+            self._save_journal()
+        elif self.journal['original'] != original:
+            raise ValueError(
+                '{} is part way through accessioning {}, not {}'
+                ''.format(self.path, self.journal['original'], original))
+        else:
+            logger.info(
+                'resuming accession of {} into {} after: {}'.format(
+                    original, self.path,
+                    ', '.join(self.journal['steps']) or 'nothing'))
+
+    def _load_journal(self) -> dict:
+        """Restore the state of an unfinished accession, if there is one."""
+        try:
+            with open(
+                    join(self.path, WORK_DIR, JOURNAL_FILENAME), 'r',
+                    encoding='utf-8') as f:
+                journal = json.load(f)
+            del f
+        except FileNotFoundError:
+            return None
+        self.components.update(journal['components'])
+        self.digests.entries = {
+            rel_path: tuple(entry)
+            for rel_path, entry in journal['digests'].items()}
+        return journal
+
+    def _save_journal(self):
+        self.journal['components'] = self.components
+        self.journal['digests'] = self.digests.entries
+        path = join(self.path, WORK_DIR)
+        makedirs(path, exist_ok=True)
+        tmp = join(path, JOURNAL_FILENAME + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.journal, f, indent=4, sort_keys=True)
+        del f
+        if self.fsync:
+            fsync_path(tmp)
+        replace(tmp, join(path, JOURNAL_FILENAME))
+        if self.fsync:
+            fsync_path(path)
+
+    def _finish_accession(self):
+        """Drop the journal and staging area of a completed accession."""
+        rmtree(join(self.path, WORK_DIR), ignore_errors=True)
+        self.journal = None
+
+    def _staging_path(self, filename: str = None) -> str:
+        """Where to write a payload file before it is complete."""
+        path = join(self.path, WORK_DIR, 'staging')
+        makedirs(path, exist_ok=True)
+        if filename is None:
+            return path
+        return join(path, filename)
+
+    def _unstage(self, filename: str) -> str:
+        """Rename a finished file (or directory) into data/."""
+        target = join(self.path, 'data', filename)
+        if isdir(target):
+            # left by an interrupted run; replace() cannot overwrite it
+            rmtree(target)
+        replace(self._staging_path(filename), target)
+        if self.fsync:
+            fsync_path(join(self.path, 'data'))
+        return target
+
+    def _find_near_duplicates(self):
+        """Look up originals in the index that look like this one."""
+        self.near_duplicates = [
+            (distance, path) for distance, path in self.index.find_similar(
+                self.components['original']['perceptual_hash'])
+            if path != self.path]
+        for distance, path in self.near_duplicates:
+            logger.info(
+                '{} looks like {} (distance {})'
+                ''.format(self.path, path, distance))
+
+    def _accession_duplicate(self, path: str, digest: str, existing: str):
+        if self.dedup == 'skip':
+            if self.auto_made and not self.components:
+                # the bag was made for this original and is still empty
+                rmtree(self.path)
+            raise DuplicateOriginal(path, existing)
         d = self.components['original'] = {}
         d['accession_path'] = realpath(expanduser(expandvars(normpath(path))))
         d['filename'] = basename(d['accession_path'])
-        fn, ext = splitext(d['filename'])
-        target_path = join(self.path, 'data', d['filename'])
-        shutil.copy2(
-            d['accession_path'], target_path)
-        with ExifTool() as et:
-            meta = et.get_metadata(target_path)
-        pprint(meta)
-        xmp = XMPFiles(file_path=target_path).get_xmp()
-        pprint(xmp)
+        d['sha256'] = digest
+        d['source_bag'] = existing
+        if self.dedup == 'pointer':
+            self._update(manifests=True)
+            return
+        source = ImageBag(existing, lazy=True)
+        master = source.components['master']['filename']
+        for src_fn, dst_fn in [
+                (source.components['original']['filename'], d['filename']),
+                (master, master)]:
+            link_file(
+                join(existing, 'data', src_fn),
+                join(self.path, 'data', dst_fn), self.dedup)
+            self.digests.record(
+                'data/{}'.format(dst_fn),
+                source.bag.entries['data/{}'.format(src_fn)])
+        self.components['master'] = {'filename': master}
+        # the metadata sidecar is keyed by the same digest, so it still holds
+        for filename in ('original.json', 'descriptive.json'):
+            sidecar = join(existing, 'metadata', filename)
+            if exists(sidecar):
+                makedirs(join(self.path, 'metadata'), exist_ok=True)
+                copy2(sidecar, join(self.path, 'metadata', filename))
+        if self.derivatives or self.pyramid or self.tiles:
+            self._generate_derivatives()
+        else:
+            self._update(manifests=True)
+
+    def validate(
+        self,
+        fast: bool = False,
+        io_workers: int = DEFAULT_IO_WORKERS
+    ) -> dict:
+        """Check the bag's fixity; see moondog.fixity.check_bag.
+
+        Files are re-hashed io_workers at a time; fast only compares
+        Payload-Oxum and the manifests with the payload on disk.
+        """
+        if fast:
+            return check_bag(self.path, fast=True)
+        with ThreadPoolExecutor(max_workers=io_workers) as executor:
+            return check_bag(self.path, executor=executor)
+
+    def _copy_original(self, path: str):
+        """Copy the original into the payload, hashing it on the way."""
+        d = self.components['original'] = {}
+        d['accession_path'] = realpath(expanduser(expandvars(normpath(path))))
+        d['filename'] = basename(d['accession_path'])
+        with span('copy', bag=self.path) as s:
+            digests = copy_and_hash(
+                d['accession_path'], self._staging_path(d['filename']),
+                self.bag.algorithms, fsync=self.fsync)
+            target_path = self._unstage(d['filename'])
+            self.digests.record('data/{}'.format(d['filename']), digests)
+            s.bytes = self.digests.entries[
+                'data/{}'.format(d['filename'])][0]
+        try:
+            d['sha256'] = digests[SIDECAR_DIGEST]
+        except KeyError:
+            d['sha256'] = hash_file(
+                target_path, [SIDECAR_DIGEST])[SIDECAR_DIGEST]
+        if self.perceptual_hash is not None:
+            with span('perceptual_hash', bag=self.path):
+                d['perceptual_hash'] = image_hash(
+                    target_path, self.perceptual_hash)
+
+    def _describe_original(self):
+        """Extract the original's metadata and save the bag."""
+        meta, xmp, written = self._extract_metadata()
+        with span('xmp', bag=self.path) as s:
+            if xmp is None:
+                self.descriptive = DescriptiveMetadata()
+            else:
+                s.bytes = len(xmp)
+                self.descriptive = DescriptiveMetadata(
+                    xmp=XMPMeta(xmp_str=xmp))
+        self._write_metadata('descriptive.json', self.descriptive.get_dict())
         self._update(manifests=True)
 
+    def extract_metadata(self, refresh: bool = False) -> tuple:
+        """Return (exiftool metadata, XMP packet or None) for the original.
+
+        The result is cached in metadata/original.json together with the
+        sha256 of the original it was extracted from. While that digest
+        still matches, the sidecar is returned without running exiftool;
+        when it is rewritten, the tag manifests are updated to match.
+        """
+        meta, xmp, written = self._extract_metadata(refresh)
+        if written:
+            self._update()
+        return meta, xmp
+
+    def _extract_metadata(self, refresh: bool = False) -> tuple:
+        """(exiftool metadata, XMP packet, whether the sidecar was written)"""
+        rel_path = 'data/{}'.format(self._original_filename())
+        digest = self._payload_digest(rel_path)
+        if not refresh:
+            try:
+                with open(
+                        join(self.path, 'metadata', 'original.json'), 'r',
+                        encoding='utf-8') as f:
+                    cached = json.load(f)
+                del f
+            except (OSError, ValueError):
+                cached = None
+            if (isinstance(cached, dict)
+                    and cached.get(SIDECAR_DIGEST) == digest):
+                return cached['exiftool'], cached['xmp'], False
+        with span('exiftool', bag=self.path):
+            if self.exiftool is None:
+                meta, xmp = shared_pool().extract(join(self.path, rel_path))
+            else:
+                meta, xmp = self.exiftool.extract(join(self.path, rel_path))
+        self._write_metadata(
+            'original.json',
+            {SIDECAR_DIGEST: digest, 'exiftool': meta, 'xmp': xmp})
+        return meta, xmp, True
+
+    def _original_filename(self) -> str:
+        try:
+            return self.components['original']['filename']
+        except KeyError:
+            return self.bag.info['Original-Filename']
+
+    def _payload_digest(self, rel_path: str) -> str:
+        """The sha256 of a payload file, from what is already known if we can.
+
+        A digest recorded this session is used while the file's size and
+        mtime are unchanged; a bag opened from disk trusts its manifest.
+        Otherwise the file is hashed.
+        """
+        digest = None
+        try:
+            size, mtime_ns, digests = self.digests.entries[rel_path]
+        except KeyError:
+            try:
+                digest = self.bag.entries[rel_path][SIDECAR_DIGEST]
+            except KeyError:
+                pass
+        else:
+            st = stat(join(self.path, rel_path))
+            if size == st.st_size and mtime_ns == st.st_mtime_ns:
+                digest = digests.get(SIDECAR_DIGEST)
+        if digest is None:
+            digest = hash_file(
+                join(self.path, rel_path), [SIDECAR_DIGEST])[SIDECAR_DIGEST]
+        return digest
+
+    def _write_metadata(self, filename: str, d: dict):
+        """Write d as JSON to the bag's metadata/ tag directory."""
+        path = join(self.path, 'metadata')
+        makedirs(path, exist_ok=True)
+        tmp = join(path, filename + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(d, f, ensure_ascii=False, indent=4, sort_keys=True)
+        del f
+        replace(tmp, join(path, filename))
+
     def _generate_master(self):
         infn = self.components['original']['filename']
         d = self.components['master'] = {}
         d['filename'] = 'master.tif'
-        Image.open(
-            join(self.path, 'data', infn)).save(
-            join(self.path, 'data', d['filename']))
+        with span('generate_master', bag=self.path) as s:
+            generate_master(
+                join(self.path, 'data', infn),
+                self._staging_path(d['filename']),
+                compression=self.master_compression,
+                memory_limit=self.memory_limit,
+                working_profile=self.working_profile)
+            s.bytes = stat(self._unstage(d['filename'])).st_size
+        self._update(manifests=True)
+
+    def _generate_derivatives(self):
+        """Make access copies from the master, e.g. derivatives=DEFAULT_SIZES.
+
+        Each derivative becomes a component, so it is named in bag-info
+        (e.g. Thumbnail-Filename) and covered by the payload manifests.
+        """
+        with span('generate_derivatives', bag=self.path):
+            components = generate_derivatives(
+                join(
+                    self.path, 'data',
+                    self.components['master']['filename']),
+                self._staging_path(),
+                sizes=self.derivatives or {},
+                pyramid=self.pyramid,
+                tiles=self.tiles,
+                tile_size=DEFAULT_TILE_SIZE)
+            for d in components.values():
+                self._unstage(d['filename'])
+        self.components.update(components)
         self._update(manifests=True)
 
     def _update(self, manifests=False):
-        """Update the bag."""
+        """Update the bag.
+
+        Only payload files that are new or changed since the last update are
+        hashed; see moondog.manifests.
+        """
         for fn, fmeta in self.components.items():
             for term, value in fmeta.items():
                 bag_term = '{}-{}'.format(
@@ -84,5 +524,8 @@ class ImageBag:
                 else:
                     if prior_value != value:
                         self.bag.info[bag_term] = value
-        self.bag.save(manifests=manifests)
+        with span('update', bag=self.path) as s:
+            hashed = self.digests.bytes_hashed
+            save_bag(self.bag, self.digests, manifests=manifests)
+            s.bytes = self.digests.bytes_hashed - hashed
 
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collection-level search index over image bags
+"""
+
+from bagit import _load_tag_file
+import json
+import logging
+from moondog.phash import (chunk_flips, CHUNK_BITS, hamming, hash_chunks,
+                           parse_hash)
+from os import scandir, stat
+from os.path import expanduser, expandvars, join, normpath, realpath
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bags (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    original_filename TEXT,
+    bagging_date TEXT,
+    info TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    original_sha256 TEXT,
+    source_bag TEXT,
+    perceptual_hash TEXT,
+    hash_chunk_0 INTEGER,
+    hash_chunk_1 INTEGER,
+    hash_chunk_2 INTEGER
+);
+CREATE INDEX IF NOT EXISTS bags_original_sha256 ON bags(original_sha256);
+CREATE INDEX IF NOT EXISTS bags_hash_chunk_0 ON bags(hash_chunk_0);
+CREATE INDEX IF NOT EXISTS bags_hash_chunk_1 ON bags(hash_chunk_1);
+CREATE INDEX IF NOT EXISTS bags_hash_chunk_2 ON bags(hash_chunk_2);
+CREATE TABLE IF NOT EXISTS keywords (
+    bag_id INTEGER NOT NULL REFERENCES bags(id) ON DELETE CASCADE,
+    value TEXT NOT NULL COLLATE NOCASE,
+    uri TEXT
+);
+CREATE INDEX IF NOT EXISTS keywords_value ON keywords(value);
+CREATE INDEX IF NOT EXISTS keywords_uri ON keywords(uri);
+CREATE INDEX IF NOT EXISTS keywords_bag ON keywords(bag_id);
+CREATE TABLE IF NOT EXISTS agents (
+    bag_id INTEGER NOT NULL REFERENCES bags(id) ON DELETE CASCADE,
+    name TEXT NOT NULL COLLATE NOCASE,
+    role TEXT
+);
+CREATE INDEX IF NOT EXISTS agents_name ON agents(name);
+CREATE INDEX IF NOT EXISTS agents_bag ON agents(bag_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    titles, keywords, agents, descriptions, rights, info,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+DESCRIPTIVE_FILENAME = join('metadata', 'descriptive.json')
+# the perceptual hash is also stored cut into indexed columns, one per chunk
+HASH_CHUNK_COLUMNS = [
+    'hash_chunk_{}'.format(i) for i in range(len(CHUNK_BITS))]
+DEFAULT_MAX_DISTANCE = 8
+
+
+def _names(agent: dict) -> list:
+    return [n['full_name'] for n in agent.get('names', [])]
+
+
+class CollectionIndex(object):
+    """An SQLite index of bag-info and descriptive metadata for many bags.
+
+    Keywords and agent names are held in ordinary indexed tables for exact
+    (case-insensitive) lookups; titles, keywords, agents, descriptions,
+    rights and bag-info are also copied into an FTS5 table for full-text
+    search. Each bag is one row, replaced whenever it is added again.
+    """
+
+    def __init__(self, path: str):
+        if path != ':memory:':
+            path = realpath(expanduser(expandvars(normpath(path))))
+        self.path = path
+        # accession workers may share the database, so wait out their locks
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM bags').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def add(
+        self,
+        bag_path: str,
+        info: dict,
+        descriptive: dict = None,
+        mtime_ns: int = 0
+    ):
+        """Index (or re-index) one bag from its bag-info and metadata.
+
+        descriptive is the DescriptiveMetadata.get_dict() of the bag.
+        """
+        bag_path = realpath(bag_path)
+        if descriptive is None:
+            descriptive = {}
+        titles = [t['value'] for t in descriptive.get('titles', [])]
+        keywords = descriptive.get('keywords', [])
+        agents = [
+            (name, a.get('role'))
+            for a in descriptive.get('agents', []) for name in _names(a)]
+        descriptions = [
+            d['value'] for d in descriptive.get('descriptions', [])]
+        rights = []
+        for c in descriptive.get('copyright', []):
+            if c.get('statement'):
+                rights.append(c['statement'])
+            if c.get('holder'):
+                rights.extend(_names(c['holder']))
+        info_values = []
+        for value in info.values():
+            if isinstance(value, list):
+                info_values.extend(value)
+            else:
+                info_values.append(value)
+        with self.db:
+            row = self.db.execute(
+                'SELECT id FROM bags WHERE path = ?', (bag_path,)).fetchone()
+            if row is not None:
+                self._delete(row[0])
+            perceptual_hash = info.get('Original-Perceptual-Hash')
+            bag_id = self.db.execute(
+                'INSERT INTO bags (path, original_filename, bagging_date, '
+                'info, mtime_ns, original_sha256, source_bag, '
+                'perceptual_hash, hash_chunk_0, hash_chunk_1, hash_chunk_2) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (bag_path, info.get('Original-Filename'),
+                 info.get('Bagging-Date'), json.dumps(info), mtime_ns,
+                 info.get('Original-Sha256'), info.get('Original-Source-Bag'),
+                 perceptual_hash)
+                + tuple(_chunk_values(bag_path, perceptual_hash))
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO keywords (bag_id, value, uri) VALUES (?, ?, ?)',
+                [(bag_id, k['value'], k.get('uri')) for k in keywords])
+            self.db.executemany(
+                'INSERT INTO agents (bag_id, name, role) VALUES (?, ?, ?)',
+                [(bag_id, name, role) for name, role in agents])
+            self.db.execute(
+                'INSERT INTO search (rowid, titles, keywords, agents, '
+                'descriptions, rights, info) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (bag_id, '\n'.join(titles),
+                 '\n'.join(k['value'] for k in keywords),
+                 '\n'.join(name for name, role in agents),
+                 '\n'.join(descriptions), '\n'.join(rights),
+                 '\n'.join(info_values)))
+
+    def add_bag(self, bag_path: str, force: bool = False) -> bool:
+        """Index a bag from its files; False if it was already up to date.
+
+        Only bag-info.txt and metadata/descriptive.json are read, and not
+        even those when neither has changed since the bag was last indexed.
+        """
+        bag_path = realpath(bag_path)
+        mtime_ns = self._mtime_ns(bag_path)
+        if not force:
+            row = self.db.execute(
+                'SELECT mtime_ns FROM bags WHERE path = ?',
+                (bag_path,)).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                return False
+        info = _load_tag_file(join(bag_path, 'bag-info.txt'))
+        try:
+            with open(
+                    join(bag_path, DESCRIPTIVE_FILENAME), 'r',
+                    encoding='utf-8') as f:
+                descriptive = json.load(f)
+            del f
+        except FileNotFoundError:
+            descriptive = None
+        self.add(bag_path, info, descriptive, mtime_ns)
+        return True
+
+    def remove(self, bag_path: str):
+        with self.db:
+            row = self.db.execute(
+                'SELECT id FROM bags WHERE path = ?',
+                (realpath(bag_path),)).fetchone()
+            if row is not None:
+                self._delete(row[0])
+
+    def update(self, root: str) -> tuple:
+        """Bring the index up to date with every bag under root.
+
+        New and changed bags are (re-)indexed and bags that have gone are
+        dropped. Returns (bags indexed, bags removed).
+        """
+        root = realpath(expanduser(expandvars(normpath(root))))
+        seen = set()
+        indexed = 0
+        for bag_path in find_bags(root):
+            seen.add(bag_path)
+            if self.add_bag(bag_path):
+                indexed += 1
+        prefix = join(root, '')
+        gone = [
+            path for (path,) in self.db.execute(
+                'SELECT path FROM bags WHERE substr(path, 1, ?) = ?',
+                (len(prefix), prefix))
+            if path not in seen]
+        for path in gone:
+            self.remove(path)
+        return indexed, len(gone)
+
+    def search(self, query: str, limit: int = 100) -> list:
+        """Bag paths matching an FTS5 query, best matches first."""
+        return [
+            path for (path,) in self.db.execute(
+                'SELECT bags.path FROM search JOIN bags '
+                'ON bags.id = search.rowid WHERE search MATCH ? '
+                'ORDER BY rank LIMIT ?', (query, limit))]
+
+    def find_original(self, sha256: str) -> str:
+        """The bag holding an original with this sha256, or None.
+
+        Bags that merely point at (or link to) another bag's original
+        resolve to that bag.
+        """
+        row = self.db.execute(
+            'SELECT path, source_bag FROM bags WHERE original_sha256 = ? '
+            'ORDER BY source_bag IS NOT NULL, id LIMIT 1',
+            (sha256,)).fetchone()
+        if row is None:
+            return None
+        return row[1] or row[0]
+
+    def find_similar(
+        self,
+        perceptual_hash: str,
+        max_distance: int = DEFAULT_MAX_DISTANCE
+    ) -> list:
+        """[(Hamming distance, bag path)] of perceptually similar originals.
+
+        perceptual_hash is an Original-Perceptual-Hash value such as
+        'dhash:8f...'; only hashes made by the same algorithm compare.
+        Candidates are found through the indexed hash_chunk columns (see
+        moondog.phash.chunk_flips), so nothing is loaded up front and rows
+        written by other connections, e.g. other accession workers, are
+        always seen. Over a million random hashes a query takes a few
+        milliseconds up to the default distance, but several times that
+        beyond it, where each chunk needs three bit flips rather than two
+        (see benchmarks/bench_phash.py).
+        """
+        algorithm, h = parse_hash(perceptual_hash)
+        clauses = [
+            '{} IN ({})'.format(
+                column, ','.join(str(part ^ flip) for flip in flips))
+            for column, part, flips in zip(
+                HASH_CHUNK_COLUMNS, hash_chunks(h), chunk_flips(max_distance))]
+        found = []
+        for path, value in self.db.execute(
+                'SELECT path, perceptual_hash FROM bags WHERE '
+                + ' OR '.join(clauses)):
+            other_algorithm, other = parse_hash(value)
+            if other_algorithm != algorithm:
+                continue
+            distance = hamming(h, other)
+            if distance <= max_distance:
+                found.append((distance, path))
+        return sorted(found)
+
+    def find_keyword(self, value: str) -> list:
+        """Bag paths with a keyword equal to value, ignoring case."""
+        return [
+            path for (path,) in self.db.execute(
+                'SELECT DISTINCT bags.path FROM keywords JOIN bags '
+                'ON bags.id = keywords.bag_id WHERE keywords.value = ? '
+                'ORDER BY bags.path', (value,))]
+
+    def find_agent(self, name: str) -> list:
+        """Bag paths crediting an agent of this name, ignoring case."""
+        return [
+            path for (path,) in self.db.execute(
+                'SELECT DISTINCT bags.path FROM agents JOIN bags '
+                'ON bags.id = agents.bag_id WHERE agents.name = ? '
+                'ORDER BY bags.path', (name,))]
+
+    def _delete(self, bag_id: int):
+        self.db.execute('DELETE FROM search WHERE rowid = ?', (bag_id,))
+        self.db.execute('DELETE FROM bags WHERE id = ?', (bag_id,))
+
+    def _mtime_ns(self, bag_path: str) -> int:
+        mtime_ns = stat(join(bag_path, 'bag-info.txt')).st_mtime_ns
+        try:
+            return max(
+                mtime_ns,
+                stat(join(bag_path, DESCRIPTIVE_FILENAME)).st_mtime_ns)
+        except FileNotFoundError:
+            return mtime_ns
+
+
+def _chunk_values(bag_path: str, perceptual_hash: str) -> list:
+    """The hash_chunk column values for a perceptual hash, or NULLs."""
+    if perceptual_hash is None:
+        return [None] * len(CHUNK_BITS)
+    try:
+        algorithm, h = parse_hash(perceptual_hash)
+    except ValueError:
+        logger.warning(
+            'ignoring bad perceptual hash for {}: {}'
+            ''.format(bag_path, perceptual_hash))
+        return [None] * len(CHUNK_BITS)
+    return hash_chunks(h)
+
+
+def find_bags(path: str):
+    """Yield every directory under path that holds a bag-info.txt."""
+    entries = sorted(scandir(path), key=lambda e: e.name)
+    if any(e.name == 'bag-info.txt' and e.is_file() for e in entries):
+        yield path
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from find_bags(entry.path)
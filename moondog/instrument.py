@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing spans for the accession hot path
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+from os import replace
+from threading import Lock
+from time import perf_counter, time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# callables given a dict for every span that finishes
+_recorders = []
+
+
+def add_recorder(recorder):
+    _recorders.append(recorder)
+
+
+def remove_recorder(recorder):
+    _recorders.remove(recorder)
+
+
+@contextmanager
+def recording(recorder):
+    """Send spans to recorder while the with block runs."""
+    add_recorder(recorder)
+    try:
+        yield recorder
+    finally:
+        remove_recorder(recorder)
+
+
+def process_peak_rss() -> int:
+    """Peak resident set size of this process so far, in bytes, or None.
+
+    This is the high-water mark of the whole process since it started, not
+    of any one span: a span only shows that the peak had been reached by
+    the time it finished.
+    """
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _NullSpan(object):
+    """What span() returns when nothing is recording: does nothing."""
+
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.bytes = 0
+
+    def __enter__(self):
+        self.started = time()
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record = {
+            'name': self.name,
+            'labels': self.labels,
+            'started': self.started,
+            'seconds': perf_counter() - self._start,
+            'bytes': self.bytes,
+            'process_peak_rss': process_peak_rss(),
+            'error': None if exc_type is None else exc_type.__name__
+        }
+        for recorder in list(_recorders):
+            try:
+                recorder(record)
+            except Exception as e:
+                logger.warning(
+                    'span recorder {!r} failed: {}: {}'.format(
+                        recorder, type(e).__name__, str(e)))
+        return False
+
+
+def span(name: str, **labels):
+    """Time the with block as name, if anything is recording.
+
+    Set .bytes on the span to the number of bytes the block processed.
+    With no recorder registered this returns a shared no-op object, so an
+    instrumented call costs one function call and a list check.
+    """
+    if not _recorders:
+        return NULL_SPAN
+    return Span(name, labels)
+
+
+class JSONLinesRecorder(object):
+    """Append each span to path as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusRecorder(object):
+    """Totals per span name, in the Prometheus text exposition format.
+
+    write() suits node_exporter's textfile collector: point it at a file
+    in the collector's directory and call it every so often.
+    """
+
+    def __init__(self, prefix: str = 'moondog'):
+        self.prefix = prefix
+        self.totals = {}
+        self.process_peak_rss = None
+        self._lock = Lock()
+
+    def __call__(self, record: dict):
+        with self._lock:
+            t = self.totals.setdefault(
+                record['name'],
+                {'count': 0, 'seconds': 0.0, 'bytes': 0, 'errors': 0})
+            t['count'] += 1
+            t['seconds'] += record['seconds']
+            t['bytes'] += record['bytes']
+            if record['error'] is not None:
+                t['errors'] += 1
+            if record['process_peak_rss'] is not None:
+                self.process_peak_rss = max(
+                    self.process_peak_rss or 0, record['process_peak_rss'])
+
+    def text(self) -> str:
+        lines = []
+        with self._lock:
+            for metric, key, help_text in [
+                    ('span_count_total', 'count', 'Spans finished'),
+                    ('span_seconds_total', 'seconds',
+                     'Wall time spent in spans'),
+                    ('span_bytes_total', 'bytes', 'Bytes processed in spans'),
+                    ('span_errors_total', 'errors',
+                     'Spans that raised an exception')]:
+                name = '{}_{}'.format(self.prefix, metric)
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for span_name, t in sorted(self.totals.items()):
+                    lines.append('{}{{span="{}"}} {}'.format(
+                        name, span_name, t[key]))
+            if self.process_peak_rss is not None:
+                name = '{}_process_peak_rss_bytes'.format(self.prefix)
+                lines.append(
+                    '# HELP {} Highest peak resident set size of a process '
+                    'that recorded spans'.format(name))
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, self.process_peak_rss))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write text() to path atomically."""
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.text())
+        del f
+        replace(tmp, path)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental bag manifests
+"""
+
+from bagit import (_encode_filename, _make_tag_file, Bag, normalize_unicode,
+                   open_text_file)
+import hashlib
+import logging
+from os import (close, fsync as os_fsync, link, O_RDONLY, open as os_open,
+                replace, scandir, stat)
+from os.path import basename, dirname, join, relpath
+import shutil
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+LINK_MODES = ('hardlink', 'reflink')
+# linux/fs.h _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# scratch space in a bag (staging area, journal) that is never manifested
+WORK_DIR = '.accession'
+TMP_SUFFIX = '.tmp'
+
+
+def hash_file(path: str, algorithms: list) -> dict:
+    """Compute every requested digest of path in a single read."""
+    hashers = [(alg, hashlib.new(alg)) for alg in algorithms]
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            for alg, h in hashers:
+                h.update(block)
+    return {alg: h.hexdigest() for alg, h in hashers}
+
+
+def copy_and_hash(
+    src: str,
+    dst: str,
+    algorithms: list,
+    fsync: bool = False,
+    block_size: int = COPY_BLOCK_SIZE
+) -> dict:
+    """Copy src to dst like shutil.copy2, computing digests on the way.
+
+    The data is read once into a reusable buffer, fed to every hasher and
+    written out, so the copy does not have to be read back for the
+    manifests. Without algorithms the copy is left to shutil, which uses
+    the kernel's copy_file_range/sendfile where it can. With fsync the
+    file and its directory are flushed to disk before returning.
+    """
+    if not algorithms:
+        shutil.copyfile(src, dst)
+        digests = {}
+    else:
+        hashers = [(alg, hashlib.new(alg)) for alg in algorithms]
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        with open(src, 'rb', buffering=0) as fin, \
+                open(dst, 'wb', buffering=0) as fout:
+            while True:
+                n = fin.readinto(buf)
+                if not n:
+                    break
+                chunk = view[:n]
+                for alg, h in hashers:
+                    h.update(chunk)
+                written = 0
+                while written < n:
+                    written += fout.write(chunk[written:])
+        digests = {alg: h.hexdigest() for alg, h in hashers}
+    shutil.copystat(src, dst)
+    if fsync:
+        for path in (dst, dirname(dst) or '.'):
+            fsync_path(path)
+    return digests
+
+
+def fsync_path(path: str):
+    """Flush a file, or a directory's entries, to disk."""
+    fd = os_open(path, O_RDONLY)
+    try:
+        os_fsync(fd)
+    finally:
+        close(fd)
+
+
+def link_file(src: str, dst: str, mode: str = 'hardlink'):
+    """Make dst share src's data rather than copying it.
+
+    hardlink makes dst another name for the same inode. reflink asks the
+    filesystem (btrfs, XFS, ...) for a copy-on-write clone, and falls back
+    to an ordinary copy where cloning is not supported.
+    """
+    if mode == 'hardlink':
+        link(src, dst)
+    elif mode == 'reflink':
+        try:
+            if ioctl is None:
+                raise OSError('reflinks are not supported on this platform')
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError as e:
+            logger.debug(
+                'cannot reflink {}, copying instead: {}'.format(src, str(e)))
+            shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+    else:
+        raise ValueError('Unsupported link mode: "{}"'.format(mode))
+
+
+def _walk(path: str, root: str):
+    """Yield (bag-relative posix path, stat) for every file under path."""
+    entries = sorted(scandir(path), key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path, root)
+        elif entry.is_file():
+            yield (
+                relpath(entry.path, root).replace('\\', '/'),
+                entry.stat())
+
+
+def _tag_files(bag_path: str):
+    """Yield every file outside data/ except the tagmanifests themselves.
+
+    Temporary files left by an interrupted _write_atomic are skipped too.
+    """
+    for entry in sorted(scandir(bag_path), key=lambda e: e.name):
+        if (entry.name in ('data', WORK_DIR)
+                or entry.name.startswith('tagmanifest-')
+                or entry.name.endswith(TMP_SUFFIX)):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            for rel_path, st in _walk(entry.path, bag_path):
+                yield rel_path
+        elif entry.is_file():
+            yield entry.name
+
+
+class PayloadDigests(object):
+    """Known digests of payload files, keyed by bag-relative path.
+
+    Each entry remembers the size and mtime of the file when it was hashed,
+    so refresh() only reads files that are new or have changed since.
+
+    Given the bag just opened from disk, the sizes and mtimes of its
+    payload are noted, and if they add up to the bag's Payload-Oxum the
+    first refresh() takes the digests of files still unchanged since then
+    from its manifests, so a reopened bag is not rehashed. The manifests
+    themselves are only parsed at that point.
+    """
+
+    def __init__(self, bag_path: str, algorithms: list, bag: Bag = None):
+        self.bag_path = bag_path
+        self.algorithms = list(algorithms)
+        self.entries = {}
+        self.bytes_hashed = 0
+        self._bag = None
+        if bag is not None:
+            files = {
+                rel_path: (st.st_size, st.st_mtime_ns)
+                for rel_path, st in _walk(join(bag_path, 'data'), bag_path)}
+            oxum = '{}.{}'.format(
+                sum(size for size, mtime_ns in files.values()), len(files))
+            if bag.info.get('Payload-Oxum') == oxum:
+                self._bag = bag
+                self._opened = files
+            else:
+                logger.debug(
+                    '{}: payload does not match Payload-Oxum, not trusting '
+                    'the manifests'.format(bag_path))
+
+    def record(self, rel_path: str, digests: dict):
+        """Accept digests computed elsewhere, e.g. while copying a file."""
+        st = stat(join(self.bag_path, rel_path))
+        self.entries[rel_path] = (st.st_size, st.st_mtime_ns, dict(digests))
+
+    def refresh(self) -> tuple:
+        """Hash new or changed payload files and forget deleted ones.
+
+        Returns the Payload-Oxum pair (total bytes, file count).
+        """
+        current = {}
+        total_bytes = 0
+        files = list(_walk(join(self.bag_path, 'data'), self.bag_path))
+        if self._bag is not None:
+            self._seed(files)
+        for rel_path, st in files:
+            total_bytes += st.st_size
+            try:
+                size, mtime_ns, digests = self.entries[rel_path]
+            except KeyError:
+                digests = None
+            else:
+                if (size != st.st_size or mtime_ns != st.st_mtime_ns
+                        or not all(a in digests for a in self.algorithms)):
+                    digests = None
+            if digests is None:
+                logger.debug('hashing {}'.format(rel_path))
+                digests = hash_file(
+                    join(self.bag_path, rel_path), self.algorithms)
+                self.bytes_hashed += st.st_size
+            current[rel_path] = (st.st_size, st.st_mtime_ns, digests)
+        self.entries = current
+        return total_bytes, len(current)
+
+    def _seed(self, files: list):
+        """Take manifest digests for files unchanged since the bag opened."""
+        bag = self._bag
+        self._bag = None
+        for rel_path, st in files:
+            if (rel_path in self.entries or self._opened.get(rel_path)
+                    != (st.st_size, st.st_mtime_ns)):
+                continue
+            digests = bag.entries.get(rel_path)
+            if digests and all(a in digests for a in self.algorithms):
+                self.entries[rel_path] = (
+                    st.st_size, st.st_mtime_ns, dict(digests))
+
+
+class LazyBag(Bag):
+    """A Bag that reads bag-info when opened and its manifests when used.
+
+    Opening only reads bagit.txt and bag-info.txt; the algorithms are
+    taken from the manifest file names. Manifests and tagmanifests are
+    parsed the first time entries (or the normalized manifest names) are
+    needed, e.g. to validate the bag or save it without new manifests.
+    """
+
+    def _load_manifests(self):
+        self._entries = None
+        self._normalized_manifest_names = {}
+        for path in list(self.manifest_files()) + list(
+                self.tagmanifest_files()):
+            alg = basename(path).split('-', 1)[1][:-len('.txt')]
+            if alg not in self.algorithms:
+                self.algorithms.append(alg)
+
+    @property
+    def manifests_loaded(self) -> bool:
+        return self._entries is not None
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            Bag._load_manifests(self)
+        return self._entries
+
+    @entries.setter
+    def entries(self, value: dict):
+        self._entries = value
+
+    @property
+    def normalized_manifest_names(self) -> dict:
+        if self._entries is None:
+            Bag._load_manifests(self)
+        return self._normalized_manifest_names
+
+    @normalized_manifest_names.setter
+    def normalized_manifest_names(self, value: dict):
+        self._normalized_manifest_names = value
+
+
+def _write_atomic(path: str, lines: list, encoding: str):
+    tmp = path + TMP_SUFFIX
+    with open_text_file(tmp, 'w', encoding=encoding) as f:
+        f.writelines(lines)
+    replace(tmp, path)
+
+
+def save_bag(bag, digests: PayloadDigests, manifests: bool = False):
+    """Persist bag-info and manifests without rehashing unchanged payload.
+
+    A drop-in for bag.save(): payload manifests (when manifests is True)
+    come from digests, and every tag file is read once to compute all of
+    the tagmanifest digests together.
+    """
+    entries = {}
+    if manifests:
+        total_bytes, total_files = digests.refresh()
+        bag.info['Payload-Oxum'] = '{}.{}'.format(total_bytes, total_files)
+        for alg in bag.algorithms:
+            lines = []
+            for rel_path, (size, mtime, d) in digests.entries.items():
+                lines.append('{}  {}\n'.format(
+                    d[alg], _encode_filename(rel_path)))
+            _write_atomic(
+                join(bag.path, 'manifest-{}.txt'.format(alg)), lines,
+                bag.encoding)
+        for rel_path, (size, mtime, d) in digests.entries.items():
+            entries[rel_path] = {a: d[a] for a in bag.algorithms}
+    else:
+        entries.update(bag.payload_entries())
+    _make_tag_file(join(bag.path, bag.tag_file_name), bag.info)
+    tag_lines = {alg: [] for alg in bag.algorithms}
+    for rel_path in _tag_files(bag.path):
+        d = hash_file(join(bag.path, rel_path), bag.algorithms)
+        entries[rel_path] = d
+        for alg in bag.algorithms:
+            tag_lines[alg].append(
+                '{} {}\n'.format(d[alg], _encode_filename(rel_path)))
+    for alg, lines in tag_lines.items():
+        _write_atomic(
+            join(bag.path, 'tagmanifest-{}.txt'.format(alg)), lines,
+            bag.encoding)
+    bag.entries = entries
+    bag.normalized_manifest_names = {
+        normalize_unicode(p): p for p in entries.keys()}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Master TIFF generation within a memory ceiling
+"""
+
+import logging
+from moondog.color import CONVERTIBLE_MODES, srgb_profile, to_working_space
+from moondog.color import transforms
+from moondog.instrument import span
+from os.path import getsize
+from PIL import Image
+
+try:
+    import numpy
+    import tifffile
+except ImportError:
+    numpy = None
+    tifffile = None
+    TIFF_PHOTOMETRICS = ()
+else:
+    TIFF_PHOTOMETRICS = (
+        tifffile.PHOTOMETRIC.MINISWHITE, tifffile.PHOTOMETRIC.MINISBLACK,
+        tifffile.PHOTOMETRIC.RGB, tifffile.PHOTOMETRIC.SEPARATED)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+DEFAULT_TILE_SIZE = 512
+COMPRESSION_PILLOW = {
+    None: None,
+    'lzw': 'tiff_lzw',
+    'deflate': 'tiff_adobe_deflate',
+    'zstd': 'zstd'
+}
+COMPRESSION_TIFFFILE = {
+    None: None,
+    'lzw': 'lzw',
+    'deflate': 'zlib',
+    'zstd': 'zstd'
+}
+# bytes per sample of Pillow modes other than one byte per band
+SAMPLE_BYTES = {'I;16': 2, 'I;16B': 2, 'I;16L': 2, 'I;16N': 2, 'I': 4, 'F': 4}
+# little- and big-endian classic TIFF and BigTIFF
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+
+
+class MasterTooLarge(RuntimeError):
+    """The source cannot be mastered within the memory limit."""
+
+
+def generate_master(
+    src: str,
+    dst: str,
+    compression: str = None,
+    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    working_profile: bytes = None
+) -> None:
+    """Write a master TIFF for src at dst.
+
+    Images whose decoded size fits within memory_limit bytes are written
+    by Pillow as before. Larger TIFFs are written as tiled BigTIFF one tile
+    at a time with tifffile, read directly memory-mapped or decoded into a
+    temporary memory-mapped file, so the decoded raster never has to be
+    resident; TIFFs are recognised before Pillow opens them, so they are
+    not subject to its decompression bomb limit. Other formats need a full
+    Pillow decode, which still happens over memory_limit (with a warning)
+    as it always has; only Pillow's own decompression bomb limit raises
+    MasterTooLarge. Bit depth and ICC profile are carried over in every
+    case.
+
+    With a working_profile, 8-bit RGB and CMYK images are converted into
+    it (see moondog.color); ImageCms cannot convert 16-bit data, so those
+    masters keep their source profile.
+    """
+    if compression not in COMPRESSION_PILLOW:
+        raise ValueError(
+            'Unsupported master compression: "{}"'.format(compression))
+    if tifffile is not None and _is_tiff(src):
+        if _master_from_tiff(
+                src, dst, compression, memory_limit, tile_size,
+                working_profile):
+            return None
+    try:
+        im = Image.open(src)
+    except Image.DecompressionBombError as e:
+        raise MasterTooLarge('{}: {}'.format(src, str(e)))
+    size = (im.width * im.height * len(im.getbands())
+            * SAMPLE_BYTES.get(im.mode, 1))
+    if size > memory_limit:
+        logger.warning(
+            '{} will take {} bytes to decode, over the memory limit of {}; '
+            'only TIFF sources (with numpy and tifffile) are streamed'
+            ''.format(src, size, memory_limit))
+    kwargs = {}
+    if compression is not None:
+        kwargs['compression'] = COMPRESSION_PILLOW[compression]
+    with span('decode', path=src):
+        im.load()
+    if working_profile is not None:
+        im = to_working_space(im, working_profile)
+    with span('encode', path=dst) as s:
+        im.save(dst, format='TIFF', **kwargs)
+        s.bytes = getsize(dst)
+    return None
+
+
+def _is_tiff(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(4) in TIFF_SIGNATURES
+
+
+def _converter(mode: str, icc: bytes, working_profile: bytes) -> tuple:
+    """Return (tile conversion function or None, resulting Pillow mode)."""
+    if working_profile is None:
+        return None, mode
+    try:
+        out_mode = CONVERTIBLE_MODES[mode]
+    except KeyError:
+        logger.warning(
+            'cannot convert mode {} image to working space; leaving its '
+            'colour untouched'.format(mode))
+        return None, mode
+    transform = transforms.get(
+        icc or srgb_profile(), working_profile, mode, out_mode)
+    return transform.apply, out_mode
+
+
+def _array_tiles(data, tile_size: int, convert=None, mode: str = None):
+    for y in range(0, data.shape[0], tile_size):
+        for x in range(0, data.shape[1], tile_size):
+            tile = numpy.ascontiguousarray(
+                data[y:y + tile_size, x:x + tile_size])
+            if convert is not None:
+                tile = numpy.asarray(convert(Image.frombytes(
+                    mode, (tile.shape[1], tile.shape[0]), tile.tobytes())))
+            yield tile
+
+
+def _pillow_mode(page) -> str:
+    """The Pillow mode matching an 8-bit TIFF page, if ImageCms takes it."""
+    if page.dtype != numpy.uint8 or page.planarconfig != 1:
+        return None
+    if page.photometric == tifffile.PHOTOMETRIC.RGB:
+        return {3: 'RGB', 4: 'RGBA'}.get(page.samplesperpixel)
+    if (page.photometric == tifffile.PHOTOMETRIC.SEPARATED
+            and page.samplesperpixel == 4):
+        return 'CMYK'
+    return None
+
+
+def _master_from_tiff(
+    src: str,
+    dst: str,
+    compression: str,
+    memory_limit: int,
+    tile_size: int,
+    working_profile: bytes
+) -> bool:
+    """Copy the first page of a TIFF; False to leave it to Pillow instead."""
+    with tifffile.TiffFile(src) as tif:
+        page = tif.pages[0]
+        if page.photometric not in TIFF_PHOTOMETRICS:
+            return False
+        tiled = page.nbytes > memory_limit
+        mode = _pillow_mode(page)
+        if working_profile is not None and not tiled and mode is not None:
+            # small 8-bit rasters are converted by Pillow in one go
+            return False
+        if tiled:
+            data = page.asarray(out='memmap')
+        else:
+            data = page.asarray()
+        kwargs = {
+            'photometric': page.photometric,
+            'extrasamples': page.extrasamples,
+            'iccprofile': page.iccprofile,
+            'compression': COMPRESSION_TIFFFILE[compression],
+            'metadata': None
+        }
+        planar_separate = (
+            page.planarconfig == tifffile.PLANARCONFIG.SEPARATE
+            and data.ndim == 3)
+    convert = None
+    if working_profile is not None:
+        if mode is None:
+            logger.warning(
+                'cannot convert {} ({} {}) to working space; leaving its '
+                'colour untouched'.format(
+                    src, page.dtype, page.photometric.name))
+        else:
+            convert, out_mode = _converter(
+                mode, page.iccprofile, working_profile)
+            kwargs['photometric'] = 'rgb'
+            kwargs['iccprofile'] = working_profile
+            if out_mode != mode:
+                kwargs['extrasamples'] = ()
+    if not tiled:
+        if planar_separate:
+            kwargs['planarconfig'] = 'separate'
+        tifffile.imwrite(dst, data, **kwargs)
+        return True
+    if planar_separate:
+        data = numpy.moveaxis(data, 0, -1)
+    shape = data.shape
+    if convert is not None and mode == 'CMYK':
+        shape = shape[:2] + (3,)
+    logger.debug('streaming {} as tiled BigTIFF {}'.format(src, dst))
+    tifffile.imwrite(
+        dst,
+        _array_tiles(data, tile_size, convert, mode),
+        shape=shape,
+        dtype=data.dtype,
+        tile=(tile_size, tile_size),
+        bigtiff=True,
+        **kwargs)
+    del data
+    return True
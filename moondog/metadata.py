@@ -6,11 +6,11 @@ Metadata management for moondog
 
 import better_exceptions
 from enum import Enum, auto
-import inspect
+from functools import lru_cache
 import json
-import language_tags
 from libxmp.core import XMPMeta, XMPIterator
-from libxmp.consts import XMP_NS_DC
+from libxmp.consts import (XMP_NS_DC, XMP_NS_IPTCCore, XMP_NS_Photoshop,
+                           XMP_NS_XMP_Rights)
 import logging
 # from lxml import etree
 from os.path import (basename, expanduser, expandvars, join, normpath,
@@ -18,12 +18,31 @@ from os.path import (basename, expanduser, expandvars, join, normpath,
 from pprint import pprint
 import re
 import string
+from sys import intern
 from validators import url
 
 logger = logging.getLogger(__name__)
+LANGUAGE_TAG_CACHE_SIZE = 1024
+URI_CACHE_SIZE = 65536
+# controlled vocabularies whose identifiers can be checked without the full
+# URL grammar: anything under these prefixes with a plain path is valid
+AUTHORITY_PREFIXES = (
+    'http://vocab.getty.edu/',
+    'https://vocab.getty.edu/',
+    'http://id.loc.gov/',
+    'https://id.loc.gov/',
+    'http://www.wikidata.org/entity/',
+    'https://www.wikidata.org/entity/',
+    'http://orcid.org/',
+    'https://orcid.org/',
+    'http://viaf.org/viaf/',
+    'https://viaf.org/viaf/',
+    'http://sws.geonames.org/',
+    'https://sws.geonames.org/',
+    'https://pleiades.stoa.org/places/',
+)
 punct_translator = str.maketrans('', '', string.punctuation)
-rx_dcterm = re.compile(
-    r'^dc:(?P<term>[a-z]+)(\[(?P<index>\d+)\])?(/\?(?P<attr>.+))?$')
+rx_authority_path = re.compile(r'[A-Za-z0-9._~\-/]+')
 rx_rights = re.compile(
     r'^(copyright|©|©️|\(c\))\s+(?P<years>[\d\-]+)\s+(by\s+)?(?P<name>.+)$',
     re.IGNORECASE)
@@ -59,61 +78,156 @@ class ImageFormat(Enum):
 
 
 class GetDict(object):
-    """Superclass for dictionary serialization."""
+    """Superclass for dictionary serialization.
+
+    Subclasses declare the attributes to serialize in _fields (slotted
+    classes must, having no __dict__ to introspect); otherwise
+    the public attributes of the first instance serialized are used. The
+    schema and the serializer for each value type are worked out once per
+    class and cached.
+    """
+
+    __slots__ = ()
+    _fields = None
 
     def __init__(self):
         pass
 
     def get_dict(self) -> dict:
-        members = inspect.getmembers(self, lambda a: not(inspect.isroutine(a)))
-        members = [a for a in members if (
-            not(a[0].startswith('__') and a[0].endswith('__')))]
         d = {}
-        for name, value in members:
-            if isinstance(value, str):
-                d[name] = value
-            elif isinstance(value, list):
-                d[name] = []
-                for i, item in enumerate(value):
-                    if type(item) in [Agent, Name, Title]:
-                        d[name].append(item.get_dict())
-                    else:
-                        raise NotImplementedError(
-                            'no way: {}'.format(type(item)))
-            elif type(value) in [NameType, RoleTerm, TitleType]:
-                d[name] = value.value
-            else:
-                raise NotImplementedError('nope')
+        for name in _schema(type(self), self):
+            try:
+                value = getattr(self, name)
+            except AttributeError:
+                continue
+            d[name] = _serializer(type(value))(value)
         return d
 
 
+_schemas = {}
+_serializers = {}
+
+
+def _schema(cls: type, instance: GetDict) -> tuple:
+    try:
+        return _schemas[cls]
+    except KeyError:
+        pass
+    if cls._fields is not None:
+        fields = tuple(cls._fields)
+    else:
+        fields = tuple(sorted(
+            name for name in vars(instance) if not name.startswith('_')))
+    _schemas[cls] = fields
+    return fields
+
+
+def _identity(value):
+    return value
+
+
+def _enum_value(value: Enum):
+    return value.value
+
+
+def _get_dict(value: GetDict) -> dict:
+    return value.get_dict()
+
+
+def _serialize_list(value: list) -> list:
+    return [_serializer(type(item))(item) for item in value]
+
+
+def _serializer(cls: type):
+    """Return the function that serializes values of type cls."""
+    try:
+        return _serializers[cls]
+    except KeyError:
+        pass
+    if issubclass(cls, GetDict):
+        f = _get_dict
+    elif issubclass(cls, Enum):
+        f = _enum_value
+    elif issubclass(cls, (str, int, float, bool, type(None))):
+        f = _identity
+    elif issubclass(cls, (list, tuple)):
+        f = _serialize_list
+    else:
+        raise NotImplementedError(
+            'no way to serialize: {}'.format(cls))
+    _serializers[cls] = f
+    return f
+
+
+@lru_cache(maxsize=LANGUAGE_TAG_CACHE_SIZE)
+def canonical_language_tag(lang: str) -> str:
+    """Validate a BCP 47 language tag and return it in canonical case.
+
+    Results are cached, and the language-tags registry is only imported
+    the first time a tag is validated, not when this module is imported.
+    """
+    from language_tags import tags
+    tag = tags.tag(lang)
+    if not tag.valid:
+        raise ValueError(
+            'Invalid language tag: "{}"'.format(lang))
+    return intern(tag.format)
+
+
+@lru_cache(maxsize=URI_CACHE_SIZE)
+def valid_uri(uri: str) -> bool:
+    """Check a URI, trying known authority prefixes before validators.url.
+
+    Results are cached, since vocabularies repeat the same URIs endlessly.
+    """
+    for prefix in AUTHORITY_PREFIXES:
+        if uri.startswith(prefix):
+            if rx_authority_path.fullmatch(uri, len(prefix)):
+                return True
+            break
+    return bool(url(uri))
+
+
+def invalid_uris(uris: list) -> list:
+    """Return the members of uris that are not valid, in order."""
+    verdicts = {uri: valid_uri(uri) for uri in set(uris)}
+    return [uri for uri in uris if not verdicts[uri]]
+
+
 class LanguageAware(object):
     """Superclass for providing language awareness to other classes."""
 
+    __slots__ = ('lang',)
+
     def __init__(self, lang: str = 'und', **kwargs):
-        tag = language_tags.tags.check(lang)
-        if not tag:
-            raise ValueError(
-                'Invalid language tag: "{}"'.format(tag))
-        self.lang = lang
+        self.lang = canonical_language_tag(lang)
 
 
 class SortAware(object):
-    """Superclass for providing sortability information to other classes."""
+    """Superclass for providing sortability information to other classes.
+
+    Only one base of a class may add slots, and LanguageAware already does,
+    so subclasses must provide the sort_val slot themselves.
+    """
+
+    __slots__ = ()
 
     def __init__(self, sort_val: str, force: bool = False, **kwargs):
         logger.debug('sort_val: "{}"'.format(sort_val))
         logger.debug('force: {}'.format(force))
         if force:
-            self.sort_val = sort_val
+            self.sort_val = intern(sort_val)
         else:
-            self.sort_val = sort_val.translate(punct_translator).lower().\
-                            replace(' ', '')
+            self.sort_val = intern(
+                sort_val.translate(punct_translator).lower().replace(' ', ''))
         logger.debug('resulting sort_val: "{}"'.format(self.sort_val))
 
 
 class Name(LanguageAware, SortAware, GetDict):
 
+    __slots__ = ('full_name', 'display_name', 'sort_val', 'name_type')
+    _fields = ('full_name', 'display_name', 'sort_val', 'name_type', 'lang')
+
     def __init__(
         self,
         full_name: str,
@@ -144,6 +258,9 @@ class Name(LanguageAware, SortAware, GetDict):
 
 class Agent(GetDict):
 
+    __slots__ = ('names', 'role', 'uris')
+    _fields = ('names', 'role', 'uris')
+
     def __init__(
         self,
         names: list,
@@ -163,13 +280,12 @@ class Agent(GetDict):
         self.role = role
         self.uris = []
         if uris is not None:
-            for uri in uris:
-                if url(uri):
-                    self.uris.append(uri)
-                else:
-                    raise ValueError(
-                        'URI value is not valid: "{}"'
-                        ''.format(uri))
+            invalid = invalid_uris(uris)
+            if invalid:
+                raise ValueError(
+                    'URI value is not valid: "{}"'
+                    ''.format(invalid[0]))
+            self.uris.extend(uris)
 
     def __str__(self):
         return '{}: {}'.format(self.role.value, self.names[0].full_name)
@@ -177,6 +293,9 @@ class Agent(GetDict):
 
 class Copyright(GetDict):
 
+    __slots__ = ('statement', 'years', 'holder')
+    _fields = ('statement', 'years', 'holder')
+
     def __init__(
         self,
         statement: str = None,
@@ -184,11 +303,16 @@ class Copyright(GetDict):
         holder: Agent = None,
         **kwargs
     ):
-        pass
+        self.statement = statement
+        self.years = years
+        self.holder = holder
 
 
 class Description(LanguageAware, SortAware, GetDict):
 
+    __slots__ = ('value', 'sort_val')
+    _fields = ('value', 'sort_val', 'lang')
+
     def __init__(
         self,
         value: str,
@@ -206,17 +330,21 @@ class Description(LanguageAware, SortAware, GetDict):
 
 class Keyword(LanguageAware, SortAware, GetDict):
 
+    __slots__ = ('value', 'uri', 'sort_val')
+    _fields = ('value', 'uri', 'sort_val', 'lang')
+
     def __init__(
         self,
         value: str,
         uri: str = None,
         **kwargs
     ):
-        self.value = value
+        # keyword vocabularies repeat heavily; share one copy of each string
+        self.value = intern(value)
         if uri is None:
             self.uri = uri
-        elif url(uri):
-            self.uri = uri
+        elif valid_uri(uri):
+            self.uri = intern(uri)
         else:
             raise ValueError(
                 'URI value is not valid: "{}"'
@@ -232,17 +360,25 @@ class Keyword(LanguageAware, SortAware, GetDict):
 
 class License(GetDict):
 
+    __slots__ = ('title', 'url', 'short_title')
+    _fields = ('title', 'url', 'short_title')
+
     def __init__(
         self,
         title: str = None,
         url: str = None,
         short_title: str = None
     ):
-        pass
+        self.title = title
+        self.url = url
+        self.short_title = short_title
 
 
 class Title(LanguageAware, SortAware, GetDict):
 
+    __slots__ = ('value', 'title_type', 'sort_val')
+    _fields = ('value', 'title_type', 'sort_val', 'lang')
+
     def __init__(
         self,
         title_val: str,
@@ -260,8 +396,66 @@ class Title(LanguageAware, SortAware, GetDict):
         LanguageAware.__init__(self, **kwargs)
 
 
+class XMPTerm(object):
+    """How to turn the items of one XMP property into metadata objects.
+
+    key names the constructor argument that receives the property value
+    (an xml:lang qualifier becomes lang); build makes the object from the
+    collected arguments; attribute is the DescriptiveMetadata list it goes
+    into.
+    """
+
+    __slots__ = ('attribute', 'key', 'build')
+
+    def __init__(self, attribute: str, key: str, build):
+        self.attribute = attribute
+        self.key = key
+        self.build = build
+
+
+def _build_copyright(d: dict) -> Copyright:
+    m = rx_rights.match(d['statement'])
+    if m is None:
+        raise RuntimeError('rx failure on rights!')
+    return Copyright(
+        statement=d['statement'],
+        years=m.group('years'),
+        holder=Agent(names=[Name(m.group('name'))]))
+
+
+LANG_QUALIFIER = '/?xml:lang'
+XMP_TERMS = {
+    XMP_NS_DC: {
+        'creator': XMPTerm(
+            'agents', 'full_name', lambda d: Agent([Name(**d)])),
+        'description': XMPTerm(
+            'descriptions', 'value', lambda d: Description(**d)),
+        'format': None,
+        'rights': XMPTerm('copyright', 'statement', _build_copyright),
+        'subject': XMPTerm('keywords', 'value', lambda d: Keyword(**d)),
+        'title': XMPTerm('titles', 'title_val', lambda d: Title(**d)),
+    },
+    XMP_NS_Photoshop: {
+        'Headline': XMPTerm(
+            'titles', 'title_val',
+            lambda d: Title(title_type=TitleType.SHORT, **d)),
+    },
+    XMP_NS_IPTCCore: {
+        'AltTextAccessibility': XMPTerm(
+            'descriptions', 'value', lambda d: Description(**d)),
+    },
+    XMP_NS_XMP_Rights: {
+        'Owner': XMPTerm(
+            'copyright', 'full_name',
+            lambda d: Copyright(holder=Agent([Name(d['full_name'])]))),
+    },
+}
+
+
 class DescriptiveMetadata(GetDict):
 
+    _fields = ('agents', 'copyright', 'descriptions', 'keywords', 'titles')
+
     def __init__(self, **kwargs):
         self.agents = []
         self.copyright = []
@@ -332,107 +526,71 @@ class DescriptiveMetadata(GetDict):
                         ''.format(type(a)))
 
     def parse_xmp(self, xmp: XMPMeta) -> None:
-        self._parse_xmp_dc(xmp)
-
-    def _parse_xmp_dc(self, xmp: XMPMeta) -> None:
-        creators = []
-        descriptions = []
-        keywords = []
-        rights = []
-        titles = []
-        for p in XMPIterator(xmp, XMP_NS_DC):
-            if p[1] == '':
+        self.parse_xmp_properties(
+            (p[0], p[1], p[2])
+            for ns in XMP_TERMS.keys() for p in XMPIterator(xmp, ns))
+
+    def parse_xmp_properties(self, properties) -> None:
+        """Add metadata from (namespace, path, value) XMP properties.
+
+        Each property is dispatched on its namespace and term through
+        XMP_TERMS; properties of other terms, including the fields of
+        struct arrays such as photoshop:TextLayers, are skipped.
+        """
+        items = {}
+        for ns, path, value in properties:
+            if path == '':
+                continue
+            term = path[path.index(':') + 1:]
+            is_lang = term.endswith(LANG_QUALIFIER)
+            if is_lang:
+                term = term[:-len(LANG_QUALIFIER)]
+            elif value == '':
+                # array nodes and blank items carry no value
+                continue
+            qualifier = term.find('/?')
+            if qualifier != -1:
+                term = term[:qualifier]
+            bracket = term.find('[')
+            name = term if bracket == -1 else term[:bracket]
+            try:
+                handler = XMP_TERMS[ns][name]
+            except KeyError:
+                logger.debug(
+                    'untreated XMP property: {}="{}"'.format(path, value))
+                continue
+            if handler is None:
                 continue
-            m = rx_dcterm.match(p[1])
-            if m is None:
-                raise RuntimeError('DC term match failure')
-            i = m.group('index')
-            if i is None:
+            if qualifier != -1:
+                raise RuntimeError(
+                    'unexpected attr in "{}"'.format(path))
+            if bracket == -1:
                 i = 0
             else:
-                i = int(i)
-            attr = m.group('attr')
-            if attr is None:
-                if p[2] == '':
-                    # initial item is often blank for some reason
+                close = term.index(']', bracket)
+                if close != len(term) - 1:
+                    logger.debug(
+                        'untreated XMP property: {}="{}"'.format(path, value))
                     continue
-            elif attr == 'xml:lang':
-                if p[2] == 'x-default':
-                    lang = 'und'
-                else:
-                    lang = p[2]
-            else:
-                raise RuntimeError(
-                    'unexpected attr = "{}"'
-                    ''.format(attr))
-            term = m.group('term')
-
-            if term == 'creator':
-                while len(creators) < i + 1:
-                    creators.append({})
-                if attr is None:
-                    creators[i]['full_name'] = p[2]
-                elif attr == 'xml:lang':
-                    creators[i]['lang'] = lang
-
-            elif term == 'description':
-                while len(descriptions) < i + 1:
-                    descriptions.append({})
-                if attr is None:
-                    descriptions[i]['value'] = p[2]
-                elif attr == 'xml:lang':
-                    creators[i]['lang'] = lang
-
-            elif term == 'format':
-                # ignore format
-                pass
-
-            elif term == 'rights':
-                while len(rights) < i + 1:
-                    rights.append({})
-                if attr is None:
-                    m = rx_rights.match(p[2])
-                    if m is None:
-                        raise RuntimeError('rx failure on rights!')
-                    rights[i]['statement'] = p[2]
-                    rights[i]['holder'] = Agent(names=[Name(m.group('name'))])
-                    rights[i]['years'] = m.group('years')
-                elif attr == 'xml:lang':
-                    rights[i]['lang'] = lang
-
-            elif term == 'subject':
-                while len(keywords) < i + 1:
-                    keywords.append({})
-                if attr is None:
-                    keywords[i]['value'] = p[2]
-                elif attr == 'xml:lang':
-                    keywords[i]['lang'] = lang
-
-            elif term == 'title':
-                while len(titles) < i + 1:
-                    titles.append({})
-                if attr is None:
-                    titles[i]['title_val'] = p[2]
-                elif attr == 'xml:lang':
-                    titles[i]['lang'] = lang
-
+                i = int(term[bracket + 1:close])
+            try:
+                bucket = items[(ns, name)]
+            except KeyError:
+                bucket = items[(ns, name)] = []
+            if i >= len(bucket):
+                bucket.extend([None] * (i + 1 - len(bucket)))
+            d = bucket[i]
+            if d is None:
+                d = bucket[i] = {}
+            if is_lang:
+                d['lang'] = 'und' if value == 'x-default' else value
             else:
-                print('untreated term:')
-                if attr is None:
-                    print('\t{}="{}"'.format(term, p[2]))
-                else:
-                    print('\t{}@{}="{}"'.format(term, attr, p[2]))
-
-        creators = [c for c in creators if len(c) != 0]
-        descriptions = [d for d in descriptions if len(d) != 0]
-        keywords = [k for k in keywords if len(k) != 0]
-        rights = [r for r in rights if len(r) != 0]
-        titles = [t for t in titles if len(t) != 0]
-        self.agents.extend([Agent([Name(**c)]) for c in creators])
-        self.descriptions.extend([Description(**d) for d in descriptions])
-        self.keywords.extend([Keyword(**k) for k in keywords])
-        self.copyright.extend([Copyright(**r) for r in rights])
-        self.titles.extend([Title(**t) for t in titles])
+                d[handler.key] = value
+        for (ns, term), bucket in items.items():
+            handler = XMP_TERMS[ns][term]
+            getattr(self, handler.attribute).extend(
+                handler.build(d) for d in bucket
+                if d is not None and handler.key in d)
 
     def write_json(self, path: str):
         d = self.get_dict()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perceptual hashes and near-duplicate search
+"""
+
+from itertools import combinations
+import logging
+from moondog.derivatives import open_scaled
+from PIL import Image
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+# multi-index hashing cuts each hash into chunks of these many bits; three
+# chunks keep both the buckets near a probe and the rows in each bucket few
+# for up to a few million stored hashes
+CHUNK_BITS = (22, 21, 21)
+HASH_ALGORITHMS = ('dhash', 'phash')
+# decoding previews this big is plenty for a 32 x 32 DCT
+DECODE_SIZE = 128
+
+
+def dhash(im: Image.Image) -> int:
+    """64-bit difference hash: is each pixel brighter than its neighbour?"""
+    pixels = im.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    h = 0
+    for row in range(8):
+        for col in range(8):
+            h = (h << 1) | (
+                pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return h
+
+
+def phash(im: Image.Image) -> int:
+    """64-bit DCT hash: low frequencies above or below their median."""
+    if numpy is None:
+        raise RuntimeError('phash requires numpy')
+    pixels = numpy.asarray(
+        im.convert('L').resize((32, 32), Image.LANCZOS), dtype=numpy.float64)
+    n = numpy.arange(32)
+    dct = numpy.cos(numpy.pi * (2 * n[None, :] + 1) * n[:, None] / 64)
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+    bits = low > numpy.median(low[1:])
+    h = 0
+    for bit in bits:
+        h = (h << 1) | int(bit)
+    return h
+
+
+def image_hash(path: str, algorithm: str = 'dhash') -> str:
+    """Hash the image at path from a reduced decode, e.g. 'dhash:8f...'."""
+    try:
+        function = {'dhash': dhash, 'phash': phash}[algorithm]
+    except KeyError:
+        raise ValueError(
+            'Unsupported perceptual hash: "{}"'.format(algorithm))
+    with open_scaled(path, DECODE_SIZE) as im:
+        return format_hash(algorithm, function(im))
+
+
+def format_hash(algorithm: str, h: int) -> str:
+    return '{}:{:016x}'.format(algorithm, h)
+
+
+def parse_hash(value: str) -> tuple:
+    """Split 'dhash:8f...' into ('dhash', int)."""
+    algorithm, sep, digits = value.partition(':')
+    if not sep or algorithm not in HASH_ALGORITHMS:
+        raise ValueError('Invalid perceptual hash: "{}"'.format(value))
+    return algorithm, int(digits, 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def hash_chunks(h: int) -> list:
+    """h cut into runs of CHUNK_BITS bits, lowest first."""
+    chunks = []
+    for bits in CHUNK_BITS:
+        chunks.append(h & ((1 << bits) - 1))
+        h >>= bits
+    return chunks
+
+
+def chunk_flips(max_distance: int) -> list:
+    """For each chunk, XOR masks that change up to r of its bits.
+
+    r is max_distance // len(CHUNK_BITS): two hashes within max_distance
+    of each other must agree to within r bits on at least one chunk
+    (pigeonhole), so only chunk values within these masks of a probe's
+    need looking at.
+    """
+    radius = max_distance // len(CHUNK_BITS)
+    all_flips = []
+    for chunk_bits in CHUNK_BITS:
+        flips = [0]
+        for r in range(1, radius + 1):
+            for bits in combinations(range(chunk_bits), r):
+                flips.append(sum(1 << b for b in bits))
+        all_flips.append(flips)
+    return all_flips
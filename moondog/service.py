@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-running accession service fed by a drop folder
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+from moondog.batch import IMAGE_EXTENSIONS
+from moondog.exif import ExifToolPool
+from moondog.images import accession_in_progress, ImageBag
+from moondog.index import CollectionIndex
+from os import cpu_count, makedirs, replace, scandir
+from os.path import (basename, exists, expanduser, expandvars, join, normpath,
+                     realpath, splitext)
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_IO_WORKERS = 4
+DEFAULT_EXIF_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 2.0
+# ImageBag options that the master stage needs in its worker process
+MASTER_OPTIONS = (
+    'derivatives', 'master_compression', 'memory_limit', 'pyramid', 'tiles',
+    'working_profile')
+
+
+class StageStats(object):
+    """Counters for one pipeline stage.
+
+    wait is the time items spent queued for the stage and latency the
+    time the stage then spent on them, both in seconds.
+    """
+
+    def __init__(self, name: str, queue: asyncio.Queue):
+        self.name = name
+        self.queue = queue
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait = 0.0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def record(self, wait: float, latency: float, ok: bool):
+        self.wait += wait
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if ok:
+            self.processed += 1
+        else:
+            self.failed += 1
+
+    def get_dict(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            'depth': self.depth,
+            'capacity': self.queue.maxsize,
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'failed': self.failed,
+            'mean_wait': self.wait / done if done else 0.0,
+            'mean_latency': self.latency / done if done else 0.0,
+            'max_latency': self.max_latency
+        }
+
+    def __str__(self):
+        d = self.get_dict()
+        return (
+            '{}: {}/{} queued, {} running, {} done, {} failed, '
+            'wait {:.2f}s, latency {:.2f}s (max {:.2f}s)'.format(
+                self.name, d['depth'], d['capacity'], d['in_flight'],
+                d['processed'], d['failed'], d['mean_wait'],
+                d['mean_latency'], d['max_latency']))
+
+
+def _master_job(bag_path: str, original: str, options: dict) -> str:
+    """Make the master (and derivatives) of a bag in a worker process."""
+    # the journal carries the digests from the copy stage, so the original
+    # is not hashed again
+    im = ImageBag(bag_path, **options)
+    im._run_steps(original)
+    im._finish_accession()
+    return bag_path
+
+
+class AccessionService(object):
+    """Accession originals through three bounded, concurrent stages.
+
+    copy: copy and hash each original into a new bag (threads, I/O bound)
+    metadata: extract its metadata through a pool of exiftool processes
+    master: make the master and any derivatives in a process pool
+
+    Every stage takes its work from a queue of queue_size items, and an
+    item only leaves a stage once the next queue has room, so a burst of
+    submissions is held back at submit() rather than piling up in memory.
+    stats() reports each stage's queue depth, throughput and latency.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        index: str = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        io_workers: int = DEFAULT_IO_WORKERS,
+        exif_workers: int = DEFAULT_EXIF_WORKERS,
+        cpu_workers: int = None,
+        done: str = None,
+        exiftool: ExifToolPool = None,
+        **bag_options
+    ):
+        self.destination = realpath(expanduser(expandvars(normpath(
+            destination))))
+        makedirs(self.destination, exist_ok=True)
+        self.index = None if index is None else CollectionIndex(index)
+        # make_bag changes the working directory, so resolve done now
+        self.done = None if done is None else realpath(expanduser(
+            expandvars(normpath(done))))
+        # a pool passed in belongs to the caller, who closes it
+        self.exiftool = exiftool
+        self._own_exiftool = exiftool is None
+        self.bag_options = bag_options
+        self.io_workers = io_workers
+        self.exif_workers = exif_workers
+        self.cpu_workers = cpu_workers or cpu_count() or 1
+        self.queue_size = queue_size
+        self.failures = []
+        self.accessioned = []
+        self._reserved = set()
+        self._started = False
+
+    def start(self):
+        """Create the queues and stage workers on the running loop."""
+        if self._started:
+            return
+        self._started = True
+        if self._own_exiftool:
+            self.exiftool = ExifToolPool(size=self.exif_workers)
+        self._io = ThreadPoolExecutor(max_workers=self.io_workers)
+        self._exif = ThreadPoolExecutor(max_workers=self.exif_workers)
+        self._cpu = ProcessPoolExecutor(max_workers=self.cpu_workers)
+        self.stages = {}
+        self._tasks = []
+        for name, workers, handler in [
+                ('copy', self.io_workers, self._copy),
+                ('metadata', self.exif_workers, self._describe),
+                ('master', self.cpu_workers, self._master)]:
+            stage = StageStats(name, asyncio.Queue(maxsize=self.queue_size))
+            self.stages[name] = stage
+            for i in range(workers):
+                self._tasks.append(
+                    asyncio.ensure_future(self._work(stage, handler)))
+
+    async def submit(self, path: str):
+        """Queue an original; waits while the copy stage is full."""
+        self.start()
+        await self.stages['copy'].queue.put((path, None, monotonic()))
+
+    async def join(self):
+        """Wait until everything submitted so far has been through."""
+        for name in ('copy', 'metadata', 'master'):
+            await self.stages[name].queue.join()
+
+    async def close(self):
+        """Finish queued work, then stop the workers and pools."""
+        if not self._started:
+            return
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._io.shutdown()
+        self._exif.shutdown()
+        self._cpu.shutdown()
+        if self._own_exiftool:
+            self.exiftool.close()
+        if self.index is not None:
+            self.index.close()
+        self._started = False
+
+    def stats(self) -> dict:
+        return {name: s.get_dict() for name, s in self.stages.items()}
+
+    async def watch(
+        self,
+        folder: str,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        report_interval: float = None
+    ):
+        """Accession images that appear in folder, until cancelled.
+
+        A file is submitted once its size and mtime are unchanged between
+        two polls, i.e. once whoever is writing it has finished. done must
+        be set: accessioned originals are moved out of the folder into it,
+        so the folder itself records what is left to do and a restarted
+        watcher picks up where the last one stopped (resuming any bag it
+        left unfinished). A file that fails stays put and is not submitted
+        again unless it changes.
+        """
+        if self.done is None:
+            raise ValueError(
+                'watch requires done, the folder accessioned originals are '
+                'moved into')
+        self.start()
+        folder = realpath(expanduser(expandvars(normpath(folder))))
+        pending = {}
+        submitted = set()
+        last_report = monotonic()
+        while True:
+            seen = set()
+            for entry in scandir(folder):
+                if (not entry.is_file()
+                        or splitext(entry.name)[1].lower()
+                        not in IMAGE_EXTENSIONS):
+                    continue
+                st = entry.stat()
+                stamp = (st.st_size, st.st_mtime_ns)
+                key = (entry.path, stamp)
+                seen.add(key)
+                if key in submitted:
+                    continue
+                if pending.get(entry.path) == stamp:
+                    del pending[entry.path]
+                    submitted.add(key)
+                    await self.submit(entry.path)
+                else:
+                    pending[entry.path] = stamp
+            # forget files that have been moved to done, removed or changed
+            submitted &= seen
+            paths = {path for path, stamp in seen}
+            pending = {
+                path: stamp for path, stamp in pending.items()
+                if path in paths}
+            if (report_interval is not None
+                    and monotonic() - last_report >= report_interval):
+                for stage in self.stages.values():
+                    logger.info(str(stage))
+                last_report = monotonic()
+            await asyncio.sleep(interval)
+
+    async def _work(self, stage: StageStats, handler):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, im, queued = await stage.queue.get()
+            started = monotonic()
+            stage.in_flight += 1
+            ok = False
+            try:
+                result = await handler(loop, path, im)
+                ok = True
+            except Exception as e:
+                logger.error(
+                    '{} stage failed for {}: {}: {}'.format(
+                        stage.name, path, type(e).__name__, str(e)))
+                self.failures.append({
+                    'original': path,
+                    'stage': stage.name,
+                    'error': '{}: {}'.format(type(e).__name__, str(e))
+                })
+            stage.in_flight -= 1
+            stage.record(started - queued, monotonic() - started, ok)
+            try:
+                if ok and result is not None:
+                    await result
+            finally:
+                stage.queue.task_done()
+
+    async def _copy(self, loop, path: str, im: ImageBag):
+        bag_path = self._plan_bag(path)
+        try:
+            im = await loop.run_in_executor(self._io, self._new_bag, bag_path)
+            await loop.run_in_executor(self._io, im._start_journal, path)
+            await loop.run_in_executor(
+                self._io, im._run_steps, path, ['original'])
+        finally:
+            self._reserved.discard(bag_path)
+        return self._forward('metadata', path, im)
+
+    async def _describe(self, loop, path: str, im: ImageBag):
+        await loop.run_in_executor(
+            self._exif, im._run_steps, path, ['metadata'])
+        return self._forward('master', path, im)
+
+    async def _master(self, loop, path: str, im: ImageBag):
+        options = {k: self.bag_options[k] for k in MASTER_OPTIONS
+                   if k in self.bag_options}
+        await loop.run_in_executor(
+            self._cpu, _master_job, im.path, path, options)
+        if self.index is not None:
+            self.index.add_bag(im.path)
+        if self.done is not None:
+            replace(path, self._done_path(path))
+        self.accessioned.append({'original': path, 'bag': im.path})
+        logger.info('accessioned {} as {}'.format(path, im.path))
+        return None
+
+    async def _forward(self, name: str, path: str, im: ImageBag):
+        # held here until the next stage has room: this is the backpressure
+        await self.stages[name].queue.put((path, im, monotonic()))
+
+    def _new_bag(self, bag_path: str) -> ImageBag:
+        return ImageBag(
+            bag_path, auto_make=not exists(bag_path), exiftool=self.exiftool,
+            **self.bag_options)
+
+    def _done_path(self, path: str) -> str:
+        """Where to move an accessioned original without overwriting one."""
+        makedirs(self.done, exist_ok=True)
+        stem, ext = splitext(basename(path))
+        candidate = join(self.done, basename(path))
+        n = 1
+        while exists(candidate):
+            n += 1
+            candidate = join(self.done, '{}-{}{}'.format(stem, n, ext))
+        return candidate
+
+    def _plan_bag(self, path: str) -> str:
+        """A new bag path for path, or its bag from an interrupted run."""
+        stem = splitext(basename(path))[0]
+        candidate = join(self.destination, stem)
+        original = realpath(path)
+        n = 1
+        while candidate in self._reserved or (
+                exists(candidate)
+                and accession_in_progress(candidate) != original):
+            n += 1
+            candidate = join(self.destination, '{}-{}'.format(stem, n))
+        self._reserved.add(candidate)
+        return candidate
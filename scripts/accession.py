@@ -5,8 +5,12 @@ Accession one or more images
 """
 
 import better_exceptions
-from airtight.cli import configure_commandline
+from airtight.logging import configure_logging
+import argparse
 import logging
+from moondog.batch import accession_batch
+from moondog.color import working_profile
+from moondog.instrument import JSONLinesRecorder, PrometheusRecorder
 
 logger = logging.getLogger(__name__)
 
@@ -20,18 +24,83 @@ OPTIONAL_ARGUMENTS = [
         False],
     ['-w', '--veryverbose', False,
         'very verbose output (logging level == DEBUG)', False],
+    ['-j', '--workers', 0,
+        'number of worker processes (0 means one per CPU)', False],
+    ['-i', '--index', '',
+        'SQLite collection index to update with each new bag', False],
+    ['-d', '--dedup', '',
+        'for originals already in the index: skip, hardlink, reflink or '
+        'pointer (requires --index)', False],
+    ['-p', '--perceptual_hash', '',
+        'record a perceptual hash of each original: dhash or phash', False],
+    ['-c', '--working_space', 'prophoto',
+        'colour space to convert masters into: prophoto, srgb, or none',
+        False],
+    ['-t', '--timings', '',
+        'file for timing spans: Prometheus text if it ends in .prom, '
+        'otherwise JSON lines', False],
 ]
 POSITIONAL_ARGUMENTS = [
-    # each row is a list with 3 elements: name, type, help
+    # each row is a list with 4 elements: name, type, help, nargs
+    ['source', str, 'directories or glob patterns matching original images',
+        '+'],
+    ['destination', str, 'directory in which to create image bags', None],
 ]
 
 
+def configure_commandline(
+        optional_arguments, positional_arguments, default_log_level):
+    """airtight.cli.configure_commandline, with nargs for positionals.
+
+    airtight cannot give a positional argument nargs, which source needs
+    to take several paths or globs, so the parser is built here from the
+    same tables.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    for short, long, default, help, required in optional_arguments:
+        d = {'help': help, 'required': required, 'default': default}
+        if type(default) == bool:
+            d['action'] = 'store_false' if default else 'store_true'
+        else:
+            d['type'] = type(default)
+        parser.add_argument(short, long, **d)
+    for name, type_, help, nargs in positional_arguments:
+        parser.add_argument(name, type=type_, help=help, nargs=nargs)
+    args = parser.parse_args()
+    configure_logging(args, default_log_level)
+    return vars(args)
+
+
 def main(**kwargs):
     """
     main function
     """
     # logger = logging.getLogger(sys._getframe().f_code.co_name)
-    pass
+    workers = kwargs['workers']
+    if workers < 1:
+        workers = None
+    timings = kwargs['timings']
+    if not timings:
+        recorder = None
+    elif timings.endswith('.prom'):
+        recorder = PrometheusRecorder()
+    else:
+        recorder = JSONLinesRecorder(timings)
+    summary = accession_batch(
+        kwargs['source'], kwargs['destination'], workers=workers,
+        index=kwargs['index'] or None, dedup=kwargs['dedup'] or None,
+        perceptual_hash=kwargs['perceptual_hash'] or None,
+        working_profile=working_profile(kwargs['working_space']),
+        recorder=recorder)
+    if isinstance(recorder, PrometheusRecorder):
+        recorder.write(timings)
+    elif recorder is not None:
+        recorder.close()
+    for result in summary.failed:
+        print('FAILED {}: {}'.format(result['original'], result['error']))
+    print(summary)
 
 
 if __name__ == "__main__":
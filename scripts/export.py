@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export the metadata of every bag as newline-delimited JSON
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.export import export_collection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-j', '--workers', 0,
+        'number of serializing and compressing threads (0 means one per '
+        'CPU)', False],
+    ['-c', '--compression', '',
+        'gzip or zstd (default: from a .gz or .zst output suffix)', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+    ['source', str, 'directory of bags to export'],
+    ['output', str, 'NDJSON file to write'],
+]
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    stats = export_collection(
+        [kwargs['source']], kwargs['output'],
+        compression=kwargs['compression'] or None,
+        workers=kwargs['workers'] or None)
+    for error in stats['errors']:
+        print('FAILED {}: {}'.format(error['bag'], error['error']))
+    print(
+        '{} records exported, {} failed in {:.2f}s ({} bytes, {} written)'
+        ''.format(
+            stats['records'], len(stats['errors']), stats['seconds'],
+            stats['bytes'], stats['compressed_bytes']))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
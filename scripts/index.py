@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Update or query the collection index
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.index import CollectionIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-u', '--update', '',
+        'directory of bags with which to bring the index up to date', False],
+    ['-q', '--query', '', 'full-text (FTS5) query', False],
+    ['-k', '--keyword', '', 'list bags with this keyword', False],
+    ['-a', '--agent', '', 'list bags crediting this agent', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+    ['database', str, 'path to the SQLite collection index'],
+]
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    with CollectionIndex(kwargs['database']) as index:
+        if kwargs['update']:
+            indexed, removed = index.update(kwargs['update'])
+            print('{} bags indexed, {} removed; {} in index'.format(
+                indexed, removed, len(index)))
+        paths = []
+        if kwargs['query']:
+            paths.extend(index.search(kwargs['query']))
+        if kwargs['keyword']:
+            paths.extend(index.find_keyword(kwargs['keyword']))
+        if kwargs['agent']:
+            paths.extend(index.find_agent(kwargs['agent']))
+        for path in paths:
+            print(path)
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
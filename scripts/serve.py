@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Accession images dropped into a folder, until interrupted
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import asyncio
+import logging
+from moondog.color import working_profile
+from moondog.service import AccessionService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-j', '--workers', 0,
+        'number of master worker processes (0 means one per CPU)', False],
+    ['-o', '--io_workers', 4, 'number of copying threads', False],
+    ['-e', '--exif_workers', 2, 'number of exiftool processes', False],
+    ['-q', '--queue_size', 64, 'maximum items waiting at each stage', False],
+    ['-i', '--index', '',
+        'SQLite collection index to update with each new bag', False],
+    ['-p', '--perceptual_hash', '',
+        'record a perceptual hash of each original: dhash or phash', False],
+    ['-c', '--working_space', 'prophoto',
+        'colour space to convert masters into: prophoto, srgb, or none',
+        False],
+    ['-s', '--interval', 2.0, 'seconds between scans of the folder', False],
+    ['-r', '--report', 60.0,
+        'seconds between stage statistics (logged at INFO)', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+    ['folder', str, 'drop folder to watch for original images'],
+    ['destination', str, 'directory in which to create image bags'],
+    ['done', str, 'folder into which accessioned originals are moved'],
+]
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    bag_options = {
+        'working_profile': working_profile(kwargs['working_space'])}
+    if kwargs['perceptual_hash']:
+        bag_options['perceptual_hash'] = kwargs['perceptual_hash']
+    service = AccessionService(
+        kwargs['destination'], index=kwargs['index'] or None,
+        queue_size=kwargs['queue_size'], io_workers=kwargs['io_workers'],
+        exif_workers=kwargs['exif_workers'],
+        cpu_workers=kwargs['workers'] or None, done=kwargs['done'],
+        **bag_options)
+
+    async def serve():
+        try:
+            await service.watch(
+                kwargs['folder'], interval=kwargs['interval'],
+                report_interval=kwargs['report'])
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    for failure in service.failures:
+        print('FAILED {} ({}): {}'.format(
+            failure['original'], failure['stage'], failure['error']))
+    print('{} accessioned, {} failed'.format(
+        len(service.accessioned), len(service.failures)))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check the fixity of image bags
+"""
+
+import better_exceptions
+from airtight.cli import configure_commandline
+import logging
+from moondog.fixity import (check_bags, DEFAULT_FRACTION, DEFAULT_IO_WORKERS,
+                            FixityScheduler)
+from moondog.index import find_bags
+from os.path import expanduser, expandvars, normpath, realpath
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_LEVEL = logging.WARNING
+OPTIONAL_ARGUMENTS = [
+    ['-l', '--loglevel', 'NOTSET',
+        'desired logging level (' +
+        'case-insensitive string: DEBUG, INFO, WARNING, or ERROR',
+        False],
+    ['-v', '--verbose', False, 'verbose output (logging level == INFO)',
+        False],
+    ['-w', '--veryverbose', False,
+        'very verbose output (logging level == DEBUG)', False],
+    ['-f', '--fast', False,
+        'compare Payload-Oxum and manifests with the payload without '
+        'hashing', False],
+    ['-j', '--workers', 0,
+        'number of bags to check at once (0 means one per CPU)', False],
+    ['-i', '--io', DEFAULT_IO_WORKERS,
+        'maximum number of files read at once', False],
+    ['-s', '--schedule', '',
+        'fixity schedule database: fully check only the bags that are due '
+        'and fast-check the rest', False],
+    ['-r', '--fraction', DEFAULT_FRACTION,
+        'fraction of bags to fully check per scheduled run', False],
+]
+POSITIONAL_ARGUMENTS = [
+    # each row is a list with 3 elements: name, type, help
+    ['root', str, 'a bag, or a directory containing bags'],
+]
+
+
+def main(**kwargs):
+    """
+    main function
+    """
+    # logger = logging.getLogger(sys._getframe().f_code.co_name)
+    root = realpath(expanduser(expandvars(normpath(kwargs['root']))))
+    workers = kwargs['workers']
+    if workers < 1:
+        workers = None
+    start = perf_counter()
+    if kwargs['schedule']:
+        with FixityScheduler(
+                kwargs['schedule'], fraction=kwargs['fraction']) as schedule:
+            results = schedule.run(
+                [root], workers=workers, io_workers=kwargs['io'])
+    else:
+        results = list(check_bags(
+            list(find_bags(root)), fast=kwargs['fast'], workers=workers,
+            io_workers=kwargs['io']))
+    seconds = perf_counter() - start
+    failed = [r for r in results if not r['valid']]
+    for result in failed:
+        for error in result['errors']:
+            print('INVALID {}: {}'.format(result['bag'], error))
+    hashed = sum(r['bytes'] for r in results)
+    print(
+        '{} bags checked ({} fully), {} invalid in {:.2f}s ({:.2f} MB/s)'
+        ''.format(
+            len(results), len([r for r in results if not r['fast']]),
+            len(failed), seconds,
+            hashed / 1048576 / seconds if seconds else 0.0))
+
+
+if __name__ == "__main__":
+    main(**configure_commandline(
+            OPTIONAL_ARGUMENTS, POSITIONAL_ARGUMENTS, DEFAULT_LOG_LEVEL))
@@ -46,6 +46,7 @@ setup(
     extras_require={
     #     'dev': ['check-manifest'],
         'test': ['coverage', 'nose'],
+        'tiled': ['imagecodecs', 'numpy', 'tifffile'],
     },
 
     # If there are data files included in your packages that need to be
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-ins for external tools, for the tests
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StubExifTool(object):
+    """Stands in for ExifToolPool where exiftool is not wanted or installed.
+
+    extract() returns no XMP and only SourceFile plus File:FileSize, which
+    is set to the number of calls so far so that a fresh extraction can be
+    told from a cached one.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def extract(self, path: str) -> tuple:
+        self.calls += 1
+        return {'SourceFile': path, 'File:FileSize': self.calls}, None
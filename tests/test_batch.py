@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for batch accession"""
+
+import logging
+from moondog.batch import (accession_batch, BatchSummary, find_originals,
+                           plan_bags)
+from moondog.images import ImageBag, JOURNAL_FILENAME
+from moondog.index import CollectionIndex
+from moondog.manifests import WORK_DIR
+from nose.tools import assert_equal, assert_true
+from os import listdir, makedirs
+from os.path import abspath, exists, join, realpath
+from shutil import copy2, rmtree
+from tests.stubs import StubExifTool
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src')
+test_batch_path = join(test_data_path, 'batch')
+
+
+class Test_Batch(TestCase):
+
+    def setUp(self):
+        if exists(test_batch_path):
+            rmtree(test_batch_path)
+        makedirs(join(test_batch_path, 'in', 'nested'))
+
+    def tearDown(self):
+        if exists(test_batch_path):
+            rmtree(test_batch_path)
+
+    def test_find_originals_directory(self):
+        """Directories are searched recursively for image files."""
+        copy2(
+            join(test_src_path, 'IMG_4107.JPG'),
+            join(test_batch_path, 'in', 'nested', 'IMG_4107.JPG'))
+        with open(join(test_batch_path, 'in', 'notes.txt'), 'w') as f:
+            f.write('not an image')
+        found = find_originals([join(test_batch_path, 'in')])
+        assert_equal(
+            found, [join(test_batch_path, 'in', 'nested', 'IMG_4107.JPG')])
+
+    def test_find_originals_glob(self):
+        found = find_originals([join(test_src_path, '*.JPG')])
+        assert_equal(found, [join(test_src_path, 'IMG_4107.JPG')])
+
+    def test_plan_bags(self):
+        """Repeated file names get distinct bag paths."""
+        jobs = plan_bags(['/a/IMG_1.JPG', '/b/IMG_1.JPG'], test_batch_path)
+        assert_equal(
+            [j[1] for j in jobs],
+            [join(test_batch_path, 'IMG_1'),
+             join(test_batch_path, 'IMG_1-2')])
+
+    def test_plan_bags_existing(self):
+        """Bags on disk are not reused, unless resuming the same original."""
+        for name in ('IMG_1', 'IMG_2'):
+            makedirs(join(test_batch_path, name, WORK_DIR))
+        with open(
+                join(test_batch_path, 'IMG_2', WORK_DIR, JOURNAL_FILENAME),
+                'w') as f:
+            f.write('{"original": "/a/IMG_2.JPG"}')
+        jobs = plan_bags(['/a/IMG_1.JPG', '/a/IMG_2.JPG'], test_batch_path)
+        assert_equal(
+            [j[1] for j in jobs],
+            [join(test_batch_path, 'IMG_1-2'),
+             join(test_batch_path, 'IMG_2')])
+
+    def test_resubmit_duplicate(self):
+        """Resubmitting an accessioned file is reported as a duplicate."""
+        src = join(test_src_path, 'IMG_4107.JPG')
+        index_path = join(test_batch_path, 'index.sqlite')
+        index = CollectionIndex(index_path)
+        ImageBag(
+            join(test_batch_path, 'out', 'IMG_4107'), auto_make=True,
+            exiftool=StubExifTool(), index=index).accession(src)
+        index.close()
+        summary = accession_batch(
+            [src], join(test_batch_path, 'out'), workers=1,
+            index=index_path, dedup='skip')
+        assert_equal(summary.failed, [])
+        assert_equal(summary.succeeded, [])
+        assert_equal(
+            [r['duplicate_of'] for r in summary.duplicates],
+            [join(test_batch_path, 'out', 'IMG_4107')])
+        assert_equal(summary.files, 1)
+        assert_equal(summary.bytes, 0)
+        assert_equal(listdir(join(test_batch_path, 'out')), ['IMG_4107'])
+
+    def test_error_isolation(self):
+        """A broken original is reported without stopping the batch."""
+        for name in ['broken_a.jpg', 'broken_b.jpg']:
+            with open(join(test_batch_path, 'in', name), 'w') as f:
+                f.write('not an image')
+        summary = accession_batch(
+            [join(test_batch_path, 'in')], join(test_batch_path, 'out'),
+            workers=2)
+        assert_equal(summary.files, 2)
+        assert_equal(len(summary.failed), 2)
+        assert_true(all(r['error'] is not None for r in summary.failed))
+
+    def test_timings(self):
+        """Spans recorded in the workers reach the recorder."""
+        with open(join(test_batch_path, 'in', 'broken.jpg'), 'w') as f:
+            f.write('not an image')
+        records = []
+        summary = accession_batch(
+            [join(test_batch_path, 'in')], join(test_batch_path, 'out'),
+            workers=2, recorder=records.append)
+        assert_equal(len(summary.failed), 1)
+        assert_true('spans' not in summary.failed[0])
+        assert_true('copy' in [r['name'] for r in records])
+
+    def test_summary(self):
+        summary = BatchSummary()
+        summary.add({'bytes': 2097152, 'error': None})
+        summary.add({'bytes': 10, 'error': 'OSError: nope'})
+        summary.add({'bytes': 10, 'error': None, 'duplicate_of': '/a/b'})
+        summary.seconds = 2.0
+        assert_equal(summary.files, 3)
+        assert_equal(len(summary.duplicates), 1)
+        assert_equal(summary.files_per_second, 0.5)
+        assert_equal(summary.mb_per_second, 1.0)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for colour management"""
+
+from io import BytesIO
+import logging
+from moondog.color import (prophoto_profile, srgb_profile, to_working_space,
+                           TransformCache, working_profile)
+from nose.tools import assert_equal, assert_is, assert_raises, assert_true
+from os.path import abspath, join, realpath
+from PIL import Image, ImageCms
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+
+
+class Test_Color(TestCase):
+
+    def test_prophoto_profile(self):
+        """The generated ProPhoto profile is accepted by littleCMS."""
+        profile = ImageCms.ImageCmsProfile(BytesIO(prophoto_profile()))
+        assert_equal(
+            ImageCms.getProfileDescription(profile).strip(),
+            'ProPhoto RGB (moondog)')
+
+    def test_assign_srgb(self):
+        """Untagged images are treated as sRGB."""
+        im = Image.new('RGB', (4, 4), (255, 0, 0))
+        out = to_working_space(im, prophoto_profile(), cache=TransformCache())
+        assert_equal(out.info['icc_profile'], prophoto_profile())
+        r, g, b = out.getpixel((0, 0))
+        assert_true(r < 255 and g > 0)
+
+    def test_transform_cache(self):
+        cache = TransformCache(maxsize=1)
+        im = Image.open(test_src_path).resize((64, 48))
+        to_working_space(im, prophoto_profile(), cache=cache)
+        to_working_space(im, prophoto_profile(), cache=cache)
+        assert_equal((cache.misses, cache.hits), (1, 1))
+        to_working_space(
+            Image.new('RGB', (4, 4)), prophoto_profile(), cache=cache)
+        assert_equal((cache.misses, len(cache)), (2, 1))
+
+    def test_unconvertible_mode(self):
+        im = Image.new('L', (4, 4))
+        assert_is(to_working_space(im, prophoto_profile()), im)
+        assert_true(srgb_profile() != prophoto_profile())
+
+    def test_working_profile(self):
+        assert_equal(working_profile('prophoto'), prophoto_profile())
+        assert_is(working_profile('none'), None)
+        assert_raises(ValueError, working_profile, 'adobergb')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for access derivatives"""
+
+from bagit import Bag
+import json
+import logging
+from moondog.derivatives import (generate_derivatives, make_preview,
+                                 open_scaled, tifffile)
+from moondog.images import ImageBag
+from nose.tools import assert_equal, assert_false, assert_raises, assert_true
+from os import makedirs
+from os.path import abspath, exists, join, realpath
+from PIL import Image
+from shutil import copy2, rmtree
+from unittest import skipIf, TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+test_dir = join(test_data_path, 'derivatives')
+test_bag_path = join(test_data_path, 'foo')
+
+
+class Test_Derivatives(TestCase):
+
+    def setUp(self):
+        for path in (test_dir, test_bag_path):
+            if exists(path):
+                rmtree(path)
+        makedirs(test_dir)
+        self.master = join(test_dir, 'master.tif')
+        Image.linear_gradient('L').resize((1500, 1000)).convert(
+            'RGB').save(self.master)
+
+    def tearDown(self):
+        for path in (test_dir, test_bag_path):
+            if exists(path):
+                rmtree(path)
+
+    def test_sizes(self):
+        components = generate_derivatives(
+            self.master, test_dir, {'access': 800, 'thumbnail': 100})
+        assert_equal(components, {
+            'access': {'filename': 'access.jpg', 'dimensions': '800x533'},
+            'thumbnail': {'filename': 'thumbnail.jpg', 'dimensions': '100x67'}
+        })
+        with Image.open(join(test_dir, 'thumbnail.jpg')) as im:
+            assert_equal(im.size, (100, 67))
+            assert_equal(im.mode, 'RGB')
+            assert_true(im.info.get('icc_profile'))
+
+    def test_16_bit(self):
+        master = join(test_dir, 'master16.tif')
+        Image.linear_gradient('L').convert('I').point(
+            lambda v: v * 256).convert('I;16').save(master)
+        components = generate_derivatives(master, test_dir, {'small': 64})
+        with Image.open(join(test_dir, 'small.jpg')) as im:
+            assert_equal(im.mode, 'L')
+            assert_equal(im.size, (64, 64))
+            assert_true(im.getextrema()[1] > 200)
+        assert_equal(components['small']['dimensions'], '64x64')
+
+    def test_iiif_tiles(self):
+        components = generate_derivatives(
+            self.master, test_dir, {}, tiles=True, tile_size=512)
+        assert_equal(components['tiles']['filename'], 'tiles')
+        with open(join(test_dir, 'tiles', 'info.json')) as f:
+            info = json.load(f)
+        del f
+        assert_equal((info['width'], info['height']), (1500, 1000))
+        assert_equal(info['tiles'][0]['scaleFactors'], [1, 2, 4])
+        tile = join(
+            test_dir, 'tiles', '1024,512,476,488', '476,', '0', 'default.jpg')
+        with Image.open(tile) as im:
+            assert_equal(im.size, (476, 488))
+        tile = join(
+            test_dir, 'tiles', '0,0,1500,1000', '375,', '0', 'default.jpg')
+        with Image.open(tile) as im:
+            assert_equal(im.size, (375, 250))
+
+    @skipIf(tifffile is None, 'tifffile is not installed')
+    def test_pyramid(self):
+        generate_derivatives(
+            self.master, test_dir, {}, pyramid=True, tile_size=256)
+        with tifffile.TiffFile(join(test_dir, 'pyramid.tif')) as tif:
+            series = tif.series[0]
+            assert_equal(
+                [level.shape[:2] for level in series.levels],
+                [(1000, 1500), (500, 750), (250, 375), (125, 188)])
+            assert_equal(tif.pages[0].tilewidth, 256)
+
+    def test_bag_components(self):
+        """Derivatives are recorded as components and bag payload."""
+        im = ImageBag(
+            test_bag_path, auto_make=True,
+            derivatives={'thumbnail': 100}, tiles=True)
+        copy2(self.master, join(test_bag_path, 'data', 'master.tif'))
+        im.components['master'] = {'filename': 'master.tif'}
+        im._generate_derivatives()
+        bag = Bag(test_bag_path)
+        assert_true(bag.validate())
+        assert_equal(bag.info['Thumbnail-Filename'], 'thumbnail.jpg')
+        assert_equal(bag.info['Thumbnail-Dimensions'], '100x67')
+        assert_equal(bag.info['Tiles-Filename'], 'tiles')
+        assert_true('data/tiles/info.json' in bag.payload_entries())
+        assert_equal(
+            ImageBag(test_bag_path).components['thumbnail'],
+            {'filename': 'thumbnail.jpg', 'dimensions': '100x67'})
+
+    def test_custom_component(self):
+        """Derivatives with custom names are found when a bag is reopened."""
+        im = ImageBag(
+            test_bag_path, auto_make=True, derivatives={'web_large': 300})
+        copy2(self.master, join(test_bag_path, 'data', 'master.tif'))
+        im.components['master'] = {'filename': 'master.tif'}
+        im._generate_derivatives()
+        assert_equal(
+            ImageBag(test_bag_path).components['web_large'],
+            {'filename': 'web_large.jpg', 'dimensions': '300x200'})
+        assert_true('bagging' not in ImageBag(test_bag_path).components)
+
+    def test_reserved_component(self):
+        for name in ('master', 'original', 'Web Large', 'web-large'):
+            assert_raises(
+                ValueError, ImageBag, test_bag_path, auto_make=True,
+                derivatives={name: 100})
+        assert_false(exists(test_bag_path))
+
+    def test_open_scaled_jpeg(self):
+        """JPEGs are decoded at a reduced DCT scale."""
+        with open_scaled(test_src_path, 256) as im:
+            assert_equal(im.size, (504, 378))
+        with open_scaled(test_src_path, 3000) as im:
+            assert_equal(im.size, (4032, 3024))
+        dst = join(test_dir, 'preview.jpg')
+        assert_equal(make_preview(test_src_path, dst, 256), (256, 192))
+        with Image.open(dst) as im:
+            assert_equal(im.size, (256, 192))
+
+    def test_open_scaled_reduce(self):
+        with open_scaled(self.master, 256) as im:
+            assert_equal(im.size, (300, 200))
+        components = generate_derivatives(self.master, test_dir, {'t': 100})
+        assert_equal(components['t']['dimensions'], '100x67')
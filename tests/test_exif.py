@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for pooled exiftool sessions"""
+
+import logging
+from base64 import b64encode
+import gc
+from moondog.exif import (elide_binary, ExifToolPool, shared_pool,
+                          split_xmp)
+from nose.tools import (assert_equal, assert_false, assert_is, assert_is_none,
+                        assert_true, raises)
+from os.path import abspath, join, realpath
+from PIL import Image
+import shutil
+from tempfile import TemporaryDirectory
+from unittest import skipIf, TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_original_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+no_exiftool = shutil.which('exiftool') is None
+
+
+class Test_ExifToolPool(TestCase):
+
+    @raises(ValueError)
+    def test_pool_size(self):
+        ExifToolPool(size=0)
+
+    def test_shared_pool(self):
+        assert_is(shared_pool(), shared_pool())
+
+    def test_failed_start_releases_slot(self):
+        """A session that cannot start must not leak its pool slot."""
+        pool = ExifToolPool(executable='/nonexistent/exiftool')
+        for i in range(2):
+            try:
+                pool.get_metadata(test_original_path)
+            except OSError:
+                pass
+            else:
+                raise AssertionError('expected OSError')
+        assert_equal(pool._idle.qsize(), 1)
+        pool.close()
+
+    def test_collected(self):
+        """A pool that is dropped without close() is finalized."""
+        pool = ExifToolPool()
+        finalizer = pool._finalizer
+        del pool
+        gc.collect()
+        assert_false(finalizer.alive)
+
+    @raises(RuntimeError)
+    def test_closed(self):
+        pool = ExifToolPool()
+        pool.close()
+        pool.get_metadata(test_original_path)
+
+    @skipIf(no_exiftool, 'exiftool is not installed')
+    def test_restart(self):
+        with ExifToolPool() as pool:
+            pool.get_metadata(test_original_path)
+            session = pool._sessions[0]
+            session._process.kill()
+            session._process.wait()
+            meta = pool.get_metadata(test_original_path)
+            assert_true(meta['SourceFile'].endswith('IMG_4107.JPG'))
+            assert_true(pool._sessions[0] is not session)
+
+    def test_split_xmp(self):
+        packet = '<x:xmpmeta xmlns:x="adobe:ns:meta/"></x:xmpmeta>'
+        meta, xmp = split_xmp({'SourceFile': 'a.jpg', 'XMP:XMP': packet})
+        assert_equal(meta, {'SourceFile': 'a.jpg'})
+        assert_equal(xmp, packet)
+        meta, xmp = split_xmp({
+            'XMP:XMP': 'base64:' + b64encode(packet.encode()).decode()})
+        assert_equal(xmp, packet)
+        assert_is_none(split_xmp({'SourceFile': 'a.jpg'})[1])
+        assert_is_none(split_xmp({'XMP:XMP': ' '})[1])
+
+    @skipIf(no_exiftool, 'exiftool is not installed')
+    def test_extract(self):
+        with ExifToolPool() as pool:
+            meta, xmp = pool.extract(test_original_path)
+            assert_true(meta['SourceFile'].endswith('IMG_4107.JPG'))
+            assert_true('XMP:XMP' not in meta)
+            assert_true('EXIF:ThumbnailImage' not in meta)
+
+    def test_elide_binary(self):
+        meta = elide_binary({
+            'SourceFile': 'a.jpg',
+            'ICC_Profile:RedTRC': 'base64:' + b64encode(b'curv').decode(),
+            'MakerNotes:PreviewImage':
+                'base64:' + b64encode(bytes(4096)).decode()})
+        assert_equal(
+            meta['ICC_Profile:RedTRC'],
+            'base64:' + b64encode(b'curv').decode())
+        assert_equal(
+            meta['MakerNotes:PreviewImage'],
+            '(Binary data 4096 bytes, use -b option to extract)')
+
+    @skipIf(no_exiftool, 'exiftool is not installed')
+    def test_extract_mpo(self):
+        """The other frames of a multi-picture file are not dumped."""
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'stereo.mpo')
+            frames = [
+                Image.effect_noise((256, 256), 64).convert('RGB')
+                for i in range(3)]
+            frames[0].save(
+                path, 'MPO', save_all=True, append_images=frames[1:])
+            with ExifToolPool() as pool:
+                meta, xmp = pool.extract(path)
+        assert_true(meta['SourceFile'].endswith('stereo.mpo'))
+        assert_equal(
+            [tag for tag in meta if tag.startswith('MPF:MPImage')], [])
+        assert_equal(
+            [tag for tag, value in meta.items()
+             if str(value).startswith('base64:')], [])
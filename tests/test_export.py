@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for streaming metadata export"""
+
+import gzip
+import json
+import logging
+from moondog import export
+from moondog.export import bag_record, dumps, export_collection
+from moondog.images import ImageBag
+from moondog.manifests import WORK_DIR
+from nose.tools import assert_equal, assert_true, raises
+from os import makedirs
+from os.path import abspath, exists, join, realpath
+from shutil import copytree, rmtree
+from tests.stubs import StubExifTool
+from unittest import skipIf, TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_dir = join(test_data_path, 'export')
+test_original = join(test_data_path, 'src', 'IMG_4107.JPG')
+
+
+class Test_Export(TestCase):
+
+    def setUp(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+        makedirs(join(test_dir, 'bags'))
+        first = join(test_dir, 'bags', 'bag_0')
+        ImageBag(first, auto_make=True, exiftool=StubExifTool()).accession(
+            test_original)
+        self.bags = [first]
+        for i in range(1, 6):
+            self.bags.append(join(test_dir, 'bags', 'bag_{}'.format(i)))
+            copytree(first, self.bags[-1])
+
+    def tearDown(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+
+    def _read(self, path: str, opener=open) -> list:
+        with opener(path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_record(self):
+        record = bag_record(self.bags[0])
+        assert_equal(record['bag'], self.bags[0])
+        assert_equal(record['info']['Master-Filename'], 'master.tif')
+        assert_equal(record['descriptive']['titles'], [])
+
+    def test_dumps(self):
+        """One compact line per record, keys sorted, UTF-8."""
+        line = dumps({'b': 'Ĉu', 'a': [1, 2]})
+        assert_equal(line, '{"a":[1,2],"b":"Ĉu"}\n'.encode('utf-8'))
+
+    def test_export(self):
+        path = join(test_dir, 'out.ndjson')
+        stats = export_collection([join(test_dir, 'bags')], path, workers=2)
+        records = self._read(path)
+        assert_equal(stats['records'], 6)
+        assert_equal([r['bag'] for r in records], self.bags)
+        assert_equal(stats['bytes'], stats['compressed_bytes'])
+        assert_true(not exists(path + '.tmp'))
+
+    def test_gzip_blocks(self):
+        """Blocks compressed in parallel still read as one gzip stream."""
+        path = join(test_dir, 'out.ndjson.gz')
+        stats = export_collection(
+            [join(test_dir, 'bags')], path, workers=3, block_size=1)
+        records = self._read(path, gzip.open)
+        assert_equal([r['bag'] for r in records], self.bags)
+        assert_true(stats['compressed_bytes'] < stats['bytes'])
+
+    @skipIf(export.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        path = join(test_dir, 'out.ndjson.zst')
+        export_collection([join(test_dir, 'bags')], path, block_size=1)
+        with open(path, 'rb') as f:
+            reader = export.zstandard.ZstdDecompressor().stream_reader(
+                f, read_across_frames=True)
+            lines = reader.read().decode('utf-8').splitlines()
+        assert_equal(len(lines), 6)
+
+    def test_skip_and_errors(self):
+        """Unfinished bags are skipped and broken ones reported."""
+        makedirs(join(self.bags[1], WORK_DIR))
+        with open(join(self.bags[2], 'bag-info.txt'), 'wb') as f:
+            f.write(b'\xff\xfe not utf-8')
+        path = join(test_dir, 'out.ndjson')
+        stats = export_collection([join(test_dir, 'bags')], path)
+        assert_equal(stats['records'], 4)
+        assert_equal([e['bag'] for e in stats['errors']], [self.bags[2]])
+        assert_equal(len(self._read(path)), 4)
+
+    def test_error_cleanup(self):
+        """A failed export leaves neither output nor temporary file."""
+        path = join(test_dir, 'out.ndjson')
+        try:
+            export_collection(
+                [join(test_dir, 'bags'), join(test_dir, 'missing')], path,
+                block_size=1)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError('export of a missing root succeeded')
+        assert_true(not exists(path))
+        assert_true(not exists(path + '.tmp'))
+
+    @raises(ValueError)
+    def test_bad_compression(self):
+        export_collection(
+            [join(test_dir, 'bags')], join(test_dir, 'out'),
+            compression='lz4')
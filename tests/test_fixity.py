@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for fixity checking and scheduling"""
+
+import logging
+from moondog.fixity import check_bag, check_bags, FixityScheduler
+from moondog.images import ImageBag
+from nose.tools import assert_equal, assert_false, assert_true, raises
+from os import stat, utime
+from os.path import abspath, exists, join, realpath
+from shutil import copy2, rmtree
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_root_path = join(test_data_path, 'collection')
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+
+
+def _make_bag(name: str) -> str:
+    path = join(test_root_path, name)
+    im = ImageBag(path, auto_make=True)
+    im.components['original'] = {'filename': 'IMG_4107.JPG'}
+    copy2(test_src_path, join(path, 'data', 'IMG_4107.JPG'))
+    im._update(manifests=True)
+    return path
+
+
+def _corrupt(bag_path: str):
+    """Flip a byte of the payload, keeping its size and mtime."""
+    path = join(bag_path, 'data', 'IMG_4107.JPG')
+    with open(path, 'r+b') as f:
+        f.seek(100)
+        b = f.read(1)
+        f.seek(100)
+        f.write(bytes([b[0] ^ 0xff]))
+    del f
+    st = stat(test_src_path)
+    utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+class Test_Fixity(TestCase):
+
+    def setUp(self):
+        if exists(test_root_path):
+            rmtree(test_root_path)
+        self.bags = [_make_bag('bag{}'.format(i)) for i in range(3)]
+
+    def tearDown(self):
+        if exists(test_root_path):
+            rmtree(test_root_path)
+
+    def test_valid(self):
+        result = ImageBag(self.bags[0]).validate()
+        assert_true(result['valid'])
+        assert_false(result['fast'])
+        assert_true(result['bytes'] > 0)
+        assert_true(ImageBag(self.bags[0]).validate(fast=True)['valid'])
+
+    def test_corrupt(self):
+        """Fast checks cannot see silent corruption; full checks do."""
+        _corrupt(self.bags[1])
+        results = list(check_bags(self.bags, workers=2, io_workers=2))
+        assert_equal([r['valid'] for r in results], [True, False, True])
+        assert_true('checksum mismatch' in results[1]['errors'][0])
+        assert_true(check_bag(self.bags[1], fast=True)['valid'])
+
+    def test_fast(self):
+        """Fast checks catch changed sizes, mtimes and file lists."""
+        known = check_bag(self.bags[0])['files']
+        utime(join(self.bags[0], 'data', 'IMG_4107.JPG'), ns=(0, 0))
+        result = check_bag(self.bags[0], fast=True, known=known)
+        assert_equal(
+            result['errors'],
+            ['data/IMG_4107.JPG has changed since it was last verified'])
+        with open(join(self.bags[2], 'data', 'extra.txt'), 'w') as f:
+            f.write('extra')
+        del f
+        result = check_bag(self.bags[2], fast=True)
+        assert_equal(len(result['errors']), 2)
+        assert_true(result['errors'][0].startswith('Payload-Oxum is'))
+        assert_equal(
+            result['errors'][1], 'data/extra.txt is not in the manifest')
+
+    def test_scheduler(self):
+        """Each run fully checks the bags least recently hashed."""
+        schedule_path = join(test_root_path, 'fixity.sqlite')
+        with FixityScheduler(schedule_path, fraction=0.5) as schedule:
+            results = schedule.run([test_root_path], now=1.0)
+            full = [r['bag'] for r in results if not r['fast']]
+            assert_equal(full, self.bags[:2])
+            results = schedule.run([test_root_path], now=2.0)
+            full = [r['bag'] for r in results if not r['fast']]
+            assert_equal(full, [self.bags[2], self.bags[0]])
+            # bag2 is only fast-checked this time
+            utime(join(self.bags[2], 'data', 'IMG_4107.JPG'), ns=(0, 0))
+            results = schedule.run([test_root_path], now=3.0)
+            invalid = [r['bag'] for r in results if not r['valid']]
+            assert_equal(invalid, [self.bags[2]])
+
+    @raises(ValueError)
+    def test_scheduler_fraction(self):
+        FixityScheduler(':memory:', fraction=0)
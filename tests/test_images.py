@@ -2,14 +2,20 @@
 # -*- coding: utf-8 -*-
 """Tests for moondog """
 
-from bagit import BagError
+from bagit import Bag, BagError
+import json
 import logging
-from moondog.images import ImageBag
-from nose.tools import assert_equal, assert_false, assert_true, raises
-from os import makedirs
+from moondog import images
+from moondog.images import accession_in_progress, DuplicateOriginal, ImageBag
+from moondog.index import CollectionIndex
+from nose.tools import (assert_equal, assert_false, assert_raises, assert_true,
+                        raises)
+from os import listdir, makedirs, remove, stat
 from os.path import abspath, exists, join, realpath
-from shutil import rmtree
+from PIL import Image
+from shutil import copy2, rmtree
 import sys
+from tests.stubs import StubExifTool
 from unittest import TestCase
 
 logger = logging.getLogger(__name__)
@@ -78,6 +84,9 @@ class Test_Image_Import(TestCase):
         im.accession(join(test_data_path, 'src', 'IMG_4107.JPG'))
         assert_true(exists(test_original_path))
         assert_true(exists(test_master_path))
+        assert_true(
+            exists(join(test_bag_path, 'metadata', 'descriptive.json')))
+        assert_true(exists(join(test_bag_path, 'metadata', 'original.json')))
         with open(join(test_bag_path, 'bag-info.txt'), 'r') as f:
             lines = [l[:-1] for l in f.readlines()]
         del f
@@ -90,3 +99,223 @@ class Test_Image_Import(TestCase):
         assert_equal(lines[4], "Original-Filename: IMG_4107.JPG")
         assert_true(exists(join(test_data_path, 'src', 'IMG_4107.JPG')))
 
+
+class Test_Metadata_Sidecar(TestCase):
+
+    def setUp(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+
+    def tearDown(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+
+    def test_sidecar_reused(self):
+        """Metadata is extracted once while the original is unchanged."""
+        pool = StubExifTool()
+        im = ImageBag(test_bag_path, auto_make=True, exiftool=pool)
+        im.accession(join(test_data_path, 'src', test_original))
+        assert_equal(pool.calls, 1)
+        with open(join(test_bag_path, 'metadata', 'original.json')) as f:
+            sidecar = json.load(f)
+        del f
+        assert_equal(
+            sidecar['sha256'],
+            im.bag.entries['data/{}'.format(test_original)]['sha256'])
+        # a fresh ImageBag finds the digest in the manifest
+        im = ImageBag(test_bag_path, exiftool=pool)
+        meta, xmp = im.extract_metadata()
+        assert_equal(pool.calls, 1)
+        assert_equal(meta['File:FileSize'], 1)
+        im.extract_metadata(refresh=True)
+        assert_equal(pool.calls, 2)
+
+    def test_refresh_validates(self):
+        """Rewriting the sidecar keeps the tag manifests in step."""
+        pool = StubExifTool()
+        im = ImageBag(test_bag_path, auto_make=True, exiftool=pool)
+        im.accession(join(test_data_path, 'src', test_original))
+        im = ImageBag(test_bag_path, exiftool=pool)
+        im.extract_metadata(refresh=True)
+        assert_equal(pool.calls, 2)
+        Bag(test_bag_path).validate()
+
+    def test_sidecar_stale(self):
+        """A sidecar for different content is not used."""
+        pool = StubExifTool()
+        im = ImageBag(test_bag_path, auto_make=True, exiftool=pool)
+        im.accession(join(test_data_path, 'src', test_original))
+        copy2(
+            join(test_data_path, 'src', test_original),
+            join(test_bag_path, 'data', test_original))
+        with open(join(test_bag_path, 'data', test_original), 'ab') as f:
+            f.write(b'changed')
+        del f
+        meta, xmp = im.extract_metadata()
+        assert_equal(pool.calls, 2)
+
+
+class Test_Dedup(TestCase):
+
+    def setUp(self):
+        self.paths = [join(test_data_path, n) for n in ('foo', 'bar')]
+        for path in self.paths:
+            if exists(path):
+                rmtree(path)
+        self.index = CollectionIndex(':memory:')
+        self.pool = StubExifTool()
+        self.src = join(test_data_path, 'src', test_original)
+        im = ImageBag(
+            self.paths[0], auto_make=True, exiftool=self.pool,
+            index=self.index, dedup='hardlink')
+        im.accession(self.src)
+
+    def tearDown(self):
+        self.index.close()
+        for path in self.paths:
+            if exists(path):
+                rmtree(path)
+
+    def _duplicate(self, mode: str) -> ImageBag:
+        im = ImageBag(
+            self.paths[1], auto_make=True, exiftool=self.pool,
+            index=self.index, dedup=mode)
+        im.accession(self.src)
+        return im
+
+    def test_first_accession(self):
+        assert_equal(self.pool.calls, 1)
+        bag = Bag(self.paths[0])
+        assert_equal(
+            bag.info['Original-Sha256'],
+            bag.entries['data/{}'.format(test_original)]['sha256'])
+        assert_equal(
+            self.index.find_original(bag.info['Original-Sha256']),
+            self.paths[0])
+
+    def test_hardlink(self):
+        im = self._duplicate('hardlink')
+        assert_equal(self.pool.calls, 1)
+        assert_equal(
+            im.components['original']['source_bag'], self.paths[0])
+        for fn in (test_original, 'master.tif'):
+            assert_equal(
+                stat(join(self.paths[0], 'data', fn)).st_ino,
+                stat(join(self.paths[1], 'data', fn)).st_ino)
+        assert_true(Bag(self.paths[1]).validate())
+        assert_equal(
+            self.index.find_original(
+                Bag(self.paths[1]).info['Original-Sha256']),
+            self.paths[0])
+
+    def test_reflink(self):
+        """Reflinks fall back to copies where they are not supported."""
+        self._duplicate('reflink')
+        assert_true(Bag(self.paths[1]).validate())
+        assert_equal(
+            sorted(listdir(join(self.paths[1], 'data'))),
+            [test_original, 'master.tif'])
+
+    def test_pointer(self):
+        self._duplicate('pointer')
+        bag = Bag(self.paths[1])
+        assert_true(bag.validate())
+        assert_equal(listdir(join(self.paths[1], 'data')), [])
+        assert_equal(bag.info['Original-Source-Bag'], self.paths[0])
+
+    def test_skip(self):
+        """A skipped duplicate leaves no bag behind."""
+        assert_raises(DuplicateOriginal, self._duplicate, 'skip')
+        assert_false(exists(self.paths[1]))
+
+    @raises(ValueError)
+    def test_dedup_needs_index(self):
+        ImageBag(self.paths[1], auto_make=True, dedup='skip')
+
+    def test_near_duplicates(self):
+        """A re-encoded, resized copy is reported as a near duplicate."""
+        resized = self.paths[1] + '.jpg'
+        with Image.open(self.src) as src:
+            src.resize((1008, 756)).save(resized, quality=50)
+        im = ImageBag(
+            self.paths[0] + '-2', auto_make=True, exiftool=self.pool,
+            index=self.index, perceptual_hash='dhash')
+        im.accession(self.src)
+        im = ImageBag(
+            self.paths[1], auto_make=True, exiftool=self.pool,
+            index=self.index, perceptual_hash='dhash')
+        try:
+            im.accession(resized)
+        finally:
+            rmtree(self.paths[0] + '-2')
+            remove(resized)
+        assert_equal(
+            [path for distance, path in im.near_duplicates],
+            [self.paths[0] + '-2'])
+        assert_true(
+            Bag(self.paths[1]).info['Original-Perceptual-Hash'].startswith(
+                'dhash:'))
+
+
+class Crash(Exception):
+    pass
+
+
+def crash(*args, **kwargs):
+    raise Crash()
+
+
+class Test_Resume(TestCase):
+
+    def setUp(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+        self.src = join(test_data_path, 'src', test_original)
+        self.pool = StubExifTool()
+        im = ImageBag(test_bag_path, auto_make=True, exiftool=self.pool)
+        generate_master = images.generate_master
+        images.generate_master = crash
+        try:
+            im.accession(self.src)
+        except Crash:
+            pass
+        finally:
+            images.generate_master = generate_master
+
+    def tearDown(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+
+    def test_interrupted(self):
+        """An interrupted accession leaves its journal, not partial files."""
+        assert_equal(accession_in_progress(test_bag_path), realpath(self.src))
+        im = ImageBag(test_bag_path)
+        assert_equal(im.journal['steps'], ['original', 'metadata'])
+        assert_equal(listdir(join(test_bag_path, 'data')), [test_original])
+        assert_true(
+            (('data/' + test_original) in im.digests.entries))
+        bag = Bag(test_bag_path)
+        assert_false(any(p.startswith('.accession') for p in bag.entries))
+        assert_true(bag.validate())
+
+    def test_resume(self):
+        """Resuming neither copies, hashes nor describes the original again."""
+        copy_and_hash = images.copy_and_hash
+        images.copy_and_hash = crash
+        try:
+            im = ImageBag(test_bag_path, exiftool=self.pool)
+            im.accession(self.src)
+        finally:
+            images.copy_and_hash = copy_and_hash
+        assert_equal(self.pool.calls, 1)
+        assert_equal(
+            im.digests.bytes_hashed, stat(test_master_path).st_size)
+        assert_equal(im.journal, None)
+        assert_false(exists(join(test_bag_path, '.accession')))
+        assert_equal(accession_in_progress(test_bag_path), None)
+        assert_true(Bag(test_bag_path).validate())
+
+    @raises(ValueError)
+    def test_resume_other_original(self):
+        im = ImageBag(test_bag_path, exiftool=self.pool)
+        im.accession(join(test_data_path, 'src', 'other.jpg'))
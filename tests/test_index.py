@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the collection index"""
+
+import logging
+from moondog.images import ImageBag
+from moondog.index import CollectionIndex
+from moondog.metadata import DescriptiveMetadata
+from nose.tools import assert_equal, assert_false, assert_true
+from os.path import abspath, exists, join, realpath
+from shutil import rmtree
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_root_path = join(test_data_path, 'collection')
+
+
+def _make_bag(name: str, keywords: list, photographer: str) -> str:
+    path = join(test_root_path, name)
+    im = ImageBag(path, auto_make=True)
+    im.components['original'] = {'filename': '{}.jpg'.format(name)}
+    im._write_metadata('descriptive.json', DescriptiveMetadata(
+        agents=[{'names': [{'full_name': photographer}]}],
+        keywords=[{'value': k} for k in keywords],
+        titles=[{'title_val': 'Picture of {}'.format(name)}]).get_dict())
+    im._update()
+    return path
+
+
+class Test_CollectionIndex(TestCase):
+
+    def setUp(self):
+        if exists(test_root_path):
+            rmtree(test_root_path)
+        self.cotton = _make_bag('cotton', ['cotton', 'Alabama'], 'Tom Elliott')
+        self.moon = _make_bag('moon', ['moon'], 'Jane Doe')
+
+    def tearDown(self):
+        if exists(test_root_path):
+            rmtree(test_root_path)
+
+    def test_update_and_lookup(self):
+        with CollectionIndex(':memory:') as index:
+            assert_equal(index.update(test_root_path), (2, 0))
+            assert_equal(len(index), 2)
+            assert_equal(index.find_keyword('alabama'), [self.cotton])
+            assert_equal(index.find_agent('jane doe'), [self.moon])
+            assert_equal(
+                sorted(index.search('picture')), [self.cotton, self.moon])
+            assert_equal(index.search('titles:moon'), [self.moon])
+            assert_equal(index.search('"cotton.jpg"'), [self.cotton])
+
+    def test_incremental(self):
+        """Unchanged bags are skipped and removed bags are dropped."""
+        with CollectionIndex(':memory:') as index:
+            index.update(test_root_path)
+            assert_equal(index.update(test_root_path), (0, 0))
+            assert_false(index.add_bag(self.cotton))
+            assert_true(index.add_bag(self.cotton, force=True))
+            assert_equal(len(index), 2)
+            assert_equal(index.find_keyword('cotton'), [self.cotton])
+            rmtree(self.moon)
+            assert_equal(index.update(test_root_path), (0, 1))
+            assert_equal(index.find_agent('Jane Doe'), [])
+            assert_equal(index.search('moon'), [])
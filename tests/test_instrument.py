@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for timing spans"""
+
+import json
+import logging
+from moondog.images import ImageBag
+from moondog.instrument import (JSONLinesRecorder, NULL_SPAN,
+                                PrometheusRecorder, recording, span)
+from nose.tools import assert_equal, assert_true, raises
+from os import makedirs
+from os.path import abspath, exists, join, realpath
+from shutil import rmtree
+from tests.stubs import StubExifTool
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_dir = join(test_data_path, 'instrument')
+test_original = join(test_data_path, 'src', 'IMG_4107.JPG')
+
+
+class Test_Spans(TestCase):
+
+    def setUp(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+        makedirs(test_dir)
+
+    def tearDown(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+
+    def test_disabled(self):
+        """Without a recorder, span() is a shared no-op."""
+        with span('copy', bag='x') as s:
+            s.bytes = 10
+        assert_true(s is NULL_SPAN)
+        assert_equal(NULL_SPAN.bytes, 0)
+
+    def test_record(self):
+        records = []
+        with recording(records.append):
+            with span('copy', bag='x') as s:
+                s.bytes = 10
+        with span('copy'):
+            pass
+        assert_equal(len(records), 1)
+        r = records[0]
+        assert_equal(r['name'], 'copy')
+        assert_equal(r['labels'], {'bag': 'x'})
+        assert_equal(r['bytes'], 10)
+        assert_equal(r['error'], None)
+        assert_true(r['seconds'] >= 0.0)
+        assert_true(r['process_peak_rss'] > 0)
+
+    @raises(KeyError)
+    def test_error(self):
+        """Exceptions are recorded and still raised."""
+        records = []
+        try:
+            with recording(records.append):
+                with span('copy'):
+                    raise KeyError('x')
+        finally:
+            assert_equal(records[0]['error'], 'KeyError')
+
+    def test_jsonl(self):
+        path = join(test_dir, 'spans.jsonl')
+        with JSONLinesRecorder(path) as recorder, recording(recorder):
+            for i in range(3):
+                with span('encode') as s:
+                    s.bytes = i
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        assert_equal([r['bytes'] for r in lines], [0, 1, 2])
+
+    def test_prometheus(self):
+        recorder = PrometheusRecorder()
+        with recording(recorder):
+            for i in range(2):
+                with span('decode') as s:
+                    s.bytes = 100
+        text = recorder.text()
+        assert_true('moondog_span_count_total{span="decode"} 2\n' in text)
+        assert_true('moondog_span_bytes_total{span="decode"} 200\n' in text)
+        assert_true('# TYPE moondog_process_peak_rss_bytes gauge\n' in text)
+        recorder.write(join(test_dir, 'moondog.prom'))
+        with open(join(test_dir, 'moondog.prom'), 'r') as f:
+            assert_equal(f.read(), text)
+
+    def test_accession_spans(self):
+        """Accession reports each step of the hot path."""
+        records = []
+        im = ImageBag(
+            join(test_dir, 'bag'), auto_make=True, exiftool=StubExifTool())
+        with recording(records.append):
+            im.accession(test_original)
+        names = {r['name'] for r in records}
+        for name in ('original', 'metadata', 'master', 'copy', 'exiftool',
+                     'xmp', 'generate_master', 'decode', 'encode', 'update'):
+            assert_true(name in names, name)
+        copy = [r for r in records if r['name'] == 'copy'][0]
+        assert_equal(copy['labels'], {'bag': im.path})
+        assert_true(copy['bytes'] > 0)
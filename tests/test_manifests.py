@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for incremental bag manifests"""
+
+from bagit import Bag
+import logging
+from moondog.images import ImageBag
+from moondog.manifests import copy_and_hash, hash_file, LazyBag
+from nose.tools import assert_equal, assert_false, assert_true
+from os import makedirs
+from os.path import abspath, exists, getmtime, getsize, join, realpath
+from shutil import copy2, rmtree
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_bag_path = join(test_data_path, 'foo')
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+
+
+class Test_Manifests(TestCase):
+
+    def setUp(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+
+    def tearDown(self):
+        if exists(test_bag_path):
+            rmtree(test_bag_path)
+
+    def test_hash_file(self):
+        d = hash_file(test_src_path, ['md5', 'sha256'])
+        assert_equal(sorted(d.keys()), ['md5', 'sha256'])
+        assert_equal(len(d['sha256']), 64)
+
+    def test_copy_and_hash(self):
+        """Copying yields the same digests as hashing the copy."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        target = join(test_bag_path, 'data', 'IMG_4107.JPG')
+        for block_size in [4096, 8 * 1024 * 1024]:
+            digests = copy_and_hash(
+                test_src_path, target, ['md5', 'sha256', 'sha512'],
+                fsync=True, block_size=block_size)
+            assert_equal(
+                digests, hash_file(target, ['md5', 'sha256', 'sha512']))
+        assert_equal(getmtime(target), getmtime(test_src_path))
+        assert_equal(copy_and_hash(test_src_path, target, []), {})
+        del im
+
+    def test_recorded_digests_not_rehashed(self):
+        im = ImageBag(test_bag_path, auto_make=True)
+        target = join(test_bag_path, 'data', 'IMG_4107.JPG')
+        im.digests.record(
+            'data/IMG_4107.JPG',
+            copy_and_hash(test_src_path, target, im.bag.algorithms))
+        im._update(manifests=True)
+        assert_equal(im.digests.bytes_hashed, 0)
+        assert_true(Bag(test_bag_path).validate())
+
+    def test_incremental_update(self):
+        """Unchanged payload is not rehashed and the bag stays valid."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        im.components['original'] = {'filename': 'IMG_4107.JPG'}
+        copy2(test_src_path, join(test_bag_path, 'data', 'IMG_4107.JPG'))
+        im._update(manifests=True)
+        hashed = im.digests.bytes_hashed
+        assert_equal(hashed, getsize(test_src_path))
+        im._generate_master()
+        assert_equal(
+            im.digests.bytes_hashed - hashed,
+            getsize(join(test_bag_path, 'data', 'master.tif')))
+        bag = Bag(test_bag_path)
+        assert_true(bag.validate())
+        assert_equal(
+            sorted(bag.payload_entries().keys()),
+            ['data/IMG_4107.JPG', 'data/master.tif'])
+        assert_equal(
+            bag.info['Payload-Oxum'],
+            '{}.2'.format(
+                getsize(test_src_path)
+                + getsize(join(test_bag_path, 'data', 'master.tif'))))
+
+    def test_lazy_bag(self):
+        """A lazy bag parses its manifests only when they are needed."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        im.components['original'] = {'filename': 'IMG_4107.JPG'}
+        copy2(test_src_path, join(test_bag_path, 'data', 'IMG_4107.JPG'))
+        im._update(manifests=True)
+        im = ImageBag(test_bag_path, lazy=True)
+        assert_true(isinstance(im.bag, LazyBag))
+        assert_false(im.bag.manifests_loaded)
+        assert_equal(im.bag.algorithms, Bag(test_bag_path).algorithms)
+        assert_equal(
+            im.components, {'original': {'filename': 'IMG_4107.JPG'}})
+        assert_equal(im.bag.info['Original-Filename'], 'IMG_4107.JPG')
+        assert_false(im.bag.manifests_loaded)
+        assert_true(im.bag.validate())
+        assert_true(im.bag.manifests_loaded)
+        assert_equal(im.bag.entries, Bag(test_bag_path).entries)
+
+    def test_lazy_bag_save(self):
+        """Saving without new manifests loads the existing ones first."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        im.components['original'] = {'filename': 'IMG_4107.JPG'}
+        copy2(test_src_path, join(test_bag_path, 'data', 'IMG_4107.JPG'))
+        im._update(manifests=True)
+        im = ImageBag(test_bag_path, lazy=True)
+        im.bag.info['Original-Note'] = 'lazy'
+        im._update()
+        assert_true(Bag(test_bag_path).validate())
+        im = ImageBag(test_bag_path, lazy=True)
+        im._update(manifests=True)
+        assert_equal(im.digests.bytes_hashed, 0)
+        assert_true(Bag(test_bag_path).validate())
+
+    def test_reopened_bag_not_rehashed(self):
+        """A reopened bag takes its digests from its manifests."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        im.components['original'] = {'filename': 'IMG_4107.JPG'}
+        copy2(test_src_path, join(test_bag_path, 'data', 'IMG_4107.JPG'))
+        im._update(manifests=True)
+        im = ImageBag(test_bag_path)
+        im._generate_master()
+        assert_equal(
+            im.digests.bytes_hashed,
+            getsize(join(test_bag_path, 'data', 'master.tif')))
+        assert_true(Bag(test_bag_path).validate())
+
+    def test_changed_oxum_rehashed(self):
+        """Manifests are not trusted once the payload no longer matches."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        im.components['original'] = {'filename': 'IMG_4107.JPG'}
+        target = join(test_bag_path, 'data', 'IMG_4107.JPG')
+        copy2(test_src_path, target)
+        im._update(manifests=True)
+        with open(target, 'ab') as f:
+            f.write(b'changed')
+        im = ImageBag(test_bag_path)
+        im._update(manifests=True)
+        assert_equal(im.digests.bytes_hashed, getsize(target))
+        assert_true(Bag(test_bag_path).validate())
+
+    def test_tag_files(self):
+        """Stray temporary files are left out; odd names are encoded."""
+        im = ImageBag(test_bag_path, auto_make=True)
+        with open(join(test_bag_path, 'bag-info.txt.tmp'), 'w') as f:
+            f.write('interrupted')
+        makedirs(join(test_bag_path, 'metadata'))
+        with open(join(test_bag_path, 'metadata', 'a\nb.json'), 'w') as f:
+            f.write('{}')
+        im._update(manifests=True)
+        with open(join(test_bag_path, 'tagmanifest-sha256.txt')) as f:
+            tagmanifest = f.read()
+        assert_true('metadata/a%0Ab.json\n' in tagmanifest)
+        assert_false('.tmp' in tagmanifest)
+        assert_true(Bag(test_bag_path).validate())
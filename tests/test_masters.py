@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for master TIFF generation"""
+
+import logging
+from moondog.color import prophoto_profile
+from moondog.masters import generate_master, numpy, tifffile
+from nose.tools import assert_equal, assert_true, raises
+from os import makedirs
+from os.path import abspath, exists, join, realpath
+from PIL import Image
+from shutil import rmtree
+from unittest import skipIf, TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+test_master_dir = join(test_data_path, 'masters')
+
+
+class Test_Masters(TestCase):
+
+    def setUp(self):
+        if exists(test_master_dir):
+            rmtree(test_master_dir)
+        makedirs(test_master_dir)
+
+    def tearDown(self):
+        if exists(test_master_dir):
+            rmtree(test_master_dir)
+
+    def test_master_in_memory(self):
+        dst = join(test_master_dir, 'master.tif')
+        generate_master(test_src_path, dst)
+        with Image.open(test_src_path) as orig, Image.open(dst) as master:
+            assert_equal(master.format, 'TIFF')
+            assert_equal(master.size, orig.size)
+            assert_equal(master.mode, orig.mode)
+            assert_equal(
+                master.info.get('icc_profile'), orig.info.get('icc_profile'))
+
+    @raises(ValueError)
+    def test_master_bad_compression(self):
+        generate_master(
+            test_src_path, join(test_master_dir, 'master.tif'),
+            compression='gzip')
+
+    def test_master_jpeg_over_limit(self):
+        """Formats other than TIFF are decoded in full, with a warning."""
+        dst = join(test_master_dir, 'master.tif')
+        with self.assertLogs('moondog.masters', logging.WARNING):
+            generate_master(test_src_path, dst, memory_limit=1024)
+        with Image.open(test_src_path) as orig, Image.open(dst) as master:
+            assert_equal(master.size, orig.size)
+
+    @skipIf(tifffile is None, 'tifffile is not installed')
+    def test_master_above_pixel_limit(self):
+        """TIFFs over Pillow's decompression bomb limit are still tiled.
+
+        A full-size scan (14000 x 14000 is 196 Mpx) would take a while to
+        write here, so Pillow's limit is lowered instead.
+        """
+        src = join(test_master_dir, 'scan.tif')
+        dst = join(test_master_dir, 'master.tif')
+        data = numpy.arange(400 * 300, dtype=numpy.uint8).reshape(400, 300)
+        tifffile.imwrite(src, data, tile=(64, 64))
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 400 * 300 // 4
+        try:
+            generate_master(src, dst, memory_limit=1024, tile_size=64)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+        with tifffile.TiffFile(dst) as tif:
+            assert_true(tif.pages[0].is_tiled)
+            assert_true((tif.pages[0].asarray() == data).all())
+
+    @skipIf(tifffile is None, 'tifffile is not installed')
+    def test_master_tiled_from_16bit_tiff(self):
+        """16-bit RGB and the ICC profile survive the tiled path."""
+        src = join(test_master_dir, 'scan.tif')
+        dst = join(test_master_dir, 'master.tif')
+        data = numpy.arange(300 * 200 * 3, dtype=numpy.uint16).reshape(
+            300, 200, 3)
+        tifffile.imwrite(
+            src, data, photometric='rgb', compression='lzw',
+            iccprofile=b'not really a profile')
+        for memory_limit, tiled in [(0, True), (1024 * 1024, False)]:
+            generate_master(
+                src, dst, compression='zstd', memory_limit=memory_limit,
+                tile_size=64)
+            with tifffile.TiffFile(dst) as tif:
+                page = tif.pages[0]
+                assert_equal(page.is_tiled, tiled)
+                assert_equal(page.dtype, numpy.uint16)
+                assert_equal(page.iccprofile, b'not really a profile')
+                assert_true((page.asarray() == data).all())
+
+    def test_master_working_profile(self):
+        dst = join(test_master_dir, 'master.tif')
+        generate_master(
+            test_src_path, dst, working_profile=prophoto_profile())
+        with Image.open(dst) as master:
+            assert_equal(master.info['icc_profile'], prophoto_profile())
+
+    @skipIf(tifffile is None, 'tifffile is not installed')
+    def test_master_tiled_working_profile(self):
+        """Tiles are converted one at a time on the streaming path."""
+        src = join(test_master_dir, 'scan.tif')
+        small = join(test_master_dir, 'small.tif')
+        tiled = join(test_master_dir, 'tiled.tif')
+        with Image.open(test_src_path) as im:
+            im.resize((300, 200)).save(src)
+        generate_master(src, small, working_profile=prophoto_profile())
+        generate_master(
+            src, tiled, memory_limit=0, tile_size=64,
+            working_profile=prophoto_profile())
+        with tifffile.TiffFile(tiled) as tif:
+            page = tif.pages[0]
+            assert_true(page.is_tiled)
+            assert_equal(page.iccprofile, prophoto_profile())
+            data = page.asarray()
+        with Image.open(small) as im:
+            assert_true((data == numpy.asarray(im)).all())
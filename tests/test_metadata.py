@@ -4,12 +4,20 @@
 
 import json
 from libxmp import XMPFiles
+from libxmp.consts import (XMP_NS_DC, XMP_NS_IPTCCore, XMP_NS_Photoshop,
+                           XMP_NS_XMP_Rights)
 import logging
-from moondog.metadata import (Agent, LanguageAware, Name, DescriptiveMetadata,
-                              NameType, RoleTerm, Title, TitleType)
-from nose.tools import assert_dict_equal, assert_equal, assert_false, assert_true, raises
+from moondog import metadata
+from moondog.metadata import (Agent, canonical_language_tag, Copyright,
+                              Description, DescriptiveMetadata, GetDict,
+                              invalid_uris, Keyword, LanguageAware, License,
+                              Name, NameType, RoleTerm, Title, TitleType,
+                              valid_uri)
+from nose.tools import (assert_dict_equal, assert_equal, assert_false,
+                        assert_true, raises)
 from os import remove
 from os.path import abspath, join, realpath
+import pickle
 from unittest import TestCase
 
 logger = logging.getLogger(__name__)
@@ -53,6 +61,21 @@ class Test_Metadata(TestCase):
     def test_languageaware_bad(self):
         LanguageAware(lang="bad_apples")
 
+    def test_languageaware_canonical(self):
+        """Tags are canonicalized and validated once per distinct tag."""
+        assert_equal(LanguageAware(lang='EN-us').lang, 'en-US')
+        hits = canonical_language_tag.cache_info().hits
+        LanguageAware(lang='EN-us')
+        assert_equal(canonical_language_tag.cache_info().hits, hits + 1)
+
+    def test_languageaware_bad_message(self):
+        try:
+            LanguageAware(lang='bad_apples')
+        except ValueError as e:
+            assert_equal(str(e), 'Invalid language tag: "bad_apples"')
+        else:
+            raise AssertionError('expected ValueError')
+
     def test_name(self):
         """Test name creation"""
         d = {
@@ -107,6 +130,46 @@ class Test_Metadata(TestCase):
         a = Agent(names, uris=['pickles!'])
         del a
 
+    def test_valid_uri(self):
+        assert_true(valid_uri('http://vocab.getty.edu/aat/300014067'))
+        assert_true(valid_uri('https://www.wikidata.org/entity/Q11451'))
+        assert_true(valid_uri('https://example.org/thesaurus?term=1'))
+        assert_false(valid_uri('http://vocab.getty.edu/aat/300014067 x'))
+        assert_false(valid_uri('pickles!'))
+
+    def test_valid_uri_authority(self):
+        """Known authority URIs never reach validators.url."""
+        calls = []
+
+        def fake_url(uri):
+            calls.append(uri)
+            return True
+
+        valid_uri.cache_clear()
+        real_url = metadata.url
+        metadata.url = fake_url
+        try:
+            assert_true(valid_uri('http://vocab.getty.edu/aat/300014067'))
+            assert_true(valid_uri('https://orcid.org/0000-0002-1825-0097'))
+            assert_equal(calls, [])
+            valid_uri('https://example.org/thesaurus?term=1')
+            assert_equal(calls, ['https://example.org/thesaurus?term=1'])
+        finally:
+            metadata.url = real_url
+            valid_uri.cache_clear()
+
+    def test_invalid_uris(self):
+        uris = [
+            'http://id.loc.gov/authorities/subjects/sh85074443',
+            'pickles!',
+            'http://id.loc.gov/authorities/subjects/sh85074443',
+            'no soup']
+        assert_equal(invalid_uris(uris), ['pickles!', 'no soup'])
+
+    @raises(ValueError)
+    def test_keyword_bad_uri(self):
+        Keyword('cotton', uri='http://vocab.getty.edu/ aat')
+
     def test_title(self):
         """Test title"""
         d = {
@@ -202,6 +265,69 @@ class Test_Metadata(TestCase):
                 ]
             })
 
+    def test_get_dict_all_classes(self):
+        """Every metadata class serializes, including None values."""
+        m = DescriptiveMetadata(
+            descriptions=[Description('Cotton by a road', lang='en')],
+            keywords=[
+                {'value': 'cotton'},
+                {'value': 'Alabama',
+                 'uri': 'http://vocab.getty.edu/tgn/7007689'}])
+        m.copyright.append(Copyright(
+            statement='Copyright 2017 Tom Elliott', years='2017',
+            holder=Agent(names=[Name('Tom Elliott')])))
+        d = m.get_dict()
+        assert_equal(
+            d['descriptions'],
+            [{'value': 'Cotton by a road', 'sort_val': 'cottonbyaroad',
+              'lang': 'en'}])
+        assert_equal(
+            d['keywords'][0],
+            {'value': 'cotton', 'uri': None, 'sort_val': 'cotton',
+             'lang': 'und'})
+        assert_equal(
+            d['keywords'][1]['uri'], 'http://vocab.getty.edu/tgn/7007689')
+        assert_equal(d['copyright'][0]['years'], '2017')
+        assert_equal(
+            d['copyright'][0]['holder']['names'][0]['full_name'],
+            'Tom Elliott')
+        assert_equal(
+            License(title='CC BY 4.0').get_dict(),
+            {'title': 'CC BY 4.0', 'url': None, 'short_title': None})
+
+    def test_get_dict_introspected(self):
+        """Undeclared subclasses are introspected from their attributes."""
+        class Thing(GetDict):
+            def __init__(self):
+                self.role = RoleTerm.PHOTOGRAPHER
+                self.titles = [Title('Moontown')]
+                self._private = 'hidden'
+        d = Thing().get_dict()
+        assert_equal(sorted(d.keys()), ['role', 'titles'])
+        assert_equal(d['role'], 'photographer')
+
+    @raises(NotImplementedError)
+    def test_get_dict_unsupported(self):
+        class Thing(GetDict):
+            _fields = ('value',)
+
+            def __init__(self):
+                self.value = object()
+        Thing().get_dict()
+
+    def test_compact_value_objects(self):
+        """Value objects carry no __dict__ and share repeated strings."""
+        a = Keyword(''.join(['cot', 'ton']), lang='en')
+        b = Keyword(''.join(['cott', 'on']), lang='en')
+        for o in [a, Name('Tom Elliott'), Title('Moontown'),
+                  Description('Cotton'), Agent(names=[Name('Tom')])]:
+            assert_false(hasattr(o, '__dict__'))
+        assert_true(a.value is b.value)
+        assert_true(a.sort_val is b.sort_val)
+        c = pickle.loads(pickle.dumps(a))
+        assert_equal(c.get_dict(), a.get_dict())
+        assert_false(a == b)
+
     def test_descriptive_metadata_write_json(self):
         m = DescriptiveMetadata(
             agents=[Agent(names=[Name('Tom Elliott')])],
@@ -256,3 +382,82 @@ class Test_Metadata(TestCase):
             [k.value for k in sorted(m.keywords, key=lambda k: k.sort_val)],
             ['Alabama', 'cotton'])
 
+    def test_parse_xmp_properties(self):
+        """XMP properties are dispatched by namespace and term."""
+        properties = [
+            (XMP_NS_DC, '', ''),
+            (XMP_NS_DC, 'dc:title', ''),
+            (XMP_NS_DC, 'dc:title[1]', 'Moontown Cotton'),
+            (XMP_NS_DC, 'dc:title[1]/?xml:lang', 'x-default'),
+            (XMP_NS_DC, 'dc:creator', ''),
+            (XMP_NS_DC, 'dc:creator[1]', 'Tom Elliott'),
+            (XMP_NS_DC, 'dc:description', ''),
+            (XMP_NS_DC, 'dc:description[1]', 'Cotton by a gravel road.'),
+            (XMP_NS_DC, 'dc:description[1]/?xml:lang', 'en'),
+            (XMP_NS_DC, 'dc:subject', ''),
+            (XMP_NS_DC, 'dc:subject[1]', 'cotton'),
+            (XMP_NS_DC, 'dc:subject[2]', 'Alabama'),
+            (XMP_NS_DC, 'dc:rights', ''),
+            (XMP_NS_DC, 'dc:rights[1]', 'Copyright 2017 Tom Elliott'),
+            (XMP_NS_DC, 'dc:rights[1]/?xml:lang', 'x-default'),
+            (XMP_NS_DC, 'dc:format', 'image/png'),
+            (XMP_NS_Photoshop, 'photoshop:Headline', 'Cotton'),
+            (XMP_NS_Photoshop, 'photoshop:City', 'Moontown'),
+            (XMP_NS_IPTCCore, 'Iptc4xmpCore:AltTextAccessibility', ''),
+            (XMP_NS_IPTCCore, 'Iptc4xmpCore:AltTextAccessibility[1]',
+             'White cotton bolls'),
+            (XMP_NS_IPTCCore, 'Iptc4xmpCore:AltTextAccessibility[1]/?xml:lang',
+             'en'),
+            (XMP_NS_XMP_Rights, 'xmpRights:Owner', ''),
+            (XMP_NS_XMP_Rights, 'xmpRights:Owner[1]', 'Tom Elliott'),
+        ]
+        m = DescriptiveMetadata()
+        m.parse_xmp_properties(properties)
+        assert_equal(
+            [(t.value, t.title_type, t.lang) for t in m.titles],
+            [('Moontown Cotton', TitleType.FULL, 'und'),
+             ('Cotton', TitleType.SHORT, 'und')])
+        assert_equal(m.agents[0].names[0].full_name, 'Tom Elliott')
+        assert_equal(
+            [(d.value, d.lang) for d in m.descriptions],
+            [('Cotton by a gravel road.', 'en'), ('White cotton bolls', 'en')])
+        assert_equal([k.value for k in m.keywords], ['cotton', 'Alabama'])
+        assert_equal(m.copyright[0].years, '2017')
+        assert_equal(
+            m.copyright[1].holder.names[0].full_name, 'Tom Elliott')
+
+    def test_parse_xmp_properties_many_subjects(self):
+        """Arrays grow as their items arrive."""
+        properties = [(XMP_NS_DC, 'dc:subject', '')]
+        for i in range(1, 301):
+            properties.append(
+                (XMP_NS_DC, 'dc:subject[{}]'.format(i), 'term {}'.format(i)))
+        m = DescriptiveMetadata()
+        m.parse_xmp_properties(properties)
+        assert_equal(len(m.keywords), 300)
+        assert_equal(m.keywords[-1].value, 'term 300')
+
+    def test_parse_xmp_properties_struct_array(self):
+        """Fields of struct array items are skipped, not misparsed."""
+        properties = [
+            (XMP_NS_Photoshop, 'photoshop:Headline', 'Cotton'),
+            (XMP_NS_Photoshop, 'photoshop:TextLayers', ''),
+            (XMP_NS_Photoshop, 'photoshop:TextLayers[1]', ''),
+            (XMP_NS_Photoshop, 'photoshop:TextLayers[1]/photoshop:LayerName',
+             'Caption'),
+            (XMP_NS_Photoshop, 'photoshop:TextLayers[1]/photoshop:LayerText',
+             'Moontown'),
+            (XMP_NS_DC, 'dc:creator[1]/dc:title', 'Mr'),
+            (XMP_NS_DC, 'dc:creator[1]', 'Tom Elliott'),
+        ]
+        m = DescriptiveMetadata()
+        m.parse_xmp_properties(properties)
+        assert_equal([t.value for t in m.titles], ['Cotton'])
+        assert_equal(
+            [a.names[0].full_name for a in m.agents], ['Tom Elliott'])
+
+    @raises(RuntimeError)
+    def test_parse_xmp_properties_bad_qualifier(self):
+        m = DescriptiveMetadata()
+        m.parse_xmp_properties(
+            [(XMP_NS_DC, 'dc:subject[1]/?rdf:resource', 'x')])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for perceptual hashes and near-duplicate search"""
+
+import logging
+from moondog.index import CollectionIndex
+from moondog.phash import (format_hash, hamming, image_hash, numpy,
+                           parse_hash)
+from nose.tools import assert_equal, assert_true, raises
+from os import makedirs
+from os.path import abspath, exists, join, realpath
+from PIL import Image
+import random
+from shutil import rmtree
+from unittest import skipIf, TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src', 'IMG_4107.JPG')
+test_dir = join(test_data_path, 'phash')
+
+
+class Test_Perceptual_Hash(TestCase):
+
+    def setUp(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+        makedirs(test_dir)
+        self.resized = join(test_dir, 'resized.jpg')
+        self.other = join(test_dir, 'other.png')
+        with Image.open(test_src_path) as im:
+            im.resize((800, 600)).save(self.resized, quality=60)
+        Image.linear_gradient('L').rotate(90).save(self.other)
+
+    def tearDown(self):
+        if exists(test_dir):
+            rmtree(test_dir)
+
+    def _distances(self, algorithm: str) -> tuple:
+        hashes = [
+            parse_hash(image_hash(path, algorithm))[1]
+            for path in (test_src_path, self.resized, self.other)]
+        return hamming(hashes[0], hashes[1]), hamming(hashes[0], hashes[2])
+
+    def test_dhash(self):
+        near, far = self._distances('dhash')
+        assert_true(near <= 4)
+        assert_true(far >= 16)
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_phash(self):
+        near, far = self._distances('phash')
+        assert_true(near <= 4)
+        assert_true(far >= 16)
+
+    def test_format(self):
+        assert_equal(format_hash('dhash', 255), 'dhash:00000000000000ff')
+        assert_equal(parse_hash('dhash:00000000000000ff'), ('dhash', 255))
+
+    @raises(ValueError)
+    def test_bad_hash(self):
+        parse_hash('md5:00ff')
+
+    def test_find_similar_exact(self):
+        """Multi-index search finds exactly what a linear scan finds."""
+        rng = random.Random(4107)
+        hashes = {'/{}'.format(i): rng.getrandbits(64) for i in range(500)}
+        probe = hashes['/7']
+        for i in range(500, 550):
+            # plant near neighbours of the probe
+            bits = rng.sample(range(64), rng.randint(1, 12))
+            hashes['/{}'.format(i)] = probe ^ sum(1 << b for b in bits)
+        with CollectionIndex(':memory:') as index:
+            for path, h in hashes.items():
+                index.add(path, {
+                    'Original-Perceptual-Hash': format_hash('dhash', h)})
+            for max_distance in (0, 3, 8, 12):
+                expected = sorted(
+                    (hamming(probe, h), path) for path, h in hashes.items()
+                    if hamming(probe, h) <= max_distance)
+                assert_equal(
+                    index.find_similar(
+                        format_hash('dhash', probe), max_distance),
+                    expected)
+
+    def test_find_similar(self):
+        with CollectionIndex(':memory:') as index:
+            index.add('/a', {'Original-Perceptual-Hash': image_hash(
+                test_src_path)})
+            index.add('/b', {'Original-Perceptual-Hash': image_hash(
+                self.other)})
+            h = image_hash(self.resized)
+            assert_equal(
+                [path for distance, path in index.find_similar(h)], ['/a'])
+            index.add('/c', {'Original-Perceptual-Hash': h})
+            assert_equal(
+                sorted(path for distance, path in index.find_similar(h)),
+                ['/a', '/c'])
+            index.remove('/c')
+            assert_equal(len(index.find_similar(h)), 1)
+            assert_equal(index.find_similar(
+                'phash:0000000000000000'), [])
+
+    def test_find_similar_shared(self):
+        """Hashes added through another connection are found at once."""
+        path = join(test_dir, 'index.sqlite')
+        h = 0x8f3c5a5a0ff01234
+        with CollectionIndex(path) as reader, CollectionIndex(path) as writer:
+            writer.add('/a', {'Original-Perceptual-Hash': format_hash(
+                'dhash', h)})
+            assert_equal(
+                reader.find_similar(format_hash('dhash', h ^ 0b101)),
+                [(2, '/a')])
+            writer.add('/b', {'Original-Perceptual-Hash': format_hash(
+                'dhash', h ^ (1 << 63))})
+            assert_equal(
+                reader.find_similar(format_hash('dhash', h)),
+                [(0, '/a'), (1, '/b')])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the accession service"""
+
+import asyncio
+import logging
+from moondog.images import ImageBag
+from moondog.index import CollectionIndex
+from moondog.service import AccessionService
+from nose.tools import assert_equal, assert_false, assert_true, raises
+from os import listdir, makedirs
+from os.path import abspath, exists, join, realpath, relpath
+from shutil import copy2, rmtree
+from tests.stubs import StubExifTool
+from unittest import TestCase
+
+logger = logging.getLogger(__name__)
+test_data_path = abspath(realpath(join('tests', 'data')))
+test_src_path = join(test_data_path, 'src')
+test_service_path = join(test_data_path, 'service')
+test_original = 'IMG_4107.JPG'
+
+
+class Test_Service(TestCase):
+
+    def setUp(self):
+        if exists(test_service_path):
+            rmtree(test_service_path)
+        makedirs(join(test_service_path, 'in'))
+
+    def tearDown(self):
+        if exists(test_service_path):
+            rmtree(test_service_path)
+
+    def _originals(self, n: int) -> list:
+        paths = []
+        for i in range(n):
+            path = join(test_service_path, 'in', 'IMG_{}.JPG'.format(i))
+            copy2(join(test_src_path, test_original), path)
+            paths.append(path)
+        return paths
+
+    def test_pipeline(self):
+        """More originals than queue slots all come through every stage."""
+        pool = StubExifTool()
+        service = AccessionService(
+            join(test_service_path, 'out'),
+            index=join(test_service_path, 'index.sqlite'), queue_size=1,
+            io_workers=2, exif_workers=1, cpu_workers=1, exiftool=pool)
+
+        async def run():
+            for path in self._originals(4):
+                await service.submit(path)
+            await service.close()
+        asyncio.run(run())
+        assert_equal(service.failures, [])
+        assert_equal(len(service.accessioned), 4)
+        assert_equal(pool.calls, 4)
+        stats = service.stats()
+        for name in ('copy', 'metadata', 'master'):
+            assert_equal(stats[name]['processed'], 4)
+            assert_equal(stats[name]['depth'], 0)
+            assert_equal(stats[name]['capacity'], 1)
+        for result in service.accessioned:
+            im = ImageBag(result['bag'])
+            assert_equal(im.components['master']['filename'], 'master.tif')
+            assert_true(im.bag.is_valid())
+        with CollectionIndex(join(test_service_path, 'index.sqlite')) as ix:
+            assert_equal(len(ix), 4)
+
+    def test_failure_isolated(self):
+        """A broken original fails its stage without stopping the rest."""
+        originals = self._originals(1)
+        broken = join(test_service_path, 'in', 'broken.jpg')
+        with open(broken, 'w') as f:
+            f.write('not an image')
+        service = AccessionService(
+            join(test_service_path, 'out'), cpu_workers=1,
+            exiftool=StubExifTool())
+
+        async def run():
+            await service.submit(broken)
+            await service.submit(originals[0])
+            await service.close()
+        asyncio.run(run())
+        assert_equal(len(service.accessioned), 1)
+        assert_equal(len(service.failures), 1)
+        assert_equal(service.failures[0]['original'], broken)
+        assert_equal(service.failures[0]['stage'], 'master')
+
+    def test_bag_names(self):
+        """Originals with the same name get distinct bags."""
+        copy2(
+            join(test_src_path, test_original),
+            join(test_service_path, 'in', test_original))
+        service = AccessionService(
+            join(test_service_path, 'out'), cpu_workers=1,
+            exiftool=StubExifTool())
+
+        async def run():
+            await service.submit(join(test_src_path, test_original))
+            await service.submit(join(test_service_path, 'in', test_original))
+            await service.close()
+        asyncio.run(run())
+        assert_equal(
+            sorted(listdir(join(test_service_path, 'out'))),
+            ['IMG_4107', 'IMG_4107-2'])
+
+    def test_watch(self):
+        """Files in the drop folder are accessioned once and moved."""
+        originals = self._originals(2)
+        done = join(test_service_path, 'done')
+        makedirs(done)
+        with open(join(done, 'IMG_0.JPG'), 'w') as f:
+            f.write('from an earlier card')
+        service = AccessionService(
+            join(test_service_path, 'out'), cpu_workers=1,
+            done=relpath(done), exiftool=StubExifTool())
+        assert_equal(service.done, done)
+
+        async def run():
+            watcher = asyncio.ensure_future(service.watch(
+                join(test_service_path, 'in'), interval=0.05))
+            for i in range(200):
+                await asyncio.sleep(0.05)
+                if len(service.accessioned) == 2:
+                    break
+            watcher.cancel()
+            await service.close()
+        asyncio.run(run())
+        assert_equal(len(service.accessioned), 2)
+        assert_equal(listdir(join(test_service_path, 'in')), [])
+        assert_equal(
+            sorted(listdir(done)), ['IMG_0-2.JPG', 'IMG_0.JPG', 'IMG_1.JPG'])
+        with open(join(done, 'IMG_0.JPG'), 'r') as f:
+            assert_equal(f.read(), 'from an earlier card')
+        assert_false(any(exists(p) for p in originals))
+
+    def test_watch_failure(self):
+        """A file that fails is left in the folder and not retried."""
+        broken = join(test_service_path, 'in', 'broken.jpg')
+        with open(broken, 'w') as f:
+            f.write('not an image')
+        service = AccessionService(
+            join(test_service_path, 'out'), cpu_workers=1,
+            done=join(test_service_path, 'done'), exiftool=StubExifTool())
+
+        async def run():
+            watcher = asyncio.ensure_future(service.watch(
+                join(test_service_path, 'in'), interval=0.05))
+            for i in range(200):
+                await asyncio.sleep(0.05)
+                if service.failures:
+                    break
+            await asyncio.sleep(0.25)
+            watcher.cancel()
+            await service.close()
+        asyncio.run(run())
+        assert_equal(len(service.failures), 1)
+        assert_true(exists(broken))
+
+    @raises(ValueError)
+    def test_watch_requires_done(self):
+        service = AccessionService(
+            join(test_service_path, 'out'), exiftool=StubExifTool())
+        asyncio.run(service.watch(join(test_service_path, 'in')))